@@ -0,0 +1,19 @@
+"""
+ASGI config for A+ project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The request globals (lib/request_globals.py) are kept per request, so async
+views may be served by an ASGI server, e.g. ``uvicorn aplus.asgi:application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "aplus.settings")
+
+application = get_asgi_application()
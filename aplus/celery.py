@@ -1,11 +1,12 @@
 import os
 import celery
+from celery.signals import task_postrun, worker_process_shutdown, worker_shutdown
 import datetime
 from datetime import timedelta
 import logging
 from dateutil.relativedelta import relativedelta
-from time import sleep
 from random import choice
+from time import monotonic
 
 from django.conf import settings
 
@@ -17,6 +18,22 @@ app = celery.Celery('aplus')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+@task_postrun.connect
+def clear_request_globals(task=None, **kwargs): # pylint: disable=unused-argument
+    # Each task run by a worker is a request of its own, see lib.request_globals.
+    # Eagerly run tasks belong to the request that ran them.
+    if task is not None and task.request.is_eager:
+        return
+    from lib.request_globals import RequestGlobal # pylint: disable=import-outside-toplevel
+    RequestGlobal.clear_globals()
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def log_http_pool_stats(**kwargs): # pylint: disable=unused-argument
+    # The graders are called through the pooled sessions of each worker process
+    from lib import http_pool # pylint: disable=import-outside-toplevel
+    http_pool.log_stats()
+
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
     if hasattr(settings, 'SIS_ENROLL_SCHEDULE'):
@@ -26,12 +43,20 @@ def setup_periodic_tasks(sender, **kwargs):
         # Run timed check twice in timeout period, for more timely retries
         sender.add_periodic_task(settings.SUBMISSION_EXPIRY_TIMEOUT/2, retry_submissions.s(), name='retry_submissions')
 
+    # Retry the course hook posts that have failed
+    sender.add_periodic_task(settings.COURSE_HOOK_RETRY_DELAY, deliver_course_hooks.s(), name='deliver_course_hooks')
+
+    # Delete the expired submission archives
+    sender.add_periodic_task(60 * 60, delete_submission_archives.s(), name='delete_submission_archives')
+
 @app.task
 def enroll():
     """
     Traverse the currently open courses that are linked to SIS and update enrollments.
     """
-    from course.models import CourseInstance # pylint: disable=import-outside-toplevel
+    # pylint: disable=import-outside-toplevel
+    from course.models import CourseInstance
+    from course.sis_sync import enroll_from_sis_concurrently
     now = datetime.datetime.now(datetime.timezone.utc)
     # Enroll students for active courses, or those that will start in 14 days
     courses = CourseInstance.objects.filter(
@@ -39,15 +64,14 @@ def enroll():
         starting_time__lt=now + timedelta(days=14),
         sis_enroll=True,
     )
-    for i in courses:
-        i.enroll_from_sis()
-        if settings.SIS_ENROLL_DELAY:
-            sleep(settings.SIS_ENROLL_DELAY)
+    enroll_from_sis_concurrently(courses)
 
 @app.task
 def retry_submissions():
-    # pylint: disable-next=import-outside-toplevel
+    # pylint: disable=import-outside-toplevel
+    from exercise.regrade import grade_concurrently, grader_host
     from exercise.submission_models import PendingSubmission
+    from inheritance.models import as_leaf_classes
 
     # Recovery state: only send one grading request to probe the state of grader
     if not PendingSubmission.objects.is_grader_stable():
@@ -73,8 +97,20 @@ def retry_submissions():
     expiry_time = datetime.datetime.now(datetime.timezone.utc) - relativedelta(
         seconds=settings.SUBMISSION_EXPIRY_TIMEOUT
     )
-    expired = PendingSubmission.objects.filter(submission_time__lt=expiry_time)
+    expired = list(
+        PendingSubmission.objects
+        .filter(submission_time__lt=expiry_time)
+        .select_related('submission__exercise')
+    )
+    # Fetch the exercises as their own types once per type instead of per submission
+    exercises = {
+        exercise.id: exercise
+        for exercise in as_leaf_classes(pending.submission.exercise for pending in expired)
+    }
+    for pending in expired:
+        pending.submission.exercise = exercises[pending.submission.exercise_id]
 
+    retried = []
     for pending in expired:
         if pending.submission.exercise.can_regrade:
             # Do not retry submission until SUBMISSION_EXPIRY_TIMEOUT * num_retries has passed
@@ -85,8 +121,7 @@ def retry_submissions():
                 if pending.submission_time < pending_timelimit:
                     logger.info("Retrying expired submission %s (retries: %s)",
                                 pending.submission, pending.num_retries)
-                    pending.submission.exercise.grade(pending.submission)
-                    sleep(0.5)  # Delay 500 ms to avoid choking grader
+                    retried.append(pending.submission)
                 else:
                     logger.info("Not yet retrying submission %s (retries: %s)",
                                 pending.submission, pending.num_retries)
@@ -94,4 +129,61 @@ def retry_submissions():
                 logger.info("Could not grade submission %s (maximum retries exceeded).", pending.submission)
                 pending.submission.set_error()
                 pending.submission.save()
-                pending.delete()
\ No newline at end of file
+                pending.delete()
+
+    # The concurrency towards each grader adapts to how it responds
+    grade_concurrently(
+        retried,
+        lambda submission: grader_host(submission.exercise),
+        lambda submission: submission.exercise.grade(submission).is_loaded,
+    )
+
+
+@app.task
+def deliver_course_hooks():
+    """
+    Posts the queued course hook events. The events are grouped by the hook
+    URL and posted in order over the pooled connection to that host. When a
+    post fails, the rest of the events to the same URL are postponed too.
+
+    A batch may take longer to post than COURSE_HOOK_CLAIM_TIMEOUT, so the
+    claim of the events that are not posted yet is renewed when half of it
+    has passed.
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from course.models import CourseHookEvent
+
+    while True:
+        events = CourseHookEvent.objects.claim_due(settings.COURSE_HOOK_BATCH_SIZE)
+        if not events:
+            return
+        claimed = monotonic()
+        pending = {event.id: event for event in events}
+        by_url = {}
+        for event in events:
+            by_url.setdefault(event.hook.hook_url, []).append(event)
+        for url_events in by_url.values():
+            for i, event in enumerate(url_events):
+                if monotonic() - claimed > settings.COURSE_HOOK_CLAIM_TIMEOUT / 2:
+                    CourseHookEvent.objects.renew_claim(pending.values())
+                    claimed = monotonic()
+                del pending[event.id]
+                if not event.hook.post(event.data):
+                    event.postpone(failed=True)
+                    for skipped in url_events[i + 1:]:
+                        del pending[skipped.id]
+                        skipped.postpone(failed=False)
+                    break
+                event.delete()
+        if len(events) < settings.COURSE_HOOK_BATCH_SIZE:
+            return
+
+@app.task
+def delete_submission_archives():
+    """Deletes the submission archives older than SUBMISSION_ARCHIVE_EXPIRY."""
+    # pylint: disable-next=import-outside-toplevel
+    from exercise.submission_zip import delete_expired_archives
+
+    deleted = delete_expired_archives(settings.SUBMISSION_ARCHIVE_EXPIRY)
+    if deleted:
+        logger.info("Deleted %d expired submission archives", deleted)
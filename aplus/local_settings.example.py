@@ -113,6 +113,8 @@ BASE_URL = 'http://localhost:8000/' # required!
 
 # Delay in seconds between outgoing SIS enrollment requests (None for no delay)
 # SIS_ENROLL_DELAY = 15
+# How many course instances are enrolled from SIS at the same time
+# SIS_ENROLL_CONCURRENCY = 4
 
 ## Database
 #DATABASES = {
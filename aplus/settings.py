@@ -65,6 +65,17 @@ APLUS_AUTH = {
 # Expiry time for LTI 1.3 JWT tokens, in seconds
 LTI_TOKEN_LIFETIME = 3600
 
+# Points are sent to LTI 1.3 platforms (lti_tool/ags.py) by the celery worker
+# LTI_AGS_PUBLISH_DELAY seconds after grading, so that several gradings of the
+# same exercise by the same user are sent once. Failed requests are retried
+# after LTI_AGS_RETRY_DELAY * 2^retries seconds, at most LTI_AGS_RETRY_LIMIT
+# times. The access token of a platform is reused for LTI_AGS_TOKEN_LIFETIME
+# seconds.
+LTI_AGS_PUBLISH_DELAY = 10
+LTI_AGS_RETRY_DELAY = 60
+LTI_AGS_RETRY_LIMIT = 5
+LTI_AGS_TOKEN_LIFETIME = 3000
+
 # Content (may override in local_settings.py)
 #
 # Any templates can be overridden by copying into
@@ -128,6 +139,14 @@ EXCEL_CSV_DEFAULT_DELIMITER = ';'
 # Exercise loading settings
 EXERCISE_HTTP_TIMEOUT = 15
 EXERCISE_HTTP_RETRIES = (5,5,5)
+# Number of keep-alive connections kept open per host for the requests to
+# exercise services, the git manager, LTI platforms and course hooks
+# (lib/http_pool.py)
+HTTP_POOL_MAXSIZE = 10
+# BeautifulSoup tree builder used to parse the exercise and chapter pages.
+# 'html5lib' parses exactly like browsers do. 'lxml' is several times faster
+# and produces the same result for well-formed pages.
+HTML_PARSER = 'html5lib'
 EXERCISE_ERROR_SUBJECT = """A+ exercise error in {course}: {exercise}"""
 EXERCISE_ERROR_DESCRIPTION = (
     '\nAs a course teacher or technical contact you were automatically emailed by A+ about the error incident. '
@@ -268,6 +287,9 @@ SOCIAL_AUTH_USERNAME_IS_FULL_EMAIL = True
 
 # Delay in seconds between outgoing SIS enrollment requests (None for no delay)
 SIS_ENROLL_DELAY = 15
+# How many course instances are enrolled from SIS at the same time
+# (course/sis_sync.py). The requests still start SIS_ENROLL_DELAY apart.
+SIS_ENROLL_CONCURRENCY = 4
 
 ##########################################################################
 # Settings related automatic retries of unfinished grading tasks
@@ -292,6 +314,39 @@ SUBMISSION_RETRY_LIMIT = 3
 # requests in this case.
 GRADER_STABLE_THRESHOLD = 5
 
+# Grade new submissions in the background instead of in the request that
+# created them (exercise/grading.py). The submission is left in the waiting
+# state and the submission page polls for the result.
+# None: grade in the request
+# 'celery': grade in the celery workers
+# 'thread': grade in a thread pool of SUBMISSION_ASYNC_GRADING_THREADS threads
+#   in the web server process
+# Exercises that need the request for grading (LTI) are always graded in the request.
+SUBMISSION_ASYNC_GRADING = None
+SUBMISSION_ASYNC_GRADING_THREADS = 4
+
+# Regrading existing submissions (exercise/regrade.py) sends at most
+# REGRADE_MAX_CONCURRENCY concurrent grading requests to each exercise service
+# host. The concurrency starts from one, grows while the grader responds, and
+# is halved when a grading request fails or times out.
+REGRADE_MAX_CONCURRENCY = 10
+
+# Course hooks are posted by the celery worker from a queue of CourseHookEvents
+# instead of in the request that graded the submission. A failed post is
+# retried after COURSE_HOOK_RETRY_DELAY * 2^(attempts - 1) seconds until it has
+# failed COURSE_HOOK_RETRY_LIMIT times. The worker claims at most
+# COURSE_HOOK_BATCH_SIZE events at a time, and claimed events that are not
+# posted within COURSE_HOOK_CLAIM_TIMEOUT seconds are retried. The worker renews
+# the claim while it posts the batch.
+COURSE_HOOK_RETRY_DELAY = 30
+COURSE_HOOK_RETRY_LIMIT = 10
+COURSE_HOOK_BATCH_SIZE = 100
+COURSE_HOOK_CLAIM_TIMEOUT = 300
+
+# The ZIP archives of submissions built in the background are deleted from the
+# default storage after this many seconds
+SUBMISSION_ARCHIVE_EXPIRY = 24 * 60 * 60
+
 ## Celery
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -349,6 +404,7 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 10000000
 FILE_UPLOAD_PERMISSIONS = 0o644
 
 WSGI_APPLICATION = 'aplus.wsgi.application'
+ASGI_APPLICATION = 'aplus.asgi.application'
 
 
 # Database (override in local_settings.py)
@@ -365,6 +421,12 @@ DATABASES = {
     }
 }
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+# Store the JSON fields of submissions and exercises in the native JSON column
+# type of the database (jsonb in PostgreSQL) instead of text. The existing
+# columns must be converted first with `manage.py convert_json_fields`, and
+# back with `--to text` before turning this off.
+JSON_FIELDS_NATIVE = False
 ##########################################################################
 
 # Cache (override in local_settings.py)
@@ -379,6 +441,24 @@ CACHES = {
         'OPTIONS': {'MAX_SIZE': 1000000}, # simulate memcached value limit
     }
 }
+# Serialization format of the course content and points cache entries
+# (lib/cache/codecs.py): 'pickle' or 'compact'. Entries written in either
+# format can be read regardless of this setting.
+CACHE_CODEC = 'pickle'
+# Compress large cache entries with lz4 (or zlib if lz4 is not installed)
+CACHE_CODEC_COMPRESS = False
+# Size in bytes of the per-process in-memory tier in front of the shared cache
+# for the course content and points caches (lib/cache/local.py). The entries
+# are validated against a small version key in the shared cache on every read.
+# 0 disables the tier.
+CACHE_LOCAL_TIER_MAX_SIZE = 0
+# Single-flight regeneration of cache entries (lib/cache/lease.py). When
+# CACHE_LEASE_WAIT is above 0, only one process regenerates a missing entry
+# while the others wait for up to CACHE_LEASE_WAIT seconds for the new value,
+# e.g. CACHE_LEASE_WAIT = 5. CACHE_LEASE_TIMEOUT is the lifetime of the lease
+# in case the generating process dies. 0 disables leasing.
+CACHE_LEASE_WAIT = 0
+CACHE_LEASE_TIMEOUT = 10
 # The default SESSION_ENGINE is 'django.contrib.sessions.backends.db' (database)
 # Cache-based sessions require the Memcached cache backend.
 #SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
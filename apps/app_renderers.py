@@ -28,12 +28,13 @@ data required by the plugin view.
 """
 
 import logging
-import urllib.request
 
 from bs4 import BeautifulSoup
 from django.template.loader import get_template
 
+from inheritance.models import as_leaf_classes
 from lib.helpers import update_url_params
+from lib.http_pool import get as http_get
 
 
 logger = logging.getLogger("aplus.apps")
@@ -72,7 +73,7 @@ def build_plugin_renderers(plugins, # pylint: disable=too-many-arguments
         #else:
         #    raise ValueError(view_name + " is not supported for plugins.")
 
-        plugins = plugins.filter(views__contains=view_name)
+        plugins = as_leaf_classes(plugins.filter(views__contains=view_name))
 
         renderers = []
         for p in plugins:
@@ -162,8 +163,9 @@ class TabRenderer:
 
     def render(self):
         url = self._build_src()
-        opener = urllib.request.build_opener()
-        content = opener.open(url, timeout=5).read()
+        response = http_get(url, timeout=5)
+        response.raise_for_status()
+        content = response.content
 
         soup = BeautifulSoup(content)
 
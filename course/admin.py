@@ -7,6 +7,7 @@ from course.models import (
     Enrollment,
     StudentGroup,
     CourseHook,
+    CourseHookEvent,
     CourseModule,
     LearningObjectCategory,
     UserTag,
@@ -274,11 +275,22 @@ class CourseHookAdmin(admin.ModelAdmin):
     raw_id_fields = ('course_instance',)
 
 
+class CourseHookEventAdmin(admin.ModelAdmin):
+    list_display = (
+        'hook',
+        'created',
+        'next_attempt',
+        'attempts',
+    )
+    raw_id_fields = ('hook',)
+
+
 admin.site.register(Course, CourseAdmin)
 admin.site.register(CourseInstance, CourseInstanceAdmin)
 admin.site.register(Enrollment, EnrollmentAdmin)
 admin.site.register(StudentGroup, StudentGroupAdmin)
 admin.site.register(CourseHook, CourseHookAdmin)
+admin.site.register(CourseHookEvent, CourseHookEventAdmin)
 admin.site.register(CourseModule, CourseModuleAdmin)
 admin.site.register(LearningObjectCategory, LearningObjectCategoryAdmin)
 admin.site.register(UserTag, UserTagAdmin)
@@ -2,6 +2,7 @@ from django.test import override_settings
 from rest_framework.test import APIClient
 
 from course.models import CourseInstance
+from exercise.models import LearningObject
 from ..tests import CourseTestCase
 
 class CourseInstanceAPITest(CourseTestCase):
@@ -144,3 +145,24 @@ class CourseInstanceAPITest(CourseTestCase):
         t = map(lambda x: x.user.username, course.teachers)
         self.assertIn('staff', t)
         self.assertIn('newteacher', t)
+
+    def test_renumber_tree(self):
+        url = f"/api/v2/courses/{self.current_course_instance.id}/tree/renumber/"
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(url, {"course_wide": True}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        client.force_authenticate(user=self.superuser)
+        response = client.post(url, {"course_wide": True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["changed"], 2)
+        module_orders = LearningObject.objects.filter(
+            course_module=self.course_module,
+        ).values_list('order', flat=True)
+        self.assertEqual(sorted(module_orders), [1, 2])
+        self.assertEqual(LearningObject.objects.get(id=self.broken_learning_object.id).order, 3)
+
+        response = client.post(url, {"course_wide": False}, format='json')
+        self.assertEqual(response.data["changed"], 1)
+        self.assertEqual(LearningObject.objects.get(id=self.broken_learning_object.id).order, 1)
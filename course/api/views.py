@@ -15,6 +15,7 @@ from django.utils.translation import gettext_lazy as _
 
 from aplus.api import api_reverse
 from edit_course.operations.configure import configure_from_url
+from edit_course.operations.renumber import renumber_content
 from exercise.cache.content import ModuleContent, LearningObjectContent
 from lib.api.constants import REGEX_INT, REGEX_INT_ME
 from lib.api.filters import FieldValuesFilter
@@ -280,6 +281,14 @@ class CourseExerciseTreeViewSet(CourseResourceMixin,
 
     `GET /courses/<course_id>/tree/`:
         returns the tree.
+
+    `POST /courses/<course_id>/tree/renumber/`:
+        renumbers the chapters and exercises in the order of the tree and
+        returns JSON {changed: <number of renumbered learning objects>}.
+        Requires teacher privileges. Following attributes can be given:
+
+    * `course_wide`: whether to number the top level learning objects across
+      the visible modules instead of within each module
     """
 
     # To build the tree, this viewset uses the `CachedContent` class, which
@@ -298,6 +307,18 @@ class CourseExerciseTreeViewSet(CourseResourceMixin,
         response_data = { 'modules': serializer.data }
         return Response(response_data)
 
+    @action(
+        detail=False,
+        methods=["post"],
+        permission_classes=api_settings.DEFAULT_PERMISSION_CLASSES + [OnlyCourseTeacherPermission],
+    )
+    def renumber(self, request, *args, **kwargs):
+        course_wide = request.data.get("course_wide", False)
+        if isinstance(course_wide, str):
+            course_wide = course_wide.lower() in ("true", "1", "yes")
+        changed = renumber_content(self.instance, course_wide=bool(course_wide))
+        return Response({"changed": changed})
+
 
 class CourseStudentsViewSet(NestedViewSetMixin,
                             MeUserMixin,
@@ -10,6 +10,7 @@ from ..models import (
 
 class CachedStudent(CachedAbstract):
     KEY_PREFIX = "student"
+    NAMESPACE_PARAMS = 1
 
     def __init__(self, course_instance, user):
         super().__init__(course_instance, user)
@@ -37,11 +38,7 @@ post_delete.connect(invalidate_student, sender=UserTagging)
 
 
 def invalidate_students(sender, instance: UserTag, **kwargs): # pylint: disable=unused-argument
-    course = instance.course_instance
-    for student in course.students.all():
-        CachedStudent.invalidate(
-            course,
-            student.user)
+    CachedStudent.invalidate_namespace(instance.course_instance_id)
 
 
 post_save.connect(invalidate_students, sender=UserTag)
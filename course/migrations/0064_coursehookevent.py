@@ -0,0 +1,31 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import lib.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0063_courseinstance_group_work_allowed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseHookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', lib.fields.JSONField(verbose_name='LABEL_DATA')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='LABEL_CREATED')),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='LABEL_NEXT_ATTEMPT')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='LABEL_ATTEMPTS')),
+                ('hook', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='course.coursehook', verbose_name='LABEL_COURSE_HOOK')),
+            ],
+            options={
+                'verbose_name': 'MODEL_NAME_COURSE_HOOK_EVENT',
+                'verbose_name_plural': 'MODEL_NAME_COURSE_HOOK_EVENT_PLURAL',
+            },
+        ),
+    ]
@@ -2,9 +2,7 @@ import datetime
 import json
 import logging
 import string
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, TYPE_CHECKING
-import urllib.request
-import urllib.parse
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple, TYPE_CHECKING
 from random import choice
 
 from aplus_auth.payload import Payload, Permission
@@ -14,7 +12,7 @@ from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.staticfiles import finders
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import F, Q
 from django.db.models.base import DEFERRED
 from django.db.models.signals import post_save, post_delete
@@ -29,7 +27,8 @@ from requests.exceptions import HTTPError
 from apps.models import BaseTab, BasePlugin
 from authorization.models import JWTAccessible
 from authorization.object_permissions import register_jwt_accessible_class
-from lib.fields import PercentField, DefaultOneToOneField, DefaultForeignKey
+from lib import http_pool
+from lib.fields import JSONField, PercentField, DefaultOneToOneField, DefaultForeignKey
 from lib.helpers import (
     Enum,
     get_random_string,
@@ -39,6 +38,7 @@ from lib.helpers import (
     url_with_query_in_data
 )
 from lib.models import UrlMixin
+from lib.request_globals import RequestGlobal
 from lib.typing import AnyUser
 from lib.validators import generate_url_key_validator
 from userprofile.models import User, UserProfile, GraderUser
@@ -264,22 +264,39 @@ class Enrollment(models.Model):
         verbose_name_plural = _('MODEL_NAME_ENROLLMENT_PLURAL')
         unique_together = ("course_instance", "user_profile")
 
+ENROLLMENT_CODE_CHARS = '0123456789ABCDEFGHJKLMNPQRSTUVXYZ'
+ANON_ID_CHARS = string.digits + string.ascii_lowercase
+
+def generate_enrollment_code() -> str:
+    return get_random_string(6, ENROLLMENT_CODE_CHARS)
+
+def generate_anon_id() -> str:
+    return get_random_string(16, ANON_ID_CHARS)
+
+def generate_pseudonym(enrollment_count: int) -> str:
+    '''
+     If the color-animal pairs are starting to run out, add another color.
+     This is highly unlikely, as there are roughly 140*68=9520 possible combinations
+    '''
+    second_name = ""
+    if enrollment_count > len(DATA["colors"]) * len(DATA["animals"]) * 0.75:
+        second_name = choice(DATA["colors"])["name"]
+    return choice(DATA["colors"])["name"] + second_name + " " + choice(DATA["animals"])
+
 def create_enrollment_code(sender, instance, created, **kwargs): # pylint: disable=unused-argument
     if created:
-        easychars = '0123456789ABCDEFGHJKLMNPQRSTUVXYZ'
-        code = get_random_string(6, easychars)
+        code = generate_enrollment_code()
         while Enrollment.objects.filter(course_instance=instance.course_instance, personal_code=code).exists():
-            code = get_random_string(6, easychars)
+            code = generate_enrollment_code()
         instance.personal_code = code
         instance.save()
 
 def create_anon_id(sender, instance, created, **kwargs): # pylint: disable=unused-argument
     if created or not instance.anon_id:
-        nums = string.digits + string.ascii_lowercase
-        code = get_random_string(16, nums)
+        code = generate_anon_id()
         i = 0
         while Enrollment.objects.filter(anon_id=code).exists():
-            code = get_random_string(16, nums)
+            code = generate_anon_id()
             i += 1
             if i > 10000:
                 raise RuntimeError("No anonymous user ids available")
@@ -289,16 +306,9 @@ def create_anon_id(sender, instance, created, **kwargs): # pylint: disable=unuse
 def pseudonymize(sender, instance, created, **kwargs): # pylint: disable=unused-argument
     if created or not instance.anon_name:
         def namegen():
-            '''
-             If the color-animal pairs are starting to run out, add another color.
-             This is highly unlikely, as there are roughly 140*68=9520 possible combinations
-            '''
-            second_name = ""
-            if Enrollment.objects.filter(
-                course_instance=instance.course_instance
-            ).count() > len(DATA["colors"]) * len(DATA["animals"]) * 0.75:
-                second_name = choice(DATA["colors"])["name"]
-            return choice(DATA["colors"])["name"] + second_name + " " + choice(DATA["animals"])
+            return generate_pseudonym(
+                Enrollment.objects.filter(course_instance=instance.course_instance).count()
+            )
 
         codename = namegen()
         i = 0
@@ -338,10 +348,67 @@ def check_and_tag_retaking(sender, instance, created, **kwargs): # pylint: disab
         )
 
 
+class EnrollmentRoles(RequestGlobal):
+    """
+    Remembers the roles of users in course instances for the duration of the
+    request, so that the role checks of CourseInstance load the enrollment of
+    a user once instead of running a query for each check.
+
+    The remembered roles are forgotten when an enrollment is saved or deleted,
+    and when the request enters or leaves a savepoint, so that roles read
+    inside a rolled back savepoint are not trusted afterwards.
+    """
+    enrollments: Dict[Tuple[int, int], Optional[Tuple[int, int]]]
+    transaction_state: Optional[Tuple[bool, Tuple[str, ...]]]
+
+    def init(self):
+        self.enrollments = {}
+        self.transaction_state = None
+
+    def _memo(self) -> Dict[Tuple[int, int], Optional[Tuple[int, int]]]:
+        state = (connection.in_atomic_block, tuple(connection.savepoint_ids))
+        if state != self.transaction_state:
+            self.enrollments = {}
+            self.transaction_state = state
+        return self.enrollments
+
+    def load(self, instance_id: int, profile_ids: Iterable[int]) -> Dict[int, Optional[Tuple[int, int]]]:
+        """
+        Returns the (role, status) of the enrollment of each user profile in
+        the course instance, or None if the profile is not enrolled. The
+        enrollments that are not remembered yet are loaded in one query.
+        """
+        memo = self._memo()
+        profile_ids = set(profile_ids)
+        missing = [pid for pid in profile_ids if (instance_id, pid) not in memo]
+        if missing:
+            for pid in missing:
+                memo[(instance_id, pid)] = None
+            for pid, role, status in (
+                Enrollment.objects
+                .filter(course_instance_id=instance_id, user_profile_id__in=missing)
+                .values_list('user_profile_id', 'role', 'status')
+            ):
+                memo[(instance_id, pid)] = (role, status)
+        return {pid: memo[(instance_id, pid)] for pid in profile_ids}
+
+    def get(self, instance_id: int, profile_id: int) -> Optional[Tuple[int, int]]:
+        return self.load(instance_id, (profile_id,))[profile_id]
+
+    def clear(self) -> None:
+        self.enrollments = {}
+
+
+def clear_enrollment_roles(sender, instance, **kwargs): # pylint: disable=unused-argument
+    EnrollmentRoles().clear()
+
+
 post_save.connect(create_enrollment_code, sender=Enrollment)
 post_save.connect(create_anon_id, sender=Enrollment)
 post_save.connect(pseudonymize, sender=Enrollment)
 post_save.connect(check_and_tag_retaking, sender=Enrollment)
+post_save.connect(clear_enrollment_roles, sender=Enrollment)
+post_delete.connect(clear_enrollment_roles, sender=Enrollment)
 
 
 class UserTag(UrlMixin, ColorTag):
@@ -915,22 +982,25 @@ class CourseInstance(CourseInstanceProto, models.Model):
         if self.image:
             resize_image(self.image.path, (800,600))
 
+    def _has_enrollment(self, user, role, status=Enrollment.ENROLLMENT_STATUS.ACTIVE):
+        return (
+            isinstance(user, User) and
+            EnrollmentRoles().get(self.id, user.userprofile.id) == (role, status)
+        )
+
     def is_assistant(self, user):
         return (
             user and
             user.is_authenticated and
-            isinstance(user, User) and
-            self.assistants.filter(id=user.userprofile.id).exists()
+            self._has_enrollment(user, Enrollment.ENROLLMENT_ROLE.ASSISTANT)
         )
 
     def is_teacher(self, user):
         return (
             user and
             user.is_authenticated and (
-                user.is_superuser or (
-                    isinstance(user, User) and
-                    self.teachers.filter(id=user.userprofile.id).exists()
-                ) or (
+                user.is_superuser or
+                self._has_enrollment(user, Enrollment.ENROLLMENT_ROLE.TEACHER) or (
                     isinstance(user, GraderUser) and
                     (Permission.WRITE, self.course) in user.permissions.courses
                 )
@@ -940,23 +1010,39 @@ class CourseInstance(CourseInstanceProto, models.Model):
     def is_course_staff(self, user):
         return self.is_teacher(user) or self.is_assistant(user)
 
+    def get_course_staff_ids(self, profiles: Iterable[UserProfile]) -> Set[int]:
+        """
+        Returns the ids of the user profiles that are course staff, i.e. the
+        profiles for which is_course_staff is true, with a single query.
+        The users of the profiles should be selected in the same query as them.
+        """
+        profiles = list(profiles)
+        enrollments = EnrollmentRoles().load(self.id, (p.id for p in profiles))
+        staff_roles = {
+            (Enrollment.ENROLLMENT_ROLE.TEACHER, Enrollment.ENROLLMENT_STATUS.ACTIVE),
+            (Enrollment.ENROLLMENT_ROLE.ASSISTANT, Enrollment.ENROLLMENT_STATUS.ACTIVE),
+        }
+        return {
+            p.id for p in profiles
+            if enrollments[p.id] in staff_roles or p.user.is_superuser
+        }
+
     def is_student(self, user):
         return (
             user and
             user.is_authenticated and
-            isinstance(user, User) and
-            self.students.filter(id=user.userprofile.id).exists()
+            self._has_enrollment(user, Enrollment.ENROLLMENT_ROLE.STUDENT)
         )
 
     def is_banned(self, user):
         return (
             user and
             user.is_authenticated and
-            isinstance(user, User) and
-            self.all_students.filter(
-                enrollment__status=Enrollment.ENROLLMENT_STATUS.BANNED,
-                id=user.userprofile.id,
-            ).exists()
+            self._has_enrollment(
+                user,
+                Enrollment.ENROLLMENT_ROLE.STUDENT,
+                Enrollment.ENROLLMENT_STATUS.BANNED,
+            )
         )
 
     def is_enrollable(self, user):
@@ -1029,14 +1115,12 @@ class CourseInstance(CourseInstanceProto, models.Model):
         Number of enrolled and removed students based on this call.
         -1 if there was problem accessing SIS.
         """
-        from .cache.menu import invalidate_content # pylint: disable=import-outside-toplevel
+        from .sis_sync import sync_sis_enrollments # pylint: disable=import-outside-toplevel
 
         sis: StudentInfoSystem = get_sis_configuration()
         if not sis:
             return -1, -1
 
-        addcount = 0
-        delcount = 0
         try:
             participants = sis.get_participants(self.sis_id)
         except HTTPError as exc:
@@ -1046,40 +1130,12 @@ class CourseInstance(CourseInstanceProto, models.Model):
             logger.exception("%s: Error in getting participants from SIS.", self)
             return -1, -1
 
-        from exercise.models import LearningObject # pylint: disable=import-outside-toplevel
-        use_pending = bool(LearningObject.objects.find_enrollment_exercise(self, False))
-
-        for i in participants:
-            try:
-                profile = UserProfile.get_by_student_id(i)
-                if self.enroll_student(profile.user, from_sis=True, use_pending=use_pending):
-                    addcount += 1
-
-            except UserProfile.MultipleObjectsReturned:
-                # Temporary fix for duplicate student IDs
-                pass
-            except UserProfile.DoesNotExist:
-                # This is a common scenario, if the user has enrolled in SIS, but not
-                # yet logged in to A+, then the user profile does not exist yet.
-                pass
-
         # Ignore empty participants list caused by a rare SIS API gateway malfunction
-        if participants:
-            # Remove SIS-enrolled students who are not anymore in SIS participants,
-            # for example, because they have first enrolled in SIS, but then
-            # unenrolled themselves.
-            qs = (Enrollment.objects
-                  .filter(course_instance=self, from_sis=True)
-                  .exclude(status=Enrollment.ENROLLMENT_STATUS.REMOVED)
-                  .exclude(user_profile__student_id__in=participants)
-            )
-            for e in qs:
-                invalidate_content(Enrollment, e)
-            delcount = qs.update(status=Enrollment.ENROLLMENT_STATUS.REMOVED)
-        else:
+        if not participants:
             logger.warning("%s: Received an empty participants list from SIS.", self)
             return 0, 0
 
+        addcount, delcount = sync_sis_enrollments(self, participants)
         logger.info("%s: enrolled %d, removed %d students based on SIS", self, addcount, delcount)
         return addcount, delcount
 
@@ -1241,7 +1297,8 @@ class CourseHook(models.Model):
     student submission has been successfully graded by the external service.
 
     When a hook is triggered it will do a HTTP POST to a defined URL
-    passing along data (e.g. submission id).
+    passing along data (e.g. submission id). The calls are queued as
+    CourseHookEvents and posted by the celery worker.
     """
 
     HOOK_CHOICES = (
@@ -1270,20 +1327,110 @@ class CourseHook(models.Model):
         return "{} -> {}".format(self.course_instance, self.hook_url)
 
     def trigger(self, data):
+        """
+        Queues a call of the hook. The celery worker posts it after the
+        current transaction commits.
+        """
+        CourseHookEvent.objects.create(hook=self, data=data)
+        # pylint: disable-next=import-outside-toplevel
+        from aplus.celery import deliver_course_hooks
+        transaction.on_commit(deliver_course_hooks.delay)
+
+    def post(self, data) -> bool:
+        """Posts the data to the hook URL. Returns whether it succeeded."""
         logger = logging.getLogger('aplus.hooks')
         url, data = url_with_query_in_data(self.hook_url, data)
         try:
-            urllib.request.urlopen( # pylint: disable=consider-using-with
-                url,
-                urllib.parse.urlencode(data).encode('ascii'),
-                timeout=10,
-            )
+            http_pool.post(url, data=data, timeout=10).raise_for_status()
             logger.info("%s posted to %s on %s with %s",
                         self.hook_type, self.hook_url, self.course_instance, data)
+            return True
         except Exception as error:
             logger.error("HTTP POST failed on %s hook to %s (%s); %s: %s",
                          self.hook_type, self.hook_url, self.course_instance,
                          error.__class__.__name__, error)
+            return False
+
+
+class CourseHookEventManager(models.Manager):
+
+    def claim_due(self, limit: int) -> List['CourseHookEvent']:
+        """
+        Returns at most limit events that are due to be posted, and postpones
+        them by COURSE_HOOK_CLAIM_TIMEOUT so that other workers skip them.
+        An event claimed by a worker that dies is retried after that time.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            events = list(
+                self.select_for_update(skip_locked=True, of=('self',))
+                .select_related('hook', 'hook__course_instance')
+                .filter(next_attempt__lte=now)
+                .order_by('next_attempt', 'id')[:limit]
+            )
+            self.renew_claim(events)
+        return events
+
+    def renew_claim(self, events: Iterable['CourseHookEvent']) -> None:
+        """Postpones the claimed events by COURSE_HOOK_CLAIM_TIMEOUT from now."""
+        self.filter(id__in=[event.id for event in events]).update(
+            next_attempt=timezone.now() + datetime.timedelta(seconds=settings.COURSE_HOOK_CLAIM_TIMEOUT),
+        )
+
+
+class CourseHookEvent(models.Model):
+    """
+    A queued call of a course hook. The events are posted by the celery
+    worker, and failed posts are retried with an exponential backoff.
+    """
+    hook = models.ForeignKey(CourseHook,
+        verbose_name=_('LABEL_COURSE_HOOK'),
+        on_delete=models.CASCADE,
+        related_name="events",
+    )
+    data = JSONField(
+        verbose_name=_('LABEL_DATA'),
+    )
+    created = models.DateTimeField(
+        verbose_name=_('LABEL_CREATED'),
+        auto_now_add=True,
+    )
+    next_attempt = models.DateTimeField(
+        verbose_name=_('LABEL_NEXT_ATTEMPT'),
+        default=timezone.now,
+        db_index=True,
+    )
+    attempts = models.PositiveIntegerField(
+        verbose_name=_('LABEL_ATTEMPTS'),
+        default=0,
+    )
+    objects = CourseHookEventManager()
+
+    class Meta:
+        verbose_name = _('MODEL_NAME_COURSE_HOOK_EVENT')
+        verbose_name_plural = _('MODEL_NAME_COURSE_HOOK_EVENT_PLURAL')
+
+    def __str__(self):
+        return "{} ({})".format(self.hook, self.data)
+
+    def postpone(self, failed: bool) -> None:
+        """
+        Schedules the next attempt. failed is False if the event was not
+        posted because an earlier post to the same URL failed.
+        """
+        if failed:
+            self.attempts += 1
+        if self.attempts >= settings.COURSE_HOOK_RETRY_LIMIT:
+            logging.getLogger('aplus.hooks').error(
+                "Giving up on %s hook to %s (%s) after %s attempts with %s",
+                self.hook.hook_type, self.hook.hook_url, self.hook.course_instance,
+                self.attempts, self.data,
+            )
+            self.delete()
+            return
+        delay = settings.COURSE_HOOK_RETRY_DELAY * 2 ** max(self.attempts - 1, 0)
+        self.next_attempt = timezone.now() + datetime.timedelta(seconds=delay)
+        self.save(update_fields=['attempts', 'next_attempt'])
 
 
 class CourseModuleManager(models.Manager):
@@ -0,0 +1,288 @@
+"""
+Synchronising course enrollments with the Student Information System.
+
+sync_sis_enrollments applies the participant list of a course instance with a
+fixed number of queries: the profiles of all the student ids and the existing
+enrollments are loaded at once, the changes are computed in memory and written
+with bulk_create and bulk_update. Bulk writes do not send the post_save signals
+of Enrollment, so the enrollment codes and pseudonyms that the signal handlers
+would create are generated here, and the cached menus of the affected users are
+invalidated in one batch.
+
+enroll_from_sis_concurrently synchronises many course instances in a pool of
+SIS_ENROLL_CONCURRENCY threads. The SIS requests are still started at least
+SIS_ENROLL_DELAY seconds apart.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from lib.request_globals import RequestGlobal
+from userprofile.models import UserProfile
+from .cache.menu import CachedTopMenu
+from .models import (
+    CourseInstance,
+    Enrollment,
+    EnrollmentRoles,
+    UserTag,
+    UserTagging,
+    generate_anon_id,
+    generate_enrollment_code,
+    generate_pseudonym,
+)
+
+
+logger = logging.getLogger('aplus.course')
+
+# How many times a generated code may collide before giving up
+MAX_CODE_ATTEMPTS = 10000
+
+
+def profiles_by_student_id(student_ids: Iterable[str]) -> Dict[str, UserProfile]:
+    """
+    Returns the local user profiles of the student ids. Student ids that
+    belong to several profiles are left out like missing ones.
+    """
+    profiles: Dict[str, List[UserProfile]] = defaultdict(list)
+    for profile in UserProfile.objects.filter(
+        student_id__in=set(student_ids),
+        organization=settings.LOCAL_ORGANIZATION,
+    ):
+        profiles[profile.student_id].append(profile)
+    return {student_id: p[0] for student_id, p in profiles.items() if len(p) == 1}
+
+
+def _unique_codes(
+        count: int,
+        generate: Callable[[], str],
+        taken: Callable[[Set[str]], Set[str]],
+        error: str,
+        ) -> List[str]:
+    """
+    Generates count distinct codes. taken returns the codes of a candidate set
+    that are already in use.
+    """
+    codes: Set[str] = set()
+    attempts = 0
+    while len(codes) < count:
+        candidates = set()
+        while len(codes) + len(candidates) < count:
+            candidate = generate()
+            if candidate in codes or candidate in candidates:
+                attempts += 1
+                if attempts > MAX_CODE_ATTEMPTS:
+                    raise RuntimeError(error)
+            else:
+                candidates.add(candidate)
+        used = taken(candidates)
+        codes |= candidates - used
+        attempts += len(used)
+        if attempts > MAX_CODE_ATTEMPTS:
+            raise RuntimeError(error)
+    return list(codes)
+
+
+def fill_codes(instance: CourseInstance, created: List[Enrollment], changed: List[Enrollment]) -> None:
+    """
+    Sets the enrollment codes, anonymous ids and pseudonyms that the post_save
+    signal handlers of Enrollment create for new enrollments and for old ones
+    without them.
+    """
+    existing = list(
+        Enrollment.objects
+        .filter(course_instance=instance)
+        .values_list('personal_code', 'anon_name')
+    )
+    personal_codes = {code for code, _ in existing}
+    anon_names = {name for _, name in existing}
+
+    codes = _unique_codes(
+        len(created),
+        generate_enrollment_code,
+        lambda candidates: candidates & personal_codes,
+        "No enrollment codes available",
+    )
+    for enrollment, code in zip(created, codes):
+        enrollment.personal_code = code
+
+    need_id = created + [e for e in changed if not e.anon_id]
+    ids = _unique_codes(
+        len(need_id),
+        generate_anon_id,
+        lambda candidates: set(
+            Enrollment.objects.filter(anon_id__in=candidates).values_list('anon_id', flat=True)
+        ),
+        "No anonymous user ids available",
+    )
+    for enrollment, anon_id in zip(need_id, ids):
+        enrollment.anon_id = anon_id
+
+    need_name = created + [e for e in changed if not e.anon_name]
+    enrollment_count = len(existing) + len(created)
+    names = _unique_codes(
+        len(need_name),
+        lambda: generate_pseudonym(enrollment_count),
+        lambda candidates: candidates & anon_names,
+        "No anonymous usernames available",
+    )
+    for enrollment, name in zip(need_name, names):
+        enrollment.anon_name = name
+
+
+def tag_retaking(instance: CourseInstance, profile_ids: Iterable[int]) -> None:
+    """Tags the new students that have been enrolled in other instances of the course"""
+    retaking = set(
+        Enrollment.objects
+        .filter(course_instance__course_id=instance.course_id, user_profile_id__in=set(profile_ids))
+        .exclude(course_instance=instance)
+        .values_list('user_profile_id', flat=True)
+    )
+    if not retaking:
+        return
+    retaking_tag, _ = UserTag.objects.get_or_create(
+        course_instance=instance,
+        name='Retaking',
+        slug='retaking',
+        description="This student is retaking this course.",
+        color='#ffcc00',
+    )
+    for profile_id in retaking:
+        UserTagging.objects.get_or_create(
+            tag=retaking_tag,
+            user_id=profile_id,
+            course_instance=instance,
+        )
+
+
+def sync_sis_enrollments(instance: CourseInstance, participants: Iterable[str]) -> Tuple[int, int]:
+    """
+    Enrolls the participants and removes the SIS-enrolled students who are
+    no longer participants, like enroll_student(user, from_sis=True) for each
+    participant would. Returns the number of enrolled and removed students.
+    """
+    from exercise.models import LearningObject # pylint: disable=import-outside-toplevel
+    use_pending = bool(LearningObject.objects.find_enrollment_exercise(instance, False))
+    status = Enrollment.ENROLLMENT_STATUS.PENDING if use_pending else Enrollment.ENROLLMENT_STATUS.ACTIVE
+
+    participants = set(participants)
+    profiles = profiles_by_student_id(participants)
+    profiles_by_id = {p.id: p for p in profiles.values()}
+
+    with transaction.atomic():
+        enrollments = {
+            e.user_profile_id: e
+            for e in Enrollment.objects.select_for_update().filter(
+                course_instance=instance,
+                user_profile_id__in=profiles_by_id.keys(),
+            )
+        }
+        created: List[Enrollment] = []
+        changed: List[Enrollment] = []
+        addcount = 0
+        for profile in profiles.values():
+            enrollment = enrollments.get(profile.id)
+            if enrollment is None:
+                created.append(Enrollment(
+                    course_instance=instance,
+                    user_profile=profile,
+                    role=Enrollment.ENROLLMENT_ROLE.STUDENT,
+                    status=status,
+                    from_sis=True,
+                ))
+                addcount += 1
+            elif enrollment.status in (Enrollment.ENROLLMENT_STATUS.ACTIVE, Enrollment.ENROLLMENT_STATUS.PENDING):
+                modified = False
+                if enrollment.status == Enrollment.ENROLLMENT_STATUS.PENDING and not use_pending:
+                    enrollment.status = Enrollment.ENROLLMENT_STATUS.ACTIVE
+                    modified = True
+                if not enrollment.from_sis and enrollment.role == Enrollment.ENROLLMENT_ROLE.STUDENT:
+                    enrollment.from_sis = True
+                    modified = True
+                if modified:
+                    changed.append(enrollment)
+            else:
+                enrollment.role = Enrollment.ENROLLMENT_ROLE.STUDENT
+                enrollment.status = status
+                enrollment.from_sis = True
+                changed.append(enrollment)
+                addcount += 1
+
+        fill_codes(instance, created, changed)
+        Enrollment.objects.bulk_create(created, ignore_conflicts=True)
+        Enrollment.objects.bulk_update(changed, ['role', 'status', 'from_sis', 'anon_id', 'anon_name'])
+        tag_retaking(instance, (e.user_profile_id for e in created))
+
+        # Remove SIS-enrolled students who are not anymore in SIS participants,
+        # for example, because they have first enrolled in SIS, but then
+        # unenrolled themselves.
+        removed = list(
+            Enrollment.objects
+            .filter(course_instance=instance, from_sis=True)
+            .exclude(status=Enrollment.ENROLLMENT_STATUS.REMOVED)
+            .exclude(user_profile__student_id__in=participants)
+            .values_list('id', 'user_profile__user_id')
+        )
+        delcount = (
+            Enrollment.objects
+            .filter(id__in=[enrollment_id for enrollment_id, _ in removed])
+            .update(status=Enrollment.ENROLLMENT_STATUS.REMOVED)
+        )
+
+    user_ids = {e.user_profile.user_id for e in created}
+    user_ids.update(profiles_by_id[e.user_profile_id].user_id for e in changed)
+    user_ids.update(user_id for _, user_id in removed)
+    CachedTopMenu.invalidate_many((user_id,) for user_id in user_ids)
+    EnrollmentRoles().clear()
+
+    return addcount, delcount
+
+
+class _Throttle:
+    """Spaces calls to wait() at least interval seconds apart across threads"""
+    def __init__(self, interval: Optional[float]) -> None:
+        self.interval = interval or 0
+        self.lock = Lock()
+        self.next_start = monotonic()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            sleep(start - now)
+
+
+def enroll_from_sis_concurrently(instances: Iterable[CourseInstance]) -> Dict[int, Tuple[int, int]]:
+    """
+    Calls enroll_from_sis for the course instances in a pool of
+    SIS_ENROLL_CONCURRENCY threads. Returns the enrolled and removed counts of
+    each instance by its id, (-1, -1) if the enrollment failed.
+    """
+    throttle = _Throttle(settings.SIS_ENROLL_DELAY)
+
+    def work(instance: CourseInstance) -> Tuple[int, int]:
+        try:
+            throttle.wait()
+            return instance.enroll_from_sis()
+        except Exception: # pylint: disable=broad-except
+            logger.exception("%s: Failed to enroll students from SIS.", instance)
+            return -1, -1
+        finally:
+            # The thread is reused for other instances
+            RequestGlobal.clear_globals()
+            connections.close_all()
+
+    instances = list(instances)
+    with ThreadPoolExecutor(
+            max_workers=settings.SIS_ENROLL_CONCURRENCY,
+            thread_name_prefix="sis-enroll",
+            ) as executor:
+        results = list(executor.map(work, instances))
+    return {instance.id: result for instance, result in zip(instances, results)}
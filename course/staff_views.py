@@ -204,8 +204,10 @@ class EnrollStudentsView(CourseInstanceMixin, BaseFormView):
 
         failed_already_enrolled = []
         failed_course_staff = []
-        for profile in form.cleaned_data["user_profiles"]:
-            if self.instance.is_course_staff(profile.user):
+        profiles = form.cleaned_data["user_profiles"]
+        staff_ids = self.instance.get_course_staff_ids(profiles)
+        for profile in profiles:
+            if profile.id in staff_ids:
                 # Course staff cannot be demoted into students by enrolling
                 # them via this view.
                 failed_course_staff.append(profile)
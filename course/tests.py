@@ -1,14 +1,21 @@
 from datetime import timedelta
+from threading import Barrier
+from unittest.mock import Mock, patch
 
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.db import connection, transaction
 from django.urls import reverse
 from django.test import TestCase, override_settings
 from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from course.models import Course, CourseInstance, CourseHook, CourseModule, \
+from aplus.celery import deliver_course_hooks
+from course.models import Course, CourseInstance, CourseHook, CourseHookEvent, CourseModule, Enrollment, \
     LearningObjectCategory, StudentGroup
+from course.sis import StudentInfoSystem
+from course.sis_sync import enroll_from_sis_concurrently
 from exercise.models import BaseExercise, Submission
 from exercise.exercise_models import LearningObject
 
@@ -212,6 +219,34 @@ class CourseTest(CourseTestCase):
         self.assertFalse(self.current_course_instance.is_course_staff(self.user))
         self.assertEqual(0, len(self.current_course_instance.get_course_staff_profiles()))
 
+    def test_course_roles_are_loaded_once(self):
+        instance = self.current_course_instance
+        instance.add_assistant(self.user1.userprofile)
+        instance.enroll_student(self.user2)
+        profiles = [self.user.userprofile, self.user1.userprofile, self.user2.userprofile]
+        with self.assertNumQueries(1):
+            self.assertTrue(instance.is_assistant(self.user1))
+            self.assertTrue(instance.is_course_staff(self.user1))
+            self.assertFalse(instance.is_teacher(self.user1))
+            self.assertFalse(instance.is_student(self.user1))
+            self.assertFalse(instance.is_banned(self.user1))
+        with self.assertNumQueries(1):
+            self.assertEqual(instance.get_course_staff_ids(profiles), {self.user1.userprofile.id})
+            self.assertTrue(instance.is_student(self.user2))
+            self.assertFalse(instance.is_course_staff(self.user))
+
+        # Changes to the enrollments are seen
+        instance.add_teacher(self.user.userprofile)
+        self.assertTrue(instance.is_teacher(self.user))
+        try:
+            with transaction.atomic():
+                instance.clear_teachers()
+                self.assertFalse(instance.is_teacher(self.user))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertTrue(instance.is_teacher(self.user))
+
     def test_course_instance_submitters(self):
         students = self.current_course_instance.get_submitted_profiles()
         self.assertEqual(1, len(students))
@@ -268,6 +303,68 @@ class CourseTest(CourseTestCase):
     def test_course_hook_unicode_string(self):
         self.assertEqual("123456 test course: Fall 2011 day 1 -> test_hook_url", str(self.course_hook))
 
+    def test_course_hook_events(self):
+        second_hook = CourseHook.objects.create(
+            hook_url="test_hook_url",
+            course_instance=self.current_course_instance
+        )
+        with patch('lib.http_pool.post') as post, \
+                self.captureOnCommitCallbacks() as callbacks:
+            self.submission.set_ready()
+        # The hooks are not posted while grading
+        post.assert_not_called()
+        self.assertEqual(len(callbacks), 2)
+        events = CourseHookEvent.objects.order_by('id')
+        self.assertEqual([event.hook for event in events], [self.course_hook, second_hook])
+        self.assertEqual(events[0].data["submission_id"], self.submission.id)
+
+        posted = []
+        def failing_post(url, **kwargs):
+            posted.append(url)
+            raise ConnectionError("Hook endpoint is down")
+        with patch('lib.http_pool.post', failing_post):
+            deliver_course_hooks()
+        # The events to the same URL are postponed after the first failure
+        self.assertEqual(len(posted), 1)
+        self.assertEqual([event.attempts for event in events], [1, 0])
+        self.assertTrue(all(event.next_attempt > timezone.now() for event in events))
+
+        events.update(next_attempt=timezone.now())
+        with patch('lib.http_pool.post', lambda url, **kwargs: posted.append(url) or Mock()):
+            deliver_course_hooks()
+        self.assertEqual(len(posted), 3)
+        self.assertFalse(CourseHookEvent.objects.exists())
+
+    def test_course_hook_claim_renewed(self):
+        self.course_hook.trigger({"submission_id": self.submission.id})
+        self.course_hook.trigger({"submission_id": self.submission.id})
+        first, second = CourseHookEvent.objects.order_by('id').values_list('id', flat=True)
+
+        renewed = []
+        renew_claim = CourseHookEvent.objects.renew_claim
+        def record_renewal(events):
+            events = list(events)
+            renewed.append([event.id for event in events])
+            renew_claim(events)
+        # Every post takes more than half of the claim timeout
+        clock = iter(range(0, 100 * settings.COURSE_HOOK_CLAIM_TIMEOUT, settings.COURSE_HOOK_CLAIM_TIMEOUT))
+        with patch.object(CourseHookEvent.objects, 'renew_claim', record_renewal), \
+                patch('aplus.celery.monotonic', lambda: next(clock)), \
+                patch('lib.http_pool.post', Mock()):
+            deliver_course_hooks()
+        # The claim is renewed for the events that are not posted yet
+        self.assertEqual(renewed, [[first, second], [first, second], [second]])
+        self.assertFalse(CourseHookEvent.objects.exists())
+
+    @override_settings(COURSE_HOOK_RETRY_LIMIT=2)
+    def test_course_hook_event_retry_limit(self):
+        self.course_hook.trigger({"submission_id": self.submission.id})
+        with patch('lib.http_pool.post', Mock(side_effect=ConnectionError)):
+            deliver_course_hooks()
+            CourseHookEvent.objects.update(next_attempt=timezone.now())
+            deliver_course_hooks()
+        self.assertFalse(CourseHookEvent.objects.exists())
+
     def test_course_module_late_submission_point_worth(self):
         self.assertEqual(0, self.course_module.get_late_submission_point_worth())
         self.assertEqual(80, self.course_module_with_late_submissions_allowed.get_late_submission_point_worth())
@@ -437,6 +534,78 @@ class CourseTest(CourseTestCase):
         self.assertFalse(self.past_course_instance.is_student(self.user1))
         self.assertFalse(self.past_course_instance.is_student(self.user2))
 
+    @override_settings(SIS_PLUGIN_MODULE='course.sis', SIS_PLUGIN_CLASS='StudentInfoSystem')
+    def test_sis_enrollments_are_synced_in_bulk(self):
+        instance = self.current_course_instance
+        students = []
+        for i in range(20):
+            user = User.objects.create(username=f"sis{i}")
+            user.userprofile.student_id = f"9{i:05d}"
+            user.userprofile.organization = settings.LOCAL_ORGANIZATION
+            user.userprofile.save()
+            students.append(user)
+        # Manually enrolled students are marked as coming from SIS
+        instance.enroll_student(self.user1)
+        # Removed students are enrolled again
+        instance.enroll_student(self.user2, from_sis=True)
+        Enrollment.objects.filter(user_profile=self.user2.userprofile).update(
+            status=Enrollment.ENROLLMENT_STATUS.REMOVED,
+        )
+        # SIS-enrolled students that are no longer participants are removed
+        instance.enroll_student(self.user, from_sis=True)
+
+        participants = ["333333", "555555", "unknown"] + [u.userprofile.student_id for u in students]
+        with patch.object(StudentInfoSystem, 'get_participants', return_value=participants), \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(instance.enroll_from_sis(), (21, 1))
+        # The number of queries does not grow with the participants
+        self.assertLess(len(queries), 20)
+
+        self.assertTrue(instance.is_student(self.user1))
+        self.assertTrue(instance.is_student(self.user2))
+        self.assertFalse(instance.is_student(self.user))
+        enrollments = Enrollment.objects.filter(course_instance=instance, from_sis=True).exclude(
+            status=Enrollment.ENROLLMENT_STATUS.REMOVED,
+        )
+        self.assertEqual(enrollments.count(), 22)
+        for enrollment in enrollments:
+            self.assertTrue(enrollment.personal_code)
+            self.assertTrue(enrollment.anon_id)
+            self.assertTrue(enrollment.anon_name)
+        self.assertEqual(len({e.anon_id for e in enrollments}), 22)
+
+        # Nothing changes on a second run
+        with patch.object(StudentInfoSystem, 'get_participants', return_value=participants):
+            self.assertEqual(instance.enroll_from_sis(), (0, 0))
+
+    @override_settings(SIS_ENROLL_DELAY=0.05, SIS_ENROLL_CONCURRENCY=2)
+    def test_sis_enrollment_of_instances_is_concurrent(self):
+        # The two slow instances pass the barrier only if they run at the same time
+        both_running = Barrier(2, timeout=10)
+        def enroll_from_sis(instance):
+            if instance.id == self.future_course_instance.id:
+                raise ValueError()
+            both_running.wait()
+            return (1, 0)
+
+        delays = []
+        instances = [self.past_course_instance, self.current_course_instance, self.future_course_instance]
+        with patch.object(CourseInstance, 'enroll_from_sis', enroll_from_sis), \
+                patch('course.sis_sync.monotonic', return_value=100.0), \
+                patch('course.sis_sync.sleep', delays.append), \
+                self.assertLogs('aplus.course', 'ERROR'):
+            results = enroll_from_sis_concurrently(instances)
+
+        self.assertEqual(results, {
+            self.past_course_instance.id: (1, 0),
+            self.current_course_instance.id: (1, 0),
+            self.future_course_instance.id: (-1, -1),
+        })
+        # The starts are spaced SIS_ENROLL_DELAY apart
+        self.assertEqual(len(delays), 2)
+        for delay, expected in zip(sorted(delays), (0.05, 0.1)):
+            self.assertAlmostEqual(delay, expected)
+
     def test_last_instance_view_hidden_module(self):
         course = Course.objects.create(
             name="Last instance view course",
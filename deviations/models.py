@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
-from typing import TYPE_CHECKING, Any, Dict, Generic, Iterable, Optional, TypeVar, Union
+from itertools import groupby
+from typing import TYPE_CHECKING, Any, Dict, Generic, Iterable, List, Optional, Set, Tuple, TypeVar, Union
 
 from django.db import models
 from django.utils.translation import gettext_lazy as _
@@ -79,6 +80,70 @@ class SubmissionRuleDeviationManager(models.Manager[TModel], Generic[TModel]):
         for deviation in deviations:
             return deviation
 
+    def get_max_deviations_many(
+        self,
+        submitters: Iterable[Union[UserProfile, int]],
+        exercises: Iterable[Union[BaseExercise, int]],
+    ) -> Dict[Tuple[int, int], TModel]:
+        """
+        Bulk version of `get_max_deviations` for many submitters. Returns a
+        dict mapping (submitter id, exercise id) to the maximum deviation of
+        that submitter in that exercise. Pairs without a deviation are left
+        out. Uses a constant number of queries regardless of the number of
+        submitters and exercises.
+        """
+        submitter_ids = {getattr(s, 'id', s) for s in submitters}
+        exercise_ids = {getattr(e, 'id', e) for e in exercises}
+        if not submitter_ids or not exercise_ids:
+            return {}
+
+        # Find the other submitters that have submitted the exercise together
+        # with one of the given submitters. Their deviations apply to the
+        # given submitters as well.
+        memberships = (
+            Submission.submitters.through.objects
+            .filter(
+                submission__in=Submission.objects.filter(
+                    exercise__in=exercise_ids,
+                    submitters__in=submitter_ids,
+                ),
+            )
+            .values_list('submission_id', 'submission__exercise_id', 'userprofile_id')
+            .order_by('submission_id')
+        )
+        co_submitters: Dict[Tuple[int, int], Set[int]] = {}
+        for (_, exercise_id), rows in groupby(memberships, key=lambda r: r[:2]):
+            members = {profile_id for _, _, profile_id in rows}
+            for profile_id in members & submitter_ids:
+                co_submitters.setdefault((profile_id, exercise_id), set()).update(members)
+
+        owner_ids = set(submitter_ids)
+        for members in co_submitters.values():
+            owner_ids.update(members)
+        deviations = (
+            self.filter(exercise__in=exercise_ids, submitter__in=owner_ids)
+            .order_by('exercise', self.max_order_by)
+        )
+        # The first deviation of each (owner, exercise) is the maximum one
+        owner_max: Dict[Tuple[int, int], TModel] = {}
+        ranked: Dict[int, List[TModel]] = {}
+        for deviation in deviations:
+            owner_max.setdefault((deviation.submitter_id, deviation.exercise_id), deviation)
+            ranked.setdefault(deviation.exercise_id, []).append(deviation)
+
+        result = {
+            key: deviation
+            for key, deviation in owner_max.items()
+            if key[0] in submitter_ids
+        }
+        # The members of a submission include the submitter themself
+        for (submitter_id, exercise_id), owners in co_submitters.items():
+            for deviation in ranked.get(exercise_id, ()):
+                if deviation.submitter_id in owners:
+                    result[(submitter_id, exercise_id)] = deviation
+                    break
+        return result
+
 
 class SubmissionRuleDeviation(UrlMixin, models.Model):
     """
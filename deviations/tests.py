@@ -251,6 +251,29 @@ class DeviationsTest(TestCase):
         self.assertEqual(deviation.exercise.id, self.exercise_with_attachment.id)
         self.assertEqual(deviation.extra_seconds, 3*24*60*60)
 
+    def test_get_max_deviations_many(self):
+        # Test that the bulk method returns the same deviations as
+        # get_max_deviation for every submitter, including group submissions.
+        submission = Submission.objects.create(
+            exercise=self.exercise_with_attachment,
+            status=Submission.STATUS.READY,
+        )
+        submission.submitters.add(self.user.userprofile, self.user_2.userprofile)
+
+        profiles = [self.user.userprofile, self.user_2.userprofile]
+        exercises = [self.exercise_with_attachment, self.exercise_with_attachment_2]
+        with self.assertNumQueries(2):
+            deviations = DeadlineRuleDeviation.objects.get_max_deviations_many(profiles, exercises)
+
+        for profile in profiles:
+            for exercise in exercises:
+                expected = DeadlineRuleDeviation.objects.get_max_deviation(profile, exercise)
+                deviation = deviations.get((profile.id, exercise.id))
+                if expected is None:
+                    self.assertIsNone(deviation)
+                else:
+                    self.assertEqual(deviation.extra_seconds, expected.extra_seconds)
+
     def test_update_by_form(self):
         deviation = DeadlineRuleDeviation(
             exercise=self.exercise_with_attachment,
@@ -3,7 +3,6 @@ from typing import Any
 import urllib.parse
 
 from aplus_auth.payload import Permission, Permissions
-from aplus_auth.requests import get as aplus_get
 from django import forms
 from django.conf import settings
 from django.core.exceptions import ValidationError
@@ -15,6 +14,7 @@ from aplus.api import api_reverse
 from course.models import LearningObjectCategory, CourseModule, CourseInstance, UserTag, SubmissionTag
 from course.sis import get_sis_configuration, StudentInfoSystem
 from exercise.models import CourseChapter
+from lib.http_pool import aplus_get
 from lib.validators import generate_url_key_validator
 from lib.fields import UsersSearchSelectField
 from lib.widgets import DateTimeLocalInput
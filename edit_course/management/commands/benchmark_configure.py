@@ -0,0 +1,83 @@
+import json
+from time import perf_counter
+from typing import Optional
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from edit_course.operations.configure import configure
+from lib.testdata import synthetic_course_config, throwaway_course_instance
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the time and the number of database queries of importing a '
+        'generated course configuration, reimporting it with every module and '
+        'exercise changed and reimporting it unchanged. The course is created '
+        'in the database and deleted afterwards, so run this against a '
+        'throwaway database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modules', type=int, default=15)
+        parser.add_argument('--exercises-per-module', type=int, default=20)
+        parser.add_argument(
+            '--config',
+            metavar='PATH',
+            help='Import this course JSON instead of a generated one',
+        )
+        parser.add_argument(
+            '--dump',
+            metavar='PATH',
+            help='Write the generated course JSON to this file',
+        )
+        parser.add_argument(
+            '--yes',
+            action='store_true',
+            help='Confirm that the course may be created and deleted in the configured database',
+        )
+
+    def handle(self, *args, **options):
+        if not options['yes']:
+            raise CommandError(
+                "This creates and deletes a course in the configured database. "
+                "Run it against a throwaway database and pass --yes to confirm."
+            )
+        base_config: Optional[dict] = None
+        if options['config']:
+            with open(options['config'], encoding='utf-8') as f:
+                base_config = json.load(f)
+        elif options['dump']:
+            with open(options['dump'], 'w', encoding='utf-8') as f:
+                config = synthetic_course_config(options['modules'], options['exercises_per_module'], 0)
+                json.dump(config, f, indent=2)
+
+        with throwaway_course_instance("benchmark-configure") as instance:
+            self.stdout.write(f"{'step':<14}{'seconds':>9}{'queries':>10}")
+            for step, revision in (('import', 0), ('changed', 1), ('unchanged', 1)):
+                if base_config is not None:
+                    config = self.revise(base_config, revision)
+                else:
+                    config = synthetic_course_config(options['modules'], options['exercises_per_module'], revision)
+                with CaptureQueriesContext(connection) as queries:
+                    start = perf_counter()
+                    success, errors = configure(instance, config)
+                    elapsed = perf_counter() - start
+                if not success:
+                    raise CommandError("; ".join(str(e) for e in errors))
+                self.stdout.write(f"{step:<14}{elapsed:>9.2f}{len(queries):>10}")
+
+    def revise(self, config: dict, revision: int) -> dict:
+        """Returns a copy of a course config where the title of every module and exercise changes"""
+        config = json.loads(json.dumps(config))
+
+        def mark(objects):
+            for obj in objects:
+                if isinstance(obj, dict):
+                    if revision and isinstance(obj.get("title"), str):
+                        obj["title"] = f"{obj['title']} r{revision}"
+                    mark(obj.get("children", []))
+
+        mark(config.get("modules", []))
+        return config
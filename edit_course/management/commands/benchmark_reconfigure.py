@@ -0,0 +1,87 @@
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import Any, Dict, Iterator
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+from edit_course.operations import configure as configure_module
+from lib.testdata import synthetic_course_config, throwaway_course_instance
+
+
+@contextmanager
+def replaced(obj: Any, name: str, value: Any) -> Iterator[None]:
+    """Replaces an attribute of obj inside the block"""
+    original = obj.__dict__.get(name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        if original is None:
+            delattr(obj, name)
+        else:
+            setattr(obj, name, original)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the time and the number of cache writes of configuring a '
+        'synthetic course and then reconfiguring every module and exercise of '
+        'it, with and without invalidation_batch(). The course is created in '
+        'the database and deleted afterwards, so run this against a throwaway '
+        'database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modules', type=int, default=15)
+        parser.add_argument('--exercises-per-module', type=int, default=20)
+        parser.add_argument(
+            '--yes',
+            action='store_true',
+            help='Confirm that the course may be created and deleted in the configured database',
+        )
+
+    def handle(self, *args, **options):
+        if not options['yes']:
+            raise CommandError(
+                "This creates and deletes a course in the configured database. "
+                "Run it against a throwaway database and pass --yes to confirm."
+            )
+        self.stdout.write(f"{'variant':<12}{'step':<14}{'seconds':>9}{'cache calls':>13}{'keys written':>14}")
+        for variant, batch in (('unbatched', nullcontext), ('batched', configure_module.invalidation_batch)):
+            with replaced(configure_module, 'invalidation_batch', batch):
+                self.run_variant(variant, options['modules'], options['exercises_per_module'])
+
+    def run_variant(self, variant: str, modules: int, exercises_per_module: int) -> None:
+        with throwaway_course_instance(f"benchmark-{variant}") as instance:
+            for step, revision in (('configure', 0), ('reconfigure', 1)):
+                config = synthetic_course_config(modules, exercises_per_module, revision)
+                with self.count_cache_writes() as counts:
+                    start = perf_counter()
+                    success, errors = configure_module.configure(instance, config)
+                    elapsed = perf_counter() - start
+                if not success:
+                    raise CommandError("; ".join(str(e) for e in errors))
+                self.stdout.write(
+                    f"{variant:<12}{step:<14}{elapsed:>9.2f}{counts['calls']:>13}{counts['keys']:>14}"
+                )
+
+    @contextmanager
+    def count_cache_writes(self) -> Iterator[Dict[str, int]]:
+        """Counts the set and set_many calls of the default cache and the keys written by them"""
+        counts = {'calls': 0, 'keys': 0}
+        backend = caches['default']
+        original_set, original_set_many = backend.set, backend.set_many
+
+        def counting_set(key, *args, **kwargs):
+            counts['calls'] += 1
+            counts['keys'] += 1
+            return original_set(key, *args, **kwargs)
+
+        def counting_set_many(data, *args, **kwargs):
+            counts['calls'] += 1
+            counts['keys'] += len(data)
+            return original_set_many(data, *args, **kwargs)
+
+        with replaced(backend, 'set', counting_set), replaced(backend, 'set_many', counting_set_many):
+            yield counts
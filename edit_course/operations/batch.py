@@ -4,6 +4,7 @@ from django.utils.text import format_lazy
 from django.utils.translation import gettext_lazy as _
 
 from exercise.models import BaseExercise, Submission
+from lib.cache.transact import invalidation_batch
 from lib.helpers import extract_form_errors
 from ..submission_forms import BatchSubmissionCreateAndReviewForm
 
@@ -69,16 +70,17 @@ def create_submissions(instance, admin_profile, json_text):
             )
 
     if not errors:
-        for form in validated_forms:
-            sub = Submission.objects.create(exercise=form.exercise)
-            sub.submitters.set(form.cleaned_students)
-            sub.feedback = form.cleaned_data.get("feedback")
-            sub.set_points(form.cleaned_data.get("points"),
-                sub.exercise.max_points, no_penalties=True)
-            sub.submission_time = form.cleaned_data.get("submission_time")
-            sub.grading_time = timezone.now()
-            sub.grader = form.cleaned_data.get("grader") or admin_profile
-            sub.set_ready()
-            sub.save()
+        with invalidation_batch():
+            for form in validated_forms:
+                sub = Submission.objects.create(exercise=form.exercise)
+                sub.submitters.set(form.cleaned_students)
+                sub.feedback = form.cleaned_data.get("feedback")
+                sub.set_points(form.cleaned_data.get("points"),
+                    sub.exercise.max_points, no_penalties=True)
+                sub.submission_time = form.cleaned_data.get("submission_time")
+                sub.grading_time = timezone.now()
+                sub.grader = form.cleaned_data.get("grader") or admin_profile
+                sub.set_ready()
+                sub.save()
 
     return errors
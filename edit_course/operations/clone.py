@@ -4,6 +4,7 @@ from django.db import transaction
 from django.contrib.auth.models import User
 from course.models import CourseInstance
 from course.sis import get_sis_configuration, StudentInfoSystem
+from lib.cache.transact import invalidation_batch
 
 logger = logging.getLogger("aplus.course")
 
@@ -54,6 +55,7 @@ def set_sis(instance: CourseInstance, id: str, enroll: bool) -> None: # pylint:
             instance.add_teacher(user.userprofile)
 
 @transaction.atomic
+@invalidation_batch()
 def clone( # pylint: disable=too-many-locals too-many-arguments
         cloner,
         instance,
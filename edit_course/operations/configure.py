@@ -1,13 +1,14 @@
+from collections import defaultdict
 import copy
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from functools import partial
 import json
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Type
 
 from aplus_auth.payload import Permission, Permissions
-from aplus_auth.requests import get as aplus_get
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import Model
 from django.utils import timezone
 from django.utils.text import format_lazy
 from django.utils.translation import gettext_lazy as _
@@ -21,7 +22,11 @@ from exercise.models import (
     LTI1p3Exercise,
     RevealRule,
 )
-from external_services.models import LTIService, LTI1p3Service
+from exercise.cache.content import CachedContent
+from exercise.cache.exercise import invalidate_instance
+from external_services.models import LinkService, LTIService, LTI1p3Service
+from lib.cache.transact import invalidation_batch
+from lib.http_pool import aplus_get
 from lib.localization_syntax import format_localization
 from userprofile.models import UserProfile
 
@@ -111,6 +116,7 @@ def parse_reveal_rule(
         rule_key: str,
         current_rule: Optional[RevealRule],
         errors: List[str],
+        save: bool = True,
         ):
     if not isinstance(rule_config, dict) or "trigger" not in rule_config:
         errors.append(format_lazy(_('REVEAL_RULE_ERROR_INVALID_JSON -- {key}'), key=rule_key))
@@ -134,7 +140,8 @@ def parse_reveal_rule(
         rule.delay_minutes = parse_int(rule_config["delay_minutes"], errors)
     if "show_zero_points_immediately" in rule_config:
         rule.show_zero_points_immediately = rule_config["show_zero_points_immediately"]
-    rule.save()
+    if save:
+        rule.save()
     return rule
 
 
@@ -161,6 +168,68 @@ def remove_newlines(value):
     return value.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
 
 
+def save_new(objects: List[Model]) -> None:
+    """Creates new objects of a model that is not inherited from another model.
+    bulk_create is used if the database returns the generated primary keys,
+    as they are needed for the relations. Otherwise, the objects are saved one
+    by one."""
+    if not objects:
+        return
+    if connection.features.can_return_rows_from_bulk_insert:
+        type(objects[0])._default_manager.bulk_create(objects)
+    else:
+        for obj in objects:
+            obj.save()
+
+
+def save_changed(objects: Iterable[Model], fields: Iterable[str]) -> None:
+    """Saves the given fields of existing objects with bulk_update, once for each
+    model class. Fields that a class does not have are skipped. The save signals
+    are not sent, so the caller invalidates the caches."""
+    by_class: Dict[Type[Model], List[Model]] = defaultdict(list)
+    for obj in objects:
+        by_class[type(obj)].append(obj)
+    for cls, objs in by_class.items():
+        cls_fields = {f.name for f in cls._meta.concrete_fields if not f.primary_key}
+        cls._default_manager.bulk_update(objs, [f for f in fields if f in cls_fields])
+
+
+class LTIServices:
+    """Finds LTI services by their menu label. Each service type is loaded once."""
+    def __init__(self) -> None:
+        self.services: Dict[Type[LinkService], Dict[str, LinkService]] = {}
+
+    def get(self, service_cls: Type[LinkService], label: Any) -> Optional[LinkService]:
+        services = self.services.get(service_cls)
+        if services is None:
+            services = {}
+            for service in service_cls.objects.order_by('menu_label', 'pk'):
+                services.setdefault(service.menu_label, service)
+            self.services[service_cls] = services
+        return services.get(str(label))
+
+
+REVEAL_RULE_FIELDS = ["trigger", "time", "delay_minutes", "show_zero_points_immediately"]
+# The fields that update_learning_objects may change in existing learning objects
+LEARNING_OBJECT_FIELDS = [
+    "lti_service", "context_id", "resource_link_id", "aplus_get_and_post", "open_in_iframe", "custom",
+    "allow_assistant_viewing", "allow_assistant_grading", "min_group_size", "max_group_size",
+    "max_submissions", "max_points", "points_to_pass", "difficulty",
+    "submission_feedback_reveal_rule", "model_solutions_reveal_rule", "grading_mode",
+    "generate_table_of_contents", "category", "order", "service_url", "status", "audience", "name",
+    "description", "use_wide_column", "exercise_info", "model_answers", "templates",
+]
+# The fields that configure may change in existing modules
+MODULE_FIELDS = [
+    "order", "name", "status", "points_to_pass", "introduction", "opening_time", "closing_time",
+    "reading_opening_time", "late_submission_deadline", "late_submissions_allowed",
+    "late_submission_penalty", "model_answer", "model_solution_reveal_rule",
+]
+CATEGORY_FIELDS = [
+    "status", "description", "points_to_pass", "confirm_the_level", "accept_unofficial_submits",
+]
+
+
 ChangesGetter = Callable[[dict, dict], Optional[dict]]
 
 
@@ -246,14 +315,35 @@ def update_learning_objects( # pylint: disable=too-many-locals too-many-branches
         configs: Dict[str, Dict[str, Any]],
         learning_objects: Dict[str, LearningObject],
         errors: List[str],
+        lti_services: Optional[LTIServices] = None,
         ) -> None:
     """Configures learning objects.
 
+    New learning objects are saved one by one, as bulk_create does not support
+    inherited models. Existing ones are saved with bulk_update, which does not
+    send the save signals, so the caller must invalidate the caches.
+
     :param category_map: maps category keys to LearningObjectCategory objects
     :param configs: maps lobject keys to their configs
     :param learning_objects: maps lobject keys to LearningObject objects
     :param errors: list to append errors to
+    :param lti_services: finds the LTI services by menu label
     """
+    if lti_services is None:
+        lti_services = LTIServices()
+    reveal_rule_configs = [
+        ("reveal_submission_feedback", "submission_feedback_reveal_rule"),
+        ("reveal_model_solutions", "model_solutions_reveal_rule"),
+    ]
+    # Load the current reveal rules of the changed learning objects at once
+    current_rules = RevealRule.objects.in_bulk({
+        getattr(learning_objects[key], lobject_key + "_id", None)
+        for key, o in configs.items()
+        for config_key, lobject_key in reveal_rule_configs
+        if o.get(config_key)
+    } - {None})
+    rules: List[RevealRule] = []
+
     for key, o in configs.items():
         lobject = learning_objects[key]
 
@@ -262,7 +352,7 @@ def update_learning_objects( # pylint: disable=too-many-locals too-many-branches
 
         if lobject_cls == LTIExercise:
             # validate_lobjects checks that this exists
-            lobject.lti_service = LTIService.objects.filter(menu_label=str(o["lti"])).first()
+            lobject.lti_service = lti_services.get(LTIService, o["lti"])
 
             for key in [
                 "context_id",
@@ -280,7 +370,7 @@ def update_learning_objects( # pylint: disable=too-many-locals too-many-branches
                     setattr(lobject, key, parse_bool(o[obj_key]))
 
         if lobject_cls == LTI1p3Exercise:
-            lobject.lti_service = LTI1p3Service.objects.filter(menu_label=str(o["lti1p3"])).first()
+            lobject.lti_service = lti_services.get(LTI1p3Service, o["lti1p3"])
             if "lti_custom" in o:
                 lobject.custom = o['lti_custom']
             if "lti_open_in_iframe" in o:
@@ -306,15 +396,14 @@ def update_learning_objects( # pylint: disable=too-many-locals too-many-branches
                         setattr(lobject, key, i)
             if "difficulty" in o:
                 lobject.difficulty = o["difficulty"]
-            for config_key, lobject_key in [
-                ("reveal_submission_feedback", "submission_feedback_reveal_rule"),
-                ("reveal_model_solutions", "model_solutions_reveal_rule"),
-            ]:
+            for config_key, lobject_key in reveal_rule_configs:
                 rule_config = o.get(config_key)
                 if not rule_config:
                     continue
-                rule = getattr(lobject, lobject_key)
-                rule = parse_reveal_rule(rule_config, config_key, rule, errors)
+                rule = current_rules.get(getattr(lobject, lobject_key + "_id"))
+                rule = parse_reveal_rule(rule_config, config_key, rule, errors, save=False)
+                if rule is not None:
+                    rules.append(rule)
                 setattr(lobject, lobject_key, rule)
             if "grading_mode" in o:
                 grading_mode = parse_choices(o["grading_mode"], {
@@ -365,8 +454,22 @@ def update_learning_objects( # pylint: disable=too-many-locals too-many-branches
         if "exercise_template" in o:
             lobject.templates = format_localization(o["exercise_template"])
 
-        lobject.full_clean()
-        lobject.save()
+    # The reveal rules need their primary keys before the learning objects are saved
+    save_new([rule for rule in rules if rule.pk is None])
+    save_changed([rule for rule in rules if rule.pk is not None], REVEAL_RULE_FIELDS)
+
+    changed = []
+    for key in configs:
+        lobject = learning_objects[key]
+        if lobject.pk is None:
+            lobject.full_clean()
+            lobject.save()
+        else:
+            # The module, parent and url of an existing learning object are not
+            # changed here, so they are still unique
+            lobject.full_clean(validate_unique=False)
+            changed.append(lobject)
+    save_changed(changed, LEARNING_OBJECT_FIELDS)
 
 
 def get_build_log(instance):
@@ -412,6 +515,7 @@ def validate_lobject(
         config: dict,
         category_key_to_name: Dict[str,str],
         errors: List[str],
+        lti_services: Optional[LTIServices] = None,
         ):
     """Check that config is valid.
 
@@ -436,12 +540,14 @@ def validate_lobject(
     lobject_cls = lobject_class(config)
 
     if lobject_cls in (LTIExercise, LTI1p3Exercise):
+        if lti_services is None:
+            lti_services = LTIServices()
         if lobject_cls == LTIExercise:
             conf = config["lti"]
-            lti = LTIService.objects.filter(menu_label=str(conf)).first()
+            lti = lti_services.get(LTIService, conf)
         else:
             conf = config["lti1p3"]
-            lti = LTI1p3Service.objects.filter(menu_label=str(conf)).first()
+            lti = lti_services.get(LTI1p3Service, conf)
         if not lti:
             errors.append(
                 format_lazy(
@@ -488,7 +594,9 @@ class ConfigParts:
     module_lobject_keys: Dict[str, Set[Any]]
 
     @staticmethod
-    def from_config(config: dict, errors: List[str]):
+    def from_config(config: dict, errors: List[str], lti_services: Optional[LTIServices] = None):
+        if lti_services is None:
+            lti_services = LTIServices()
         categories_config = {}
         category_key_to_name = {}
         for category_key, c in config.get("categories", {}).items():
@@ -509,7 +617,7 @@ class ConfigParts:
             # Invalid configs aren't saved in cache with this
             children = [
                 c for c in config.get("children", [])
-                if validate_lobject(c, category_key_to_name, errors)
+                if validate_lobject(c, category_key_to_name, errors, lti_services)
             ]
             n = set_order_information(children, n)
 
@@ -601,6 +709,37 @@ class ConfigParts:
         )
 
 
+def set_children(configs: Dict[str, Dict[str, Any]], learning_objects: Dict[str, LearningObject]) -> None:
+    """Sets the children of the configured learning objects like calling
+    children.set() for each of them would, with one bulk update.
+
+    :param configs: maps lobject keys to their configs
+    :param learning_objects: maps lobject keys to saved LearningObject objects
+    """
+    parents = [learning_objects[key] for key in configs]
+    new_parents: Dict[int, Optional[LearningObject]] = {
+        child_id: None
+        for child_id in LearningObject.bare_objects
+            .filter(parent__in=[parent for parent in parents if parent.pk is not None])
+            .values_list('id', flat=True)
+    }
+    for key, parent in zip(configs, parents):
+        for child_key in configs[key]["children"]:
+            new_parents[learning_objects[child_key].id] = parent
+
+    by_id = {obj.id: obj for obj in learning_objects.values()}
+    changed = []
+    for child_id, parent in new_parents.items():
+        child = by_id.get(child_id)
+        if child is None:
+            # An old child that is not in the config, e.g. an outdated one
+            child = LearningObject.bare_objects.only('id', 'parent').get(id=child_id)
+        if child.parent_id != (parent.id if parent else None):
+            child.parent = parent
+            changed.append(child)
+    LearningObject.bare_objects.bulk_update(changed, ['parent'])
+
+
 # pylint: disable-next=too-many-locals too-many-branches too-many-statements
 def configure(instance: CourseInstance, new_config: dict) -> Tuple[bool, List[str]]: # noqa: MC0001
     new_config = copy.deepcopy(new_config)
@@ -616,15 +755,17 @@ def configure(instance: CourseInstance, new_config: dict) -> Tuple[bool, List[st
 
     # Get the previous config (the one used in the last successful update)
     old_cparts = instance.get_cached_config()
-    new_cparts = ConfigParts.from_config(new_config, errors)
+    lti_services = LTIServices()
+    new_cparts = ConfigParts.from_config(new_config, errors, lti_services)
     # Get the changes between the new config and the previous config with some auxiliary information.
     # See ConfigParts and ConfigParts.diff for more info
     cparts = ConfigParts.diff(old_cparts, new_cparts)
 
     config = cparts.config
 
-    # wrap everything in a transaction to make sure invalid configuration isn't saved
-    with transaction.atomic():
+    # wrap everything in a transaction to make sure invalid configuration isn't saved.
+    # The cache invalidations of the saved objects are written once at commit.
+    with transaction.atomic(), invalidation_batch():
         # Configure course instance attributes.
         if "start" in config:
             dt = parse_date(config["start"], errors)
@@ -745,10 +886,11 @@ def configure(instance: CourseInstance, new_config: dict) -> Tuple[bool, List[st
         }
 
         # Configure learning object categories.
+        changed_categories = []
         for category in list(old_categories) + new_categories:
             if category.name not in cparts.category_names:
                 category.status = LearningObjectCategory.STATUS.HIDDEN
-                category.save()
+                changed_categories.append(category)
                 continue
 
             # Skip unchanged categories
@@ -771,17 +913,18 @@ def configure(instance: CourseInstance, new_config: dict) -> Tuple[bool, List[st
             ]:
                 if field in c:
                     setattr(category, field, parse_bool(c[field]))
-            category.full_clean()
-            category.save()
+            category.full_clean(validate_unique=category.pk is None)
+            if category.pk is not None:
+                changed_categories.append(category)
+        save_new([category for category in new_categories if category.name in cparts.categories])
+        save_changed(changed_categories, CATEGORY_FIELDS)
 
         old_modules = instance.course_modules.defer(None).all()
 
         # Create new modules
         new_module_keys = cparts.modules.keys() - (c.url for c in old_modules)
         new_modules = [CourseModule(course_instance=instance, url=key) for key in new_module_keys]
-        # bulk_create doesn't get generated primary keys, so we need to save them individually
-        for module in new_modules:
-            module.save()
+        save_new(new_modules)
 
         # Update the learning objects within each of the new and old modules
         for module in list(old_modules) + new_modules:
@@ -823,14 +966,11 @@ def configure(instance: CourseInstance, new_config: dict) -> Tuple[bool, List[st
                     lobjects_config,
                     lobject_map,
                     errors,
+                    lti_services,
                 )
 
                 # We can't set the children until they have been saved by update_learning_objects
-                for key, lobject_config in lobjects_config.items():
-                    lobject_map[key].children.set(
-                        lobject_map[child_key]
-                        for child_key in lobject_config["children"]
-                    )
+                set_children(lobjects_config, lobject_map)
 
             # Delete or hide learning objects that are not included in the module anymore
             for lobject in outdated_lobjects:
@@ -846,6 +986,7 @@ def configure(instance: CourseInstance, new_config: dict) -> Tuple[bool, List[st
                     lobject.save(update_fields=["status", "order"])
 
         # Update the modules
+        changed_modules = []
         for module in list(old_modules) + new_modules:
             #  Delete/hide any old modules not present in new version
             if module.url not in cparts.module_keys:
@@ -853,7 +994,7 @@ def configure(instance: CourseInstance, new_config: dict) -> Tuple[bool, List[st
                     module.delete()
                 else:
                     module.status = CourseModule.STATUS.HIDDEN
-                    module.save()
+                    changed_modules.append(module)
 
                 continue
 
@@ -926,14 +1067,20 @@ def configure(instance: CourseInstance, new_config: dict) -> Tuple[bool, List[st
                     errors,
                 )
 
-            module.full_clean()
-            module.save()
+            # The url of a module does not change, so it is still unique
+            module.full_clean(validate_unique=False)
+            changed_modules.append(module)
+        save_changed(changed_modules, MODULE_FIELDS)
 
         # Clean up obsolete categories.
         for category in instance.categories.filter(status=LearningObjectCategory.STATUS.HIDDEN):
             if not category.learning_objects.exists():
                 category.delete()
 
+        # The bulk updates do not send the save signals that invalidate the caches
+        CachedContent.invalidate(instance)
+        invalidate_instance(instance)
+
         if "publish_url" in config:
             success = False
             publish_errors = []
@@ -0,0 +1,52 @@
+from typing import Dict, Iterable
+
+from django.db import transaction
+
+from course.models import CourseInstance
+from exercise.cache.content import CachedContent
+from exercise.models import LearningObject
+
+
+def _number_children(parent, n: int, orders: Dict[int, int]) -> int:
+    for entry in parent.children:
+        orders[entry.id] = n
+        _number_children(entry, 1, orders)
+        n += 1
+    return n
+
+
+def content_orders(modules: Iterable, course_wide: bool = False) -> Dict[int, int]:
+    """
+    Returns the new order of each learning object in the content tree by id.
+    The learning objects are numbered from 1 within each parent, or, if
+    course_wide is set, the top level learning objects are numbered across the
+    visible modules.
+    """
+    orders: Dict[int, int] = {}
+    n = 1
+    for module in modules:
+        nn = _number_children(module, n if course_wide else 1, orders)
+        if course_wide and module.status != 'hidden':
+            n = nn
+    return orders
+
+
+def renumber_content(instance: CourseInstance, course_wide: bool = False) -> int:
+    """
+    Renumbers the learning objects of the course instance in the order of
+    CachedContent. The changed orders are saved with one bulk_update, which
+    does not send the save signals, and the content caches are invalidated
+    once. Returns the number of changed learning objects.
+    """
+    content = CachedContent(instance)
+    orders = content_orders(content.modules(), course_wide)
+    changed = [
+        LearningObject(id=entry.id, order=orders[entry.id])
+        for entry in content.data.exercise_index.values()
+        if entry.id in orders and entry.order != orders[entry.id]
+    ]
+    if changed:
+        with transaction.atomic():
+            LearningObject.bare_objects.bulk_update(changed, ['order'])
+            CachedContent.invalidate(instance)
+    return len(changed)
@@ -9,7 +9,7 @@ from django.utils import timezone
 
 from .configure import configure, parse_bool
 from course.models import Course, CourseInstance, CourseModule, LearningObjectCategory
-from exercise.models import LearningObject, CourseChapter, BaseExercise, LTIExercise
+from exercise.models import LearningObject, CourseChapter, BaseExercise, LTIExercise, RevealRule
 from external_services.models import LTIService
 
 
@@ -199,6 +199,45 @@ class ConfigureTest(TestCase):
 
         self.configure_and_test()
 
+    def test_moving_exercises(self):
+        self.config = {
+            "categories": {"cat1": deepcopy(category_configs["cat1"])},
+            "modules": [{"key": "module1"}],
+        }
+        self.insert_exercise(
+            self.config,
+            self.get_exercise_config("CourseChapter", 0, "test_chapter1"),
+            0,
+        )
+        self.insert_exercise(
+            self.config,
+            self.get_exercise_config("CourseChapter", 0, "test_chapter2"),
+            0,
+        )
+        exercise_config = self.get_exercise_config("BaseExercise", 0, "test_moved")
+        exercise_config["reveal_submission_feedback"] = {"trigger": "immediate"}
+        self.insert_exercise(self.config, exercise_config, 0, [0])
+
+        self.configure_and_test()
+        exercise = BaseExercise.objects.get(course_module__course_instance=self.instance, url="test_moved")
+        rule_id = exercise.submission_feedback_reveal_rule_id
+
+        # Move the exercise to the other chapter and change its reveal rule
+        self.remove_exercise(self.config, 0, [0])
+        exercise_config["reveal_submission_feedback"] = {"trigger": "deadline"}
+        self.insert_exercise(self.config, exercise_config, 0, [1])
+
+        self.configure_and_test()
+        exercise = BaseExercise.objects.get(course_module__course_instance=self.instance, url="test_moved")
+        self.assertEqual(exercise.submission_feedback_reveal_rule_id, rule_id)
+        self.assertEqual(exercise.submission_feedback_reveal_rule.trigger, RevealRule.TRIGGER.DEADLINE)
+
+        # Move the exercise to the top level of the module
+        self.remove_exercise(self.config, 0, [1])
+        self.insert_exercise(self.config, exercise_config, 0)
+
+        self.configure_and_test()
+
     def test_changing_type(self):
         exercise_types = set(exercise_configs.keys())
         # test every pair of exercise types
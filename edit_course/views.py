@@ -1,8 +1,6 @@
 import urllib.parse
 
 from aplus_auth.payload import Permission, Permissions
-from aplus_auth.requests import post as aplus_post
-from aplus_auth.requests import put as aplus_put
 from django.conf import settings
 from django.contrib import messages
 from django.db import models, IntegrityError
@@ -29,12 +27,14 @@ from course.viewbase import CourseInstanceMixin
 from exercise.cache.content import CachedContent
 from exercise.cache.exercise import invalidate_instance
 from exercise.cache.hierarchy import NoSuchContent
-from exercise.models import LearningObject
+from lib.cache.transact import invalidation_batch
+from lib.http_pool import aplus_post, aplus_put
 from .course_forms import CourseInstanceForm, CourseIndexForm, \
     CourseContentForm, CloneInstanceForm, GitmanagerForm, UserTagForm, SelectUsersForm, SubmissionTagForm
 from .managers import CategoryManager, ModuleManager, ExerciseManager
 from .operations.batch import create_submissions
 from .operations.configure import configure_from_url, get_build_log
+from .operations.renumber import renumber_content
 from lib.logging import SecurityLog
 from userprofile.models import UserProfile
 
@@ -101,27 +101,14 @@ class EditContentView(EditInstanceView):
     def get_success_url(self):
         return self.instance.get_url('course-edit')
 
+    @invalidation_batch()
     def form_valid(self, form):
         if self.request.POST.get('renumbermodule') is not None:
-            for module in self.content.modules():
-                self.renumber_recursion(module)
+            renumber_content(self.instance)
         elif self.request.POST.get('renumbercourse') is not None:
-            n = 1
-            for module in self.content.modules():
-                nn = self.renumber_recursion(module, n)
-                if module.status != 'hidden':
-                    n = nn
+            renumber_content(self.instance, course_wide=True)
         return super().form_valid(form)
 
-    def renumber_recursion(self, parent, n=1):
-        for entry in parent.children:
-            model = LearningObject.objects.get(id=entry['id'])
-            model.order = n
-            model.save()
-            self.renumber_recursion(entry)
-            n += 1
-        return n
-
 
 class ModelBaseMixin(CourseInstanceMixin):
     access_mode = ACCESS.TEACHER
@@ -1,5 +1,5 @@
 from collections import OrderedDict
-from typing import List
+from typing import Any, Dict, Iterator, List, Tuple
 
 from django.conf import settings
 
@@ -13,79 +13,96 @@ from exercise.cache.content import LearningObjectContent
 # For convenience, we also return the total submission count and points for student
 
 # pylint: disable-next=too-many-locals
-def aggregate_points(profiles, taggings, exercises: List[LearningObjectContent], aggregate):
+def aggregate_points(
+        profiles,
+        taggings,
+        exercises: List[LearningObjectContent],
+        aggregate,
+        ) -> Tuple[Iterator[Dict[str, Any]], List[str]]:
+    """
+    Returns the rows of the sheet and its fields. The rows are generated
+    lazily from per-student columns of counts and points, which are filled
+    from the aggregate in a single pass.
+    """
     DEFAULT_FIELDS = [
         'UserID', 'StudentID', 'Email', 'Name', 'Tags', 'Organization', 'Count', 'Total',
     ]
-    OBJECT_FIELDS = [
-        '{} Count', '{} Total',
-    ]
-
-    exercise_fields = []
 
+    # Column of each exercise and the names of its fields
+    columns = {}
+    column_fields = []
     for e in exercises:
-        for n in OBJECT_FIELDS:
-            exercise_fields.append(n.format(e.id))
+        columns[e.id] = len(column_fields)
+        column_fields.append((f'{e.id} Count', f'{e.id} Total'))
+    exercise_fields = [name for names in column_fields for name in names]
+
+    profiles = list(profiles)
+    student_index = {profile.user.id: i for i, profile in enumerate(profiles)}
+    # None marks the exercises the student has not submitted to
+    counts: List[List[Any]] = [[None] * len(column_fields) for _ in profiles]
+    totals: List[List[Any]] = [[None] * len(column_fields) for _ in profiles]
+    # The submitted columns of each student in the order of the aggregate
+    submitted: List[List[int]] = [[] for _ in profiles]
 
-    agg = {}
     # Gather exercise points per student
     for row in aggregate:
+        i = student_index.get(row['submitters__user_id'])
+        if i is None:
+            continue
         ex = row['exercise_id']
+        j = columns.get(ex)
+        if j is None:
+            # Not one of the given exercises, but still included in the rows
+            j = columns[ex] = len(column_fields)
+            column_fields.append((f'{ex} Count', f'{ex} Total'))
+            for student_counts, student_totals in zip(counts, totals):
+                student_counts.append(None)
+                student_totals.append(None)
+        if counts[i][j] is None:
+            submitted[i].append(j)
+        counts[i][j] = row['count']
+        totals[i][j] = row['total']
 
-        values = [row['count'],row['total']]
-        user_row = agg.get(row['submitters__user_id'], {})
-        user_row[ex] = values
-        agg[row['submitters__user_id']] = user_row
-
-    # Prefetch all tag_id - user_id pairs at once from DB to avoid multiple queries
+    # Index the tag_id - user_id pairs by user. They are all fetched at once
+    # from DB to avoid multiple queries.
     # TODO: Ideally this should probably be done in api.csv.views
-    all_tags = list(taggings.all().values('user_id','tag_id'))
+    user_tags: Dict[int, List[str]] = {}
+    for item in taggings.values('user_id', 'tag_id'):
+        user_tags.setdefault(item['user_id'], []).append(str(item['tag_id']))
 
-    sheet = []
+    external_label = settings.EXTERNAL_USER_LABEL.lower()
+    internal_label = settings.INTERNAL_USER_LABEL.lower()
 
-    for profile in profiles:
-        uid = profile.user.id
-        user_row = agg.get(uid, {})
-        user_tags = [
-            settings.EXTERNAL_USER_LABEL.lower() if profile.is_external else settings.INTERNAL_USER_LABEL.lower()
-        ]
-        # Instead of filtering the Django resultset (which causes a new DB query),
-        # we find the users' tags manually from the prefetched array of dicts
-        other_tags = list(item for item in all_tags if item["user_id"] == profile.id)
-        #other_tags = all_tags.all().filter(user_id=profile.id)
-        for tag in other_tags:
-            user_tags.append(str(tag['tag_id']))
-        #user_tags.extend(tags.get(uid, []))
-        row = OrderedDict([
-            ('UserID', uid),
-            ('Email', profile.user.email),
-            ('StudentID', profile.student_id),
-            ('Name', profile.user.first_name + ' ' + profile.user.last_name),
-            ('Tags', '|'.join(user_tags)),
-            ('Organization', profile.organization),
-        ])
+    def rows() -> Iterator[Dict[str, Any]]:
+        for i, profile in enumerate(profiles):
+            tags = [external_label if profile.is_external else internal_label]
+            tags.extend(user_tags.get(profile.id, []))
+            row = OrderedDict([
+                ('UserID', profile.user.id),
+                ('Email', profile.user.email),
+                ('StudentID', profile.student_id),
+                ('Name', profile.user.first_name + ' ' + profile.user.last_name),
+                ('Tags', '|'.join(tags)),
+                ('Organization', profile.organization),
+            ])
 
-        # Add submitted exercise count and points of the user as labeled dictionary items
-        # so for example if agg[uid] is {14: [1,10]}, it is turned into:
-        # "14 Count": 1
-        # "14 Total": 10
-        #
-        if uid in agg:
-            student_totalsubs = 0
-            student_totalscore = 0
-            try:
-                for e in agg[uid]:
-                    row[str(e) + ' Count'] = agg[uid][e][0]
-                    student_totalsubs += agg[uid][e][0]
-                    row[str(e) + ' Total'] = agg[uid][e][1]
-                    student_totalscore += agg[uid][e][1]
-            except KeyError:
-                pass
+            # Add submitted exercise count and points of the user as labeled dictionary items
+            # so for example if the user has 1 submission and 10 points in exercise 14:
+            # "14 Count": 1
+            # "14 Total": 10
+            #
+            if submitted[i]:
+                student_counts = counts[i]
+                student_totals = totals[i]
+                for j in submitted[i]:
+                    count_field, total_field = column_fields[j]
+                    row[count_field] = student_counts[j]
+                    row[total_field] = student_totals[j]
 
-            # Add totals per student
-            row['Count'] = student_totalsubs
-            row['Total'] = student_totalscore
+                # Add totals per student
+                row['Count'] = sum(student_counts[j] for j in submitted[i])
+                row['Total'] = sum(student_totals[j] for j in submitted[i])
 
-        sheet.append(row)
+            yield row
 
-    return sheet, DEFAULT_FIELDS + exercise_fields
+    return rows(), DEFAULT_FIELDS + exercise_fields
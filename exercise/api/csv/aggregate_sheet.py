@@ -1,5 +1,5 @@
 from collections import OrderedDict
-from typing import List, Union
+from typing import Any, Dict, Iterator, List, Tuple, Union
 
 from exercise.cache.content import ModuleContent, LearningObjectContent
 
@@ -11,7 +11,7 @@ def aggregate_sheet(
         exercises: List[Union[ModuleContent, LearningObjectContent]],
         aggregate,
         number,
-        ):
+        ) -> Tuple[Iterator[Dict[str, Any]], List[str]]:
     DEFAULT_FIELDS = [
       'UserID', 'StudentID', 'Email', 'Tags',
     ]
@@ -57,18 +57,25 @@ def aggregate_sheet(
             exercise_map[e.id] = num
             exercise_max[num] += e.max_points
 
-    agg = {}
+    # Column of each included object
+    num_columns = {num: i for i, num in enumerate(exercise_nums)}
+    exercise_columns = {eid: num_columns[num] for eid, num in exercise_map.items()}
+    column_max = [exercise_max[num] for num in exercise_nums]
+    column_fields = [exercise_fields[3 * i:3 * i + 3] for i in range(len(exercise_nums))]
+
+    profiles = list(profiles)
+    student_index = {profile.user.id: i for i, profile in enumerate(profiles)}
+    counts = [[0] * len(exercise_nums) for _ in profiles]
+    totals = [[0] * len(exercise_nums) for _ in profiles]
     for row in aggregate:
-        uid = row['submitters__user_id']
-        num = exercise_map.get(row['exercise_id'], None)
-        if num is None:
+        j = exercise_columns.get(row['exercise_id'])
+        if j is None:
+            continue
+        i = student_index.get(row['submitters__user_id'])
+        if i is None:
             continue
-        user_row = agg.get(uid, {})
-        values = user_row.get(num, [0,0])
-        values[0] += row['count']
-        values[1] += row['total']
-        user_row[num] = values
-        agg[uid] = user_row
+        counts[i][j] += row['count']
+        totals[i][j] += row['total']
 
     tags = {}
     for t in taggings:
@@ -77,27 +84,25 @@ def aggregate_sheet(
         else:
             tags[t.user_id] = [str(t.tag_id)]
 
-    sheet = []
-    for profile in profiles:
-        uid = profile.user.id
-        user_row = agg.get(uid, {})
-        user_tags = ['mooc' if profile.is_external else 'aalto']
-        user_tags.extend(tags.get(uid, []))
-        row = OrderedDict([
-            ('UserID', uid),
-            ('StudentID', profile.student_id),
-            ('Email', profile.user.email),
-            ('Tags', '|'.join(user_tags)),
-        ])
-        for i,num in enumerate(exercise_nums):
-            values = user_row.get(num, [0,0])
-            maxp = exercise_max[num]
-            for j in [0,1]:
-                row[exercise_fields[3 * i + j]] = values[j]
-            row[exercise_fields[3 * i + 2]] = (
-                values[1] / maxp if maxp > 0 else
-                1 if values[0] > 0 else 0
-            )
-        sheet.append(row)
+    def rows() -> Iterator[Dict[str, Any]]:
+        for i, profile in enumerate(profiles):
+            uid = profile.user.id
+            user_tags = ['mooc' if profile.is_external else 'aalto']
+            user_tags.extend(tags.get(uid, []))
+            row = OrderedDict([
+                ('UserID', uid),
+                ('StudentID', profile.student_id),
+                ('Email', profile.user.email),
+                ('Tags', '|'.join(user_tags)),
+            ])
+            for (count_field, total_field, ratio_field), count, total, maxp in zip(
+                    column_fields, counts[i], totals[i], column_max):
+                row[count_field] = count
+                row[total_field] = total
+                row[ratio_field] = (
+                    total / maxp if maxp > 0 else
+                    1 if count > 0 else 0
+                )
+            yield row
 
-    return sheet, DEFAULT_FIELDS + exercise_fields
+    return rows(), DEFAULT_FIELDS + exercise_fields
@@ -1,14 +1,24 @@
+from collections import Counter
 from datetime import timedelta
-
-from django.test import TestCase
+import gc
+import os
+from time import perf_counter
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.contrib.auth.models import User
 from django.utils import timezone
+from rest_framework.test import APIClient
 
 from course.models import Course, CourseInstance, CourseModule
 from exercise.models import BaseExercise, CourseChapter, LearningObjectCategory
 from exercise.submission_models import Submission
 
-from .views import CourseResultsDataViewSet
+from .aggregate_points import aggregate_points
+from .aggregate_sheet import aggregate_sheet
+from .views import CourseResultsDataViewSet, CSVStreamMixin
 
 class CourseResultsDataViewSetTest(TestCase):
     @classmethod
@@ -199,4 +209,210 @@ class CourseResultsDataViewSetTest(TestCase):
         create_submission(self.student_profile2, exercise=self.c1_mandatory_learning_object1, grade=2)
 
         self.assertEqual(query(True), all_submissions())
-        self.assertEqual(query(False), confirmed_submissions())
\ No newline at end of file
+        self.assertEqual(query(False), confirmed_submissions())
+
+    def test_csv_export_is_streamed(self):
+        teacher = User.objects.create(username="teacher")
+        self.course_instance1.add_teacher(teacher.userprofile)
+        for profile, exercise, grade in [
+            (self.student_profile, self.learning_object1, 1),
+            (self.student_profile, self.c1_learning_object1, 2),
+            (self.student_profile2, self.learning_object1, 3),
+        ]:
+            submission = Submission.objects.create(exercise=exercise, grade=grade, status=Submission.STATUS.READY)
+            submission.submitters.add(profile)
+
+        client = APIClient()
+        client.force_authenticate(user=teacher)
+        for endpoint in ('resultsdata', 'aggregatedata'):
+            url = f'/api/v2/courses/{self.course_instance1.id}/{endpoint}/'
+            with patch.object(CSVStreamMixin, 'is_streamed', return_value=False):
+                buffered = client.get(url, {'format': 'csv'})
+            self.assertFalse(buffered.streaming)
+
+            # One profile per chunk
+            with patch.object(CSVStreamMixin, 'stream_chunk_size', 1):
+                streamed = client.get(url, {'format': 'csv'})
+            self.assertTrue(streamed.streaming)
+            self.assertEqual(streamed['Content-Disposition'], buffered['Content-Disposition'])
+            self.assertEqual(streamed['Content-Type'], buffered['Content-Type'])
+
+            buffered_lines = buffered.content.decode().splitlines()
+            streamed_lines = b''.join(streamed.streaming_content).decode().splitlines()
+            self.assertEqual(len(streamed_lines), 3)
+            self.assertEqual(streamed_lines[0], buffered_lines[0])
+            self.assertCountEqual(streamed_lines, buffered_lines)
+
+
+class TaggingValues(list):
+    """Stands for a UserTagging queryset in aggregate_points"""
+    def values(self, *fields):
+        return [{field: getattr(tagging, field) for field in fields} for tagging in self]
+
+
+def generate_course(students, exercises):
+    profiles = [
+        SimpleNamespace(
+            id=100 + i,
+            user=SimpleNamespace(id=i, email=f"student{i}@aplus.com", first_name="Student", last_name=str(i)),
+            student_id=str(i),
+            is_external=i % 2 == 1,
+            organization="aalto.fi",
+        )
+        for i in range(students)
+    ]
+    taggings = TaggingValues(
+        SimpleNamespace(user_id=profile.id, tag_id=tag)
+        for profile in profiles
+        for tag in (1, 2)
+    )
+    exercise_list = [SimpleNamespace(id=1000 + j) for j in range(exercises)]
+    # Every student has submitted to every third exercise
+    aggregate = [
+        {'submitters__user_id': i, 'exercise_id': 1000 + j, 'count': 1 + j % 3, 'total': j % 5}
+        for i in range(students)
+        for j in range(0, exercises, 3)
+    ]
+    return profiles, taggings, exercise_list, aggregate
+
+
+@override_settings(EXTERNAL_USER_LABEL='MOOC', INTERNAL_USER_LABEL='Aalto')
+class AggregatePointsTest(SimpleTestCase):
+    def test_rows(self):
+        profiles, taggings, exercises, aggregate = generate_course(2, 4)
+        taggings.append(SimpleNamespace(user_id=101, tag_id=7))
+        aggregate.append({'submitters__user_id': 1, 'exercise_id': 1002, 'count': 2, 'total': 8})
+        rows, fields = aggregate_points(profiles, taggings, exercises, aggregate)
+        self.assertEqual(fields, [
+            'UserID', 'StudentID', 'Email', 'Name', 'Tags', 'Organization', 'Count', 'Total',
+            '1000 Count', '1000 Total', '1001 Count', '1001 Total',
+            '1002 Count', '1002 Total', '1003 Count', '1003 Total',
+        ])
+        self.assertEqual([dict(row) for row in rows], [
+            {
+                'UserID': 0, 'Email': 'student0@aplus.com', 'StudentID': '0', 'Name': 'Student 0',
+                'Tags': 'aalto|1|2', 'Organization': 'aalto.fi',
+                '1000 Count': 1, '1000 Total': 0, '1003 Count': 1, '1003 Total': 3,
+                'Count': 2, 'Total': 3,
+            },
+            {
+                'UserID': 1, 'Email': 'student1@aplus.com', 'StudentID': '1', 'Name': 'Student 1',
+                'Tags': 'mooc|1|2|7', 'Organization': 'aalto.fi',
+                '1000 Count': 1, '1000 Total': 0, '1003 Count': 1, '1003 Total': 3,
+                '1002 Count': 2, '1002 Total': 8,
+                'Count': 4, 'Total': 11,
+            },
+        ])
+
+    def test_single_pass(self):
+        # Each row of the aggregate is read once, so the work grows linearly
+        # with the number of students and submitted exercises
+        class Row(dict):
+            def __getitem__(self, key):
+                reads[key] += 1
+                return super().__getitem__(key)
+
+        for students in (10, 40):
+            reads = Counter()
+            profiles, taggings, exercises, aggregate = generate_course(students, 30)
+            rows, _ = aggregate_points(profiles, taggings, exercises, [Row(row) for row in aggregate])
+            self.assertEqual(sum(1 for _ in rows), students)
+            self.assertEqual(reads, Counter(dict.fromkeys(aggregate[0], len(aggregate))))
+
+    @skipUnless(os.environ.get('APLUS_BENCHMARK_TESTS'), "set APLUS_BENCHMARK_TESTS=1 to run")
+    def test_linear_scaling(self):
+        # The size of a large course: doubling the students doubles the time
+        times = []
+        for students in (1500, 3000):
+            profiles, taggings, exercises, aggregate = generate_course(students, 300)
+            best = float('inf')
+            for _ in range(3):
+                gc.collect()
+                start = perf_counter()
+                rows, _ = aggregate_points(profiles, taggings, exercises, aggregate)
+                self.assertEqual(sum(1 for _ in rows), students)
+                best = min(best, perf_counter() - start)
+            times.append(best)
+        self.assertLess(times[1] / times[0], 3)
+
+
+class SheetExercise(SimpleNamespace):
+    """Stands for a LearningObjectContent in aggregate_sheet"""
+
+
+def generate_sheet_course():
+    profiles = [
+        SimpleNamespace(
+            id=100 + i,
+            user=SimpleNamespace(id=i, email=f"student{i}@aplus.com"),
+            student_id=str(i),
+            is_external=i % 2 == 1,
+        )
+        for i in range(3)
+    ]
+    taggings = [
+        SimpleNamespace(user_id=1, tag_id=5),
+        SimpleNamespace(user_id=2, tag_id=5),
+        SimpleNamespace(user_id=2, tag_id=6),
+    ]
+    exercises = [
+        SimpleNamespace(number="1"),
+        SheetExercise(id=10, number="1.1", max_points=0),
+        SheetExercise(id=11, number="1.1.1", max_points=10),
+        SheetExercise(id=12, number="1.1.2", max_points=5),
+        SheetExercise(id=13, number="1.2", max_points=0),
+        SheetExercise(id=14, number="1.2.1", max_points=0),
+        SimpleNamespace(number="2"),
+        SheetExercise(id=20, number="2.1", max_points=8),
+        SheetExercise(id=21, number="2.2", max_points=2),
+        # The parents of these exercises are filtered out
+        SheetExercise(id=30, number="3.1.1", max_points=4),
+        SheetExercise(id=31, number="3.1.2", max_points=6),
+    ]
+    aggregate = [
+        {'submitters__user_id': i, 'exercise_id': eid, 'count': 1 + (i + eid) % 3, 'total': (i * eid) % 7}
+        for i in range(3)
+        for eid in (11, 12, 14, 20, 21, 30, 31)
+        if (i + eid) % 4
+    ]
+    # An exercise and a student that are not in the sheet
+    aggregate.append({'submitters__user_id': 1, 'exercise_id': 99, 'count': 1, 'total': 1})
+    aggregate.append({'submitters__user_id': 7, 'exercise_id': 11, 'count': 1, 'total': 1})
+    return profiles, taggings, exercises, aggregate
+
+
+@patch('exercise.api.csv.aggregate_sheet.LearningObjectContent', SheetExercise)
+class AggregateSheetTest(SimpleTestCase):
+    # The rows that aggregate_sheet returned before it was rewritten to use
+    # per-student columns. The values are compared by repr to tell 0 and 0.0 apart.
+    def assertSheetEqual(self, number, expected_fields, expected_rows):
+        rows, fields = aggregate_sheet(*generate_sheet_course(), number)
+        self.assertEqual(fields, expected_fields)
+        self.assertEqual(
+            [[(key, repr(value)) for key, value in row.items()] for row in rows],
+            [[(key, repr(value)) for key, value in zip(fields, values)] for values in expected_rows],
+        )
+
+    def test_modules(self):
+        self.assertSheetEqual(None, [
+            'UserID', 'StudentID', 'Email', 'Tags',
+            '1 Count', '1 Total', '1 Ratio', '2 Count', '2 Total', '2 Ratio', '3 Count', '3 Total', '3 Ratio',
+        ], [
+            [0, '0', 'student0@aplus.com', 'aalto', 6, 0, 0.0, 1, 0, 0.0, 3, 0, 0.0],
+            [1, '1', 'student1@aplus.com', 'mooc|5', 3, 5, 0.3333333333333333, 3, 6, 0.6, 2, 2, 0.2],
+            [2, '2', 'student2@aplus.com', 'aalto|5|6', 5, 4, 0.26666666666666666, 5, 5, 0.5, 1, 6, 0.6],
+        ])
+
+    def test_children(self):
+        self.assertSheetEqual("1", [
+            'UserID', 'StudentID', 'Email', 'Tags',
+            '1.1 Count', '1.1 Total', '1.1 Ratio', '1.2 Count', '1.2 Total', '1.2 Ratio',
+            '2.1 Count', '2.1 Total', '2.1 Ratio', '2.2 Count', '2.2 Total', '2.2 Ratio',
+            '3.1 Count', '3.1 Total', '3.1 Ratio',
+        ], [
+            [0, '0', 'student0@aplus.com', 'aalto', 3, 0, 0.0, 3, 0, 1, 0, 0, 0.0, 1, 0, 0.0, 3, 0, 0.0],
+            [1, '1', 'student1@aplus.com', 'mooc|5', 2, 5, 0.3333333333333333, 1, 0, 1, 1, 6, 0.75, 2, 0, 0.0,
+             2, 2, 0.2],
+            [2, '2', 'student2@aplus.com', 'aalto|5|6', 5, 4, 0.26666666666666666, 0, 0, 0, 2, 5, 0.625, 3, 0, 0.0,
+             1, 6, 0.6],
+        ])
@@ -1,4 +1,4 @@
-from typing import Any, Dict, Iterable, List, Optional, Set, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 from django.db.models import (
     Exists,
@@ -10,6 +10,7 @@ from django.db.models import (
 )
 from django.db.models.aggregates import Count
 from django.db.models.query import QuerySet
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets
 from rest_framework.request import Request
 from rest_framework.response import Response
@@ -17,7 +18,7 @@ from rest_framework.settings import api_settings
 from rest_framework_csv.renderers import CSVRenderer
 from rest_framework_extensions.mixins import NestedViewSetMixin
 
-from lib.api.renderers import CSVExcelRenderer
+from lib.api.renderers import CSVExcelRenderer, render_csv_stream
 from lib.api.core import APlusJSONRenderer
 from lib.api.mixins import MeUserMixin
 from lib.api.constants import REGEX_INT_ME
@@ -34,6 +35,64 @@ from .aggregate_sheet import aggregate_sheet
 from .aggregate_points import aggregate_points
 
 
+SheetBuilder = Callable[[List[UserProfile]], Tuple[List[Dict[str, Any]], List[str]]]
+
+
+class CSVStreamMixin:
+    """
+    Streams the CSV output of the list operation. The profiles are processed
+    in chunks of `stream_chunk_size`, so that the memory use does not depend
+    on the number of students in the course.
+    """
+    stream_chunk_size = 500
+
+    def is_streamed(self, request: Request) -> bool:
+        return (
+            self.action == 'list'
+            and isinstance(getattr(request, 'accepted_renderer', None), CSVRenderer)
+        )
+
+    def iterate_profile_chunks(self, profiles: QuerySet[UserProfile]) -> Iterator[List[UserProfile]]:
+        profiles = profiles.select_related('user').order_by('id')
+        last_id = 0
+        while True:
+            chunk = list(profiles.filter(id__gt=last_id)[:self.stream_chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1].id
+
+    def stream_profiles(
+            self,
+            request: Request,
+            profiles: QuerySet[UserProfile],
+            build_sheet: SheetBuilder,
+            filename: str,
+            ) -> StreamingHttpResponse:
+        """
+        Returns a response that renders the sheet as CSV one chunk of profiles
+        at a time. build_sheet returns the rows and the fields of the sheet
+        for a list of profiles.
+        """
+        # The fields do not depend on the profiles
+        _, fields = build_sheet([])
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            for chunk in self.iterate_profile_chunks(profiles):
+                sheet, _ = build_sheet(chunk)
+                yield from sheet
+
+        renderer = request.accepted_renderer
+        renderer_context = self.get_renderer_context()
+        renderer_context['header'] = fields
+        response = StreamingHttpResponse(
+            render_csv_stream(renderer, rows(), renderer_context),
+            content_type=f"{renderer.media_type}; charset={renderer.charset}",
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 class CourseSubmissionDataViewSet(NestedViewSetMixin,
                                   MeUserMixin,
                                   CourseResourceMixin,
@@ -170,6 +229,7 @@ class CourseSubmissionDataViewSet(NestedViewSetMixin,
 
 class CourseAggregateDataViewSet(NestedViewSetMixin,
                                  MeUserMixin,
+                                 CSVStreamMixin,
                                  CourseResourceMixin,
                                  viewsets.ReadOnlyModelViewSet):
     """
@@ -238,26 +298,35 @@ class CourseAggregateDataViewSet(NestedViewSetMixin,
         ids = [e.id for e in exercises if e.type == 'exercise']
         points = CachedPoints(self.instance, request.user, self.is_course_staff)
         revealed_ids = get_revealed_exercise_ids(search_args, points)
-        aggr = (
-            Submission.objects
-            .filter(exercise__in=ids, submitters__in=profiles)
-            .exclude(status__in=(
-                Submission.STATUS.UNOFFICIAL, Submission.STATUS.ERROR, Submission.STATUS.REJECTED,
-            ))
-            .values('submitters__user_id', 'exercise_id')
-            .annotate(count=Count('id'))
-            .annotate_submitter_points('total', revealed_ids)
-            .order_by()
-        )
-        data,fields = aggregate_sheet(
-            profiles,
-            self.instance.taggings.all(),
-            exercises,
-            aggr,
-            entry.number if entry else "",
-        )
+
+        taggings = self.instance.taggings.all()
+        streamed = self.is_streamed(request)
+
+        def build_sheet(profiles):
+            aggr = (
+                Submission.objects
+                .filter(exercise__in=ids, submitters__in=profiles)
+                .exclude(status__in=(
+                    Submission.STATUS.UNOFFICIAL, Submission.STATUS.ERROR, Submission.STATUS.REJECTED,
+                ))
+                .values('submitters__user_id', 'exercise_id')
+                .annotate(count=Count('id'))
+                .annotate_submitter_points('total', revealed_ids)
+                .order_by()
+            )
+            return aggregate_sheet(
+                profiles,
+                taggings.filter(user__in=profiles) if streamed else taggings,
+                exercises,
+                aggr,
+                entry.number if entry else "",
+            )
+
+        if streamed:
+            return self.stream_profiles(request, profiles, build_sheet, 'aggregate.csv')
+        rows,fields = build_sheet(profiles)
         self.renderer_fields = fields
-        response = Response(data)
+        response = Response(list(rows))
         if isinstance(getattr(request, 'accepted_renderer'), CSVRenderer):
             response['Content-Disposition'] = 'attachment; filename="aggregate.csv"'
         return response
@@ -269,6 +338,7 @@ class CourseAggregateDataViewSet(NestedViewSetMixin,
 
 
 class CourseResultsDataViewSet(NestedViewSetMixin,
+                               CSVStreamMixin,
                                CourseResourceMixin,
                                viewsets.ReadOnlyModelViewSet):
     """
@@ -420,15 +490,26 @@ class CourseResultsDataViewSet(NestedViewSetMixin,
         if not show_unofficial:
             exclude_list.append(Submission.STATUS.UNOFFICIAL)
         show_unconfirmed = request.GET.get('show_unconfirmed') == 'true'
-        aggr = self.get_submissions_query(ids, profiles, exclude_list, revealed_ids, show_unofficial, show_unconfirmed)
-        data,fields = aggregate_points(
-            profiles,
-            self.instance.taggings.all(),
-            exercises,
-            aggr,
-        )
+
+        taggings = self.instance.taggings.all()
+        streamed = self.is_streamed(request)
+
+        def build_sheet(profiles):
+            aggr = self.get_submissions_query(
+                ids, profiles, exclude_list, revealed_ids, show_unofficial, show_unconfirmed,
+            )
+            return aggregate_points(
+                profiles,
+                taggings.filter(user__in=profiles) if streamed else taggings,
+                exercises,
+                aggr,
+            )
+
+        if streamed:
+            return self.stream_profiles(request, profiles, build_sheet, 'aggregate.csv')
+        rows,fields = build_sheet(profiles)
         self.renderer_fields = fields
-        response = Response(data)
+        response = Response(list(rows))
         if isinstance(getattr(request, 'accepted_renderer'), CSVRenderer):
             response['Content-Disposition'] = 'attachment; filename="aggregate.csv"'
         return response
@@ -1,5 +1,6 @@
 from typing import Any, Dict, Optional
 
+from django.db import models
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 
@@ -100,12 +101,40 @@ class ExercisePointsSerializer(serializers.Serializer):
         return exercise_data
 
 
+class UserPointsListSerializer(serializers.ListSerializer):
+    """Resolves the points of all listed users at once instead of one by one"""
+
+    def to_representation(self, data):
+        profiles = list(data.all() if isinstance(data, models.Manager) else data)
+        view = self.context['view']
+        self.child.prefetched_points = {
+            points.user.id: points
+            for points in CachedPoints.get_many(
+                view.instance,
+                [profile.user for profile in profiles],
+                view.is_course_staff,
+            )
+        }
+        return super().to_representation(profiles)
+
+
 class UserPointsSerializer(UserWithTagsSerializer):
+    # Filled by UserPointsListSerializer when the users are listed
+    prefetched_points: Dict[int, CachedPoints]
+
+    class Meta(UserWithTagsSerializer.Meta):
+        list_serializer_class = UserPointsListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prefetched_points = {}
 
     def to_representation(self, obj: UserProfile) -> Dict[str, Any]: # pylint: disable=arguments-renamed
         rep = super().to_representation(obj)
         view = self.context['view']
-        points = CachedPoints(view.instance, obj.user, view.is_course_staff)
+        points = self.prefetched_points.get(obj.user.id)
+        if points is None:
+            points = CachedPoints(view.instance, obj.user, view.is_course_staff)
         modules = []
         for module in points.modules_flatted():
             module_data = {}
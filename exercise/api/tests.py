@@ -1,8 +1,20 @@
-from django.test import TestCase
+from io import BytesIO
+import os
+from tempfile import TemporaryDirectory
+from time import time
+import zipfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from django.contrib.auth.models import User
-from course.models import Course, CourseInstance
-from exercise.models import LearningObjectCategory
+from course.models import Course, CourseInstance, CourseModule
+from exercise.models import BaseExercise, LearningObjectCategory, Submission
+from exercise.submission_zip import archive_name, delete_expired_archives
 from django.utils import timezone
 from datetime import timedelta
 
@@ -85,3 +97,140 @@ class ExerciceSubmissionAPITest(TestCase):
         client.force_authenticate(user=self.student)
         response = client.get('/api/v2/submissions/1/')
         self.assertEqual(response.data, {'detail': 'Not found.'})
+
+
+class SubmissionZipTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student1 = User.objects.create(username="student1", first_name="First", last_name="Student")
+        cls.student1.userprofile.student_id = "111"
+        cls.student1.userprofile.save()
+        cls.student2 = User.objects.create(username="student2", first_name="Second", last_name="Student")
+        cls.student2.userprofile.student_id = "222"
+        cls.student2.userprofile.save()
+        cls.teacher = User.objects.create(username="teacher")
+
+        cls.today = timezone.now()
+        course = Course.objects.create(name="test course", code="123456", url="Course-Url")
+        cls.course_instance = CourseInstance.objects.create(
+            instance_name="Fall 2011 day 1",
+            starting_time=cls.today,
+            ending_time=cls.today + timedelta(days=1),
+            course=course,
+            url="T-00.1000_d1",
+        )
+        cls.course_instance.add_teacher(cls.teacher.userprofile)
+        cls.course_instance.enroll_student(cls.student1)
+        cls.course_instance.enroll_student(cls.student2)
+        module = CourseModule.objects.create(
+            name="test module",
+            url="test-module",
+            course_instance=cls.course_instance,
+            opening_time=cls.today,
+            closing_time=cls.today + timedelta(days=1),
+        )
+        category = LearningObjectCategory.objects.create(
+            name="test category",
+            course_instance=cls.course_instance,
+        )
+        cls.exercise = BaseExercise.objects.create(
+            name="test exercise",
+            url="e1",
+            course_module=module,
+            category=category,
+            max_points=10,
+            exercise_info={"form_i18n": {"code": {}}},
+        )
+
+    def setUp(self):
+        media = TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        self.submission_count = 0
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.teacher)
+        self.url = f'/api/v2/exercises/{self.exercise.id}/submissions/zip/'
+
+    def submit(self, users, content, points=0, **meta_data):
+        self.submission_count += 1
+        submission = Submission.objects.create(
+            exercise=self.exercise,
+            status=Submission.STATUS.READY,
+            service_points=points,
+            grade=points,
+            meta_data=meta_data,
+            submission_data=[],
+        )
+        Submission.objects.filter(id=submission.id).update(
+            submission_time=self.today + timedelta(minutes=self.submission_count),
+        )
+        submission.submitters.set([user.userprofile for user in users])
+        submission.files.create(
+            param_name="code",
+            file_object=SimpleUploadedFile("code.py", content),
+        )
+        return submission
+
+    def download(self, best=False):
+        response = self.client.get(self.url, {'best': 'yes'} if best else {})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+        info = archive.read('info.csv').decode().splitlines()
+        files = {name: archive.read(name) for name in archive.namelist() if name != 'info.csv'}
+        return files, [line.split(',') for line in info[1:]]
+
+    def test_zip(self):
+        self.submit([self.student1], b"first", points=3)
+        group_submission = self.submit([self.student1, self.student2], b"group", points=9, group=5)
+        self.submit([self.student2], b"second", points=5)
+        self.submit([self.teacher], b"staff")
+
+        files, info = self.download()
+        self.assertEqual(files, {
+            "111_file1_submission1": b"first",
+            "111+222_file1_submission2": b"group",
+            "222_file1_submission2": b"second",
+        })
+        self.assertEqual(
+            [(row[0], row[1], row[4], row[-1]) for row in info],
+            [
+                ("111_file1_submission1", "111", "3", "1"),
+                ("111+222_file1_submission2", "group5", "9", "2"),
+                ("222_file1_submission2", "222", "5", "2"),
+            ],
+        )
+        self.assertEqual(info[1][5], str(group_submission.id))
+        self.assertEqual(info[1][6], "First Student;Second Student")
+        self.assertEqual(info[1][7], "code")
+
+        # The group submission has the most points for both students
+        files, info = self.download(best=True)
+        self.assertEqual(list(files), ["111+222_file1_submission2"])
+
+    def test_queries_do_not_grow_with_submissions(self):
+        self.submit([self.student1], b"first")
+        self.submit([self.student2], b"second")
+        # Fill the caches used by the API views
+        self.download()
+        with CaptureQueriesContext(connection) as few:
+            self.download()
+        for i in range(10):
+            self.submit([self.student1 if i % 2 else self.student2], b"more")
+        with CaptureQueriesContext(connection) as many:
+            files, _ = self.download()
+        self.assertEqual(len(files), 12)
+        self.assertEqual(len(many), len(few))
+
+    def test_delete_expired_archives(self):
+        old = default_storage.save(archive_name(self.exercise.id, "old"), ContentFile(b"old"))
+        new = default_storage.save(archive_name(self.exercise.id, "new"), ContentFile(b"new"))
+        day_ago = time() - 24 * 60 * 60
+        os.utime(default_storage.path(old), (day_ago, day_ago))
+
+        self.assertEqual(delete_expired_archives(60 * 60), 1)
+        self.assertFalse(default_storage.exists(old))
+        self.assertTrue(default_storage.exists(new))
@@ -1,9 +1,7 @@
-from io import BytesIO
-import zipfile
-
 from aplus_auth.payload import Permission
 from django.core.exceptions import PermissionDenied
-from django.http.response import HttpResponse, FileResponse
+from django.core.files.storage import default_storage
+from django.http.response import HttpResponse, FileResponse, StreamingHttpResponse
 from django.http import Http404
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -33,8 +31,9 @@ from course.api.mixins import CourseResourceMixin
 from course.models import SubmissionTag
 from exercise.submission_models import SubmissionTagging
 from exercise.async_views import _post_async_submission
+from exercise.submission_zip import exported_submissions, stream_submissions_zip
+from exercise.tasks import build_submissions_zip
 
-from ..cache.points import ExercisePoints
 from ..models import (
     Submission,
     SubmittedFile,
@@ -196,6 +195,18 @@ class ExerciseSubmissionsViewSet(NestedViewSetMixin,
     - Body data:
         - `_aplus_group`: group id when submitting as a group
         - Remaining key-value pairs match questions and their answers.
+
+    `GET /exercises/<exercise_id>/submissions/zip/`:
+        returns the submitted files of the students as a ZIP archive. Only for
+        course staff.
+
+    - URL parameters:
+        - `best`: "yes" to include only the best submission of each student
+        - `background`: "yes" to build the archive in a background task. The
+          response contains the `task_id` and the `url` to download the
+          archive from when it is ready.
+        - `task`: the id of a background task. Returns the archive, or the
+          status of the task if the archive is not ready yet.
     """
     filter_backends = (
         SubmissionVisibleFilter,
@@ -336,7 +347,7 @@ class ExerciseSubmissionsViewSet(NestedViewSetMixin,
         url_name='zip',
         methods=['get'],
     )
-    def zip(self, request, exercise_id, *args, **kwargs): # pylint: disable=too-many-locals too-many-statements # noqa: MC0001
+    def zip(self, request, exercise_id, *args, **kwargs):
         if not self.instance.is_course_staff(request.user):
             return Response(
                 'Only course staff can download submissions via this API',
@@ -348,104 +359,50 @@ class ExerciseSubmissionsViewSet(NestedViewSetMixin,
         except BaseExercise.DoesNotExist:
             return Response('Exercise not found', status=status.HTTP_404_NOT_FOUND)
 
+        task_id = request.query_params.get('task')
+        if task_id:
+            return self.zip_task_response(exercise, task_id)
+
         best = request.query_params.get('best') == 'yes'
-        submissions = Submission.objects.filter(exercise__id=exercise_id).order_by('submission_time')
-
-        def get_group_id(submission):
-            group_id = None
-            if 'group' in submission.meta_data:
-                group_id = submission.meta_data['group']
-            if group_id is None:
-                for lst in submission.submission_data:
-                    if '_aplus_group' in lst:
-                        group_id = lst[1]
-                        break
-            return group_id
-
-        # pylint: disable-next=too-many-locals
-        def handle_submission(submission, submitters, info_csv):
-            group_id = None
-            if len(submitters) > 1:
-                group_id = get_group_id(submission)
-                if group_id is not None:
-                    try:
-                        group_id = int(group_id)
-                    except ValueError:
-                        return info_csv
-            submission_time = submission.submission_time.strftime('%Y-%m-%d %H:%M:%S %z')
-            points = submission.service_points
-            submission_id = submission.id
-            submitter_name = ";".join([submitter.user.get_full_name() for submitter in submission.submitters.all()])
-            exercise_form_name = ";".join(list(submission.exercise.exercise_info["form_i18n"].keys()))
-            submitted_files = SubmittedFile.objects.filter(submission=submission)
-            student_ids = sorted([str(submitter.student_id) for submitter in submitters])
-            submitters_string = '+'.join(student_ids)
-            submission_num = list(
-                dict.fromkeys( # Remove duplicates
-                    Submission.objects.filter(exercise__id=exercise_id, submitters__in=submitters)
-                    .order_by('submission_time')
-                )
-            ).index(submission) + 1
-            for i, submitted_file in enumerate(submitted_files, start=1):
-                filename = f"{submitters_string}_file{i}_submission{submission_num}"
-                original_name = submitted_file.filename
-                try:
-                    with submitted_file.file_object.file.open('rb') as file:
-                        zip_file.writestr(f'{filename}', file.read())
-                    if group_id is not None:
-                        info_csv += (
-                            f"{filename},group{group_id},{submission_time},{original_name},{points},"
-                            f"{submission_id},{submitter_name},{exercise_form_name},{submission_num}\n"
-                        )
-                    else:
-                        info_csv += (
-                            f"{filename},{submitters_string},{submission_time},{original_name},{points},"
-                            f"{submission_id},{submitter_name},{exercise_form_name},{submission_num}\n"
-                        )
-                except OSError:
-                    pass
-            return info_csv
-
-        # Create a zip file in memory
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-            info_csv = (
-                "filename,label,created_at,original_name,points,submission_id,"
-                "submitter_name,exercise_form_name,submission_index\n"
+        if request.query_params.get('background') == 'yes':
+            result = build_submissions_zip.delay(exercise.id, best)
+            url = reverse(
+                'api:exercise-submissions-zip',
+                kwargs={'exercise_id': exercise.id},
+                request=request,
             )
-            if best:
-                unique_submitters = []
-                for submission in submissions:
-                    submitters = submission.submitters.all()
-                    if any(self.instance.is_course_staff(submitter.user) for submitter in submitters):
-                        # Skip staff submissions
-                        continue
-                    for submitter in submitters:
-                        if submitter not in unique_submitters:
-                            unique_submitters.append(submitter)
-                unique_submissions = []
-                for submitter in unique_submitters:
-                    submission_entry = ExercisePoints.get(exercise, submitter.user).best_submission
-                    if submission_entry is None:
-                        continue
-                    submission = submissions.filter(id=submission_entry.id).first()
-                    # Prevent duplicate best submissions due to group submissions
-                    if submission not in unique_submissions:
-                        unique_submissions.append(submission)
-                        info_csv = handle_submission(submission, submission.submitters.all(), info_csv)
-            else:
-                for submission in submissions:
-                    submitters = submission.submitters.all()
-                    if any(self.instance.is_course_staff(submitter.user) for submitter in submitters):
-                        # Skip staff submissions
-                        continue
-                    info_csv = handle_submission(submission, submitters, info_csv)
-            zip_file.writestr('info.csv', info_csv)
-        zip_buffer.seek(0)
-
-        response = FileResponse(zip_buffer, as_attachment=True, filename='submissions.zip')
+            return Response(
+                {'task_id': result.id, 'url': f'{url}?task={result.id}'},
+                status=status.HTTP_202_ACCEPTED,
+            )
+
+        submissions = exported_submissions(self.instance, exercise, best)
+        response = StreamingHttpResponse(
+            stream_submissions_zip(exercise, submissions),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = 'attachment; filename="submissions.zip"'
         return response
 
+    def zip_task_response(self, exercise, task_id):
+        result = build_submissions_zip.AsyncResult(task_id)
+        if result.state == 'SUCCESS':
+            archive = result.result
+            if archive['exercise_id'] != exercise.id or not default_storage.exists(archive['name']):
+                # Expired archives have been deleted
+                return Response('Archive not found', status=status.HTTP_404_NOT_FOUND)
+            return FileResponse(
+                default_storage.open(archive['name'], 'rb'),
+                as_attachment=True,
+                filename='submissions.zip',
+            )
+        if result.state == 'FAILURE':
+            return Response('Creating the archive failed', status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        data = {'task_id': task_id, 'state': result.state}
+        if isinstance(result.info, dict):
+            data.update(result.info)
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
     def get_access_mode(self):
         # The API is not supposed to use the access mode permission in views,
         # but this is currently required so that enrollment exercises work in
@@ -750,7 +707,7 @@ class CoursePointsViewSet(ListSerializerMixin,
 
     def get_queryset(self):
         if self.action == 'list':
-            return self.instance.students
+            return self.instance.students.select_related('user')
         return self.instance.course_staff_and_students
 
     def retrieve(self, request, *args, **kwargs):
@@ -8,7 +8,7 @@ from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 
 from course.models import CourseInstance, CourseInstanceProto, CourseModule, CourseModuleProto
-from lib.cache.cached import CacheBase, DBDataManager, Dependencies, ProxyManager
+from lib.cache.cached import CacheBase, CacheNamespace, DBDataManager, Dependencies, ProxyManager
 from threshold.models import CourseModuleRequirement
 from .invalidate_util import category_learning_objects, module_learning_objects
 from ..models import BaseExercise, CourseChapter, LearningObject, LearningObjectCategory, LearningObjectProto
@@ -31,6 +31,12 @@ def _add_to(target: Union[ModuleEntryBase, CategoryEntryBase, TotalsBase], exerc
     )
 
 
+class InstanceNamespace(CacheNamespace):
+    """The content entries of a course instance. Invalidating it invalidates
+    the points entries too, as they depend on the content entries."""
+    KEY_PREFIX: ClassVar[str] = 'ns.instance'
+
+
 class EqById:
     """Implements equality operator by comparing the id attribute"""
     id: int
@@ -340,7 +346,10 @@ class LearningObjectEntryBase(LearningObjectProto, CacheBase, EqById, Generic[Mo
 
         # We cannot rely on INVALIDATORS as the parent of a child might change,
         # in which case this object wouldn't be invalidated (and the children would be wrong)
-        return {LearningObjectEntryBase: [proxy._params for proxy in self.children]}
+        return {
+            LearningObjectEntryBase: [proxy._params for proxy in self.children],
+            InstanceNamespace: [(module.course_instance_id,)],
+        }
 
 
 class ModuleEntryBase(CourseModuleProto, CacheBase, EqById, Generic[LearningObjectEntry]):
@@ -435,8 +444,8 @@ class ModuleEntryBase(CourseModuleProto, CacheBase, EqById, Generic[LearningObje
                     _add_to(self, exercise)
 
         # We rely on the module of an exercise never changing, so the invalidators do the work
-        # without the need for dependencies
-        return {}
+        # without the need for dependencies other than the namespace
+        return {InstanceNamespace: [(module.course_instance_id,)]}
 
 
 @dataclass(eq=False)
@@ -583,5 +592,5 @@ class CachedDataBase(CourseInstanceProto, CacheBase, Generic[ModuleEntry, Learni
         self.created = timezone.now()
 
         # We rely on the instance of a module never changing, so the invalidators do the work
-        # without the need for dependencies
-        return {}
+        # without the need for dependencies other than the namespace
+        return {InstanceNamespace: [(instance_id,)]}
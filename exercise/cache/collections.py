@@ -0,0 +1,36 @@
+from typing import Dict, List
+
+from django.db.models.signals import post_save, post_delete
+
+from lib.cache import CachedAbstract
+
+
+class CachedCollectionTargets(CachedAbstract):
+    """ The ids of the exercise collections by the ids of their target categories """
+    KEY_PREFIX = "collectiontargets"
+
+    def __init__(self):
+        super().__init__()
+
+    def _generate_data(self, *models, data=None): # pylint: disable=arguments-differ
+        # The collection model imports this module
+        from ..exercisecollection_models import ExerciseCollection # pylint: disable=import-outside-toplevel
+        targets: Dict[int, List[int]] = {}
+        for collection_id, category_id in (
+                ExerciseCollection.bare_objects
+                .filter(target_category__isnull=False)
+                .values_list('id', 'target_category_id')
+                ):
+            targets.setdefault(category_id, []).append(collection_id)
+        return targets
+
+    def collections(self, category_id: int) -> List[int]:
+        return self.data.get(category_id, [])
+
+
+def invalidate_targets(sender, instance, **kwargs): # pylint: disable=unused-argument
+    CachedCollectionTargets.invalidate()
+
+
+post_save.connect(invalidate_targets, sender='exercise.ExerciseCollection')
+post_delete.connect(invalidate_targets, sender='exercise.ExerciseCollection')
@@ -1,7 +1,14 @@
 from __future__ import annotations
 
 from course.models import CourseInstance
-from .basetypes import CachedDataBase, CategoryEntryBase, LearningObjectEntryBase, ModuleEntryBase, TotalsBase
+from .basetypes import (
+    CachedDataBase,
+    CategoryEntryBase,
+    InstanceNamespace,
+    LearningObjectEntryBase,
+    ModuleEntryBase,
+    TotalsBase,
+)
 from .hierarchy import ContentMixin
 
 
@@ -26,8 +33,4 @@ class CachedContent(ContentMixin[ModuleContent, LearningObjectContent, CategoryC
 
     @classmethod
     def invalidate(cls, instance: CourseInstance):
-        InstanceContent.invalidate(instance)
-        for module in instance.course_modules.prefetch_related("learning_objects").all():
-            ModuleEntryBase.invalidate(module)
-            for exercise in module.learning_objects.all():
-                LearningObjectEntryBase.invalidate(exercise)
+        InstanceNamespace.invalidate(instance)
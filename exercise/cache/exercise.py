@@ -1,11 +1,11 @@
 import logging
 import time
-from typing import Any, Dict, List, Optional, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
 
-from django.conf import settings
 from django.http.request import HttpRequest
 
 from lib.cache import CachedAbstract
+from lib.cache.codecs import compress, decompress, COMPRESSION_MARKER, LZ4_MARKER
 from lib.remote_page import RemotePageNotModified
 
 if TYPE_CHECKING:
@@ -15,20 +15,14 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger('aplus.cached')
 
-try:
-    from lz4.block import compress as _compress, decompress
-    def compress(data):
-        return _compress(data, compression=1)
-except ImportError:
+if COMPRESSION_MARKER != LZ4_MARKER:
     logger.warning("Unable to import lz4, using a slower zlib instead")
-    from zlib import compress as _compress, decompress
-    def compress(data):
-        return _compress(data, level=1)
 
 
 class ExerciseCache(CachedAbstract):
     """ Exercise HTML content """
     KEY_PREFIX = "exercisepage"
+    NAMESPACE_PARAMS = 1
 
     def __init__( # pylint: disable=too-many-arguments
             self,
@@ -43,6 +37,11 @@ class ExerciseCache(CachedAbstract):
         self.load_args = [language, request, students, url_name, ordinal]
         super().__init__(exercise, modifiers=[language])
 
+    @classmethod
+    def _namespace_models(cls, exercise: 'BaseExercise', *models: Any) -> Tuple[int]:
+        # The pages of a course instance share a namespace
+        return (exercise.course_module.course_instance_id,)
+
     def _needs_generation(self, data: Dict[str, Any]) -> bool:
         expires = data['expires'] if data else None
         return not expires or time.time() > expires
@@ -76,7 +75,4 @@ class ExerciseCache(CachedAbstract):
 
 
 def invalidate_instance(instance: 'CourseInstance') -> None:
-    for module in instance.course_modules.all():
-        for exercise in module.learning_objects.all():
-            for language,_ in settings.LANGUAGES:
-                ExerciseCache.invalidate(exercise, modifiers=[language])
+    ExerciseCache.invalidate_namespace(instance)
@@ -20,15 +20,16 @@ from typing import (
 )
 
 from django.contrib.auth.models import User
-from django.db.models import prefetch_related_objects
+from django.db.models import F, prefetch_related_objects
 from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.utils import timezone
 
 from course.models import CourseInstance, CourseModule, StudentGroup, StudentModuleGoal
 from deviations.models import DeadlineRuleDeviation, MaxSubmissionsRuleDeviation
-from lib.cache.cached import DBDataManager, Dependencies, ProxyManager, resolve_proxies
+from lib.cache.cached import CacheBase, DBDataManager, Dependencies, ProxyManager, resolve_proxies
 from lib.helpers import format_points
 from notification.models import Notification
+from userprofile.models import UserProfile
 from .basetypes import (
     add_by_difficulty,
     CachedDataBase,
@@ -165,6 +166,8 @@ class PointsDBData(DBDataManager):
     reveal_rules: Dict[int, RevealRule]
     module_reveal_rules: Dict[int, RevealRule]
     groups: Dict[Tuple[int, int], List[StudentGroup]]
+    module_goal_users: Dict[int, Set[int]]
+    module_goals: Dict[Tuple[int, int], int]
     fetched: Set[Tuple[int,int]]
 
     def __init__(self):
@@ -176,6 +179,8 @@ class PointsDBData(DBDataManager):
         self.reveal_rules = {}
         self.module_reveal_rules = {}
         self.groups = {}
+        self.module_goal_users = {}
+        self.module_goals = {}
         self.fetched = set()
 
     def add(self, proxy: Union[CachedPointsData, ModulePoints, LearningObjectPoints]) -> None:
@@ -184,6 +189,8 @@ class PointsDBData(DBDataManager):
             self.exercises.setdefault(user_id, set()).add(model_id)
         elif isinstance(proxy, ModulePoints):
             self.modules.add(model_id)
+            if user_id is not None:
+                self.module_goal_users.setdefault(user_id, set()).add(model_id)
 
     def fetch(self) -> None:
         modules = (
@@ -199,56 +206,94 @@ class PointsDBData(DBDataManager):
         )
         self.modules.clear()
 
-        for user_id, exercise_ids in self.exercises.items():
-            self.fetched.update((user_id, exercise_id) for exercise_id in exercise_ids)
-
-            user = User.objects.get(id=user_id)
-            submissions = (
-                Submission.objects
-                .filter(submitters=user.userprofile, exercise_id__in=exercise_ids)
-                .prefetch_related("exercise", "notifications", "submitters")
-                .order_by('exercise_id', '-submission_time')
-            )
-            for exercise_id, exercise_submissions in groupby(submissions, key=lambda s: s.exercise_id):
-                self.submissions[(user_id, exercise_id)] = list(exercise_submissions)
-
-            deadline_deviations = (
-                DeadlineRuleDeviation.objects
-                .get_max_deviations(user.userprofile, exercise_ids)
-            )
-            for exercise_id, exercise_deviations in groupby(deadline_deviations, key=lambda s: s.exercise_id):
-                self.deadline_deviations[(user_id, exercise_id)] = list(exercise_deviations)
-            submission_deviations = (
-                MaxSubmissionsRuleDeviation.objects
-                .get_max_deviations(user.userprofile, exercise_ids)
+        if self.module_goal_users:
+            goals = (
+                StudentModuleGoal.objects
+                .filter(
+                    module_id__in={m for ms in self.module_goal_users.values() for m in ms},
+                    student__user_id__in=self.module_goal_users.keys(),
+                )
+                .values_list("student__user_id", "module_id", "goal_points")
             )
-            for exercise_id, exercise_deviations in groupby(submission_deviations, key=lambda s: s.exercise_id):
-                self.submission_deviations[(user_id, exercise_id)] = list(exercise_deviations)
-
-            exercises = (
-                BaseExercise.bare_objects
-                .filter(id__in=exercise_ids)
-                .select_related("submission_feedback_reveal_rule", "course_module")
-                .only("id", "course_module__course_instance_id", "submission_feedback_reveal_rule")
+            self.module_goals.update(
+                ((user_id, module_id), goal_points)
+                for user_id, module_id, goal_points in goals
+                if module_id in self.module_goal_users[user_id]
             )
+            self.module_goal_users.clear()
 
-            self.reveal_rules.update(
-                (e.id, e.active_submission_feedback_reveal_rule)
-                for e in exercises
-            )
+        if not self.exercises:
+            return
 
-            instance_ids = {e.course_module.course_instance_id for e in exercises}
-            group_qs = StudentGroup.objects.filter(
-                course_instance__in=instance_ids, members=user.userprofile
-            ).prefetch_related("members").order_by('course_instance_id')
-            instance_groups = {
-                instance_id: list(groups)
-                for instance_id, groups in groupby(group_qs, lambda g: g.course_instance_id)
-            }
-            self.groups.update(
-                ((user_id, e.id), instance_groups.get(e.course_module.course_instance_id, []))
-                for e in exercises
-            )
+        # Everything below is fetched for all pending users at once, so that
+        # the number of queries does not depend on the number of users
+        pending = {
+            (user_id, exercise_id)
+            for user_id, exercise_ids in self.exercises.items()
+            for exercise_id in exercise_ids
+        }
+        self.fetched.update(pending)
+        all_exercise_ids = {exercise_id for _, exercise_id in pending}
+
+        profile_ids = dict(
+            UserProfile.objects
+            .filter(user_id__in=self.exercises.keys())
+            .values_list("id", "user_id")
+        )
+
+        # A submission is listed once for each of its submitters
+        submissions = (
+            Submission.objects
+            .filter(submitters__in=profile_ids.keys(), exercise_id__in=all_exercise_ids)
+            .annotate(submitter_profile_id=F("submitters__id"))
+            .prefetch_related("exercise", "notifications", "submitters")
+            .order_by('submitter_profile_id', 'exercise_id', '-submission_time')
+        )
+        for (profile_id, exercise_id), exercise_submissions in groupby(
+                submissions, key=lambda s: (s.submitter_profile_id, s.exercise_id)):
+            key = (profile_ids[profile_id], exercise_id)
+            if key in pending:
+                self.submissions[key] = list(exercise_submissions)
+
+        for target, manager in (
+                (self.deadline_deviations, DeadlineRuleDeviation.objects),
+                (self.submission_deviations, MaxSubmissionsRuleDeviation.objects),
+                ):
+            deviations = manager.get_max_deviations_many(profile_ids.keys(), all_exercise_ids)
+            for (profile_id, exercise_id), deviation in deviations.items():
+                key = (profile_ids[profile_id], exercise_id)
+                if key in pending:
+                    target[key] = [deviation]
+
+        exercises = list(
+            BaseExercise.bare_objects
+            .filter(id__in=all_exercise_ids)
+            .select_related("submission_feedback_reveal_rule", "course_module")
+            .only("id", "course_module__course_instance_id", "submission_feedback_reveal_rule")
+        )
+
+        self.reveal_rules.update(
+            (e.id, e.active_submission_feedback_reveal_rule)
+            for e in exercises
+        )
+
+        instance_ids = {e.course_module.course_instance_id for e in exercises}
+        # StudentGroup.objects prefetches the members
+        group_qs = StudentGroup.objects.filter(
+            course_instance__in=instance_ids, members__in=profile_ids.keys()
+        ).distinct()
+        user_groups: Dict[Tuple[int, int], List[StudentGroup]] = {}
+        for group in group_qs:
+            for member in group.members.all():
+                if member.id in profile_ids:
+                    key = (profile_ids[member.id], group.course_instance_id)
+                    user_groups.setdefault(key, []).append(group)
+        exercise_instances = {e.id: e.course_module.course_instance_id for e in exercises}
+        self.groups.update(
+            ((user_id, exercise_id), user_groups.get((user_id, exercise_instances[exercise_id]), []))
+            for user_id, exercise_id in pending
+            if exercise_id in exercise_instances
+        )
 
         self.exercises.clear()
 
@@ -267,6 +312,9 @@ class PointsDBData(DBDataManager):
     def get_module_reveal_rule(self, module_id: int) -> Optional[RevealRule]:
         return self.module_reveal_rules.get(module_id)
 
+    def get_module_goal_points(self, user_id: int, module_id: int) -> Optional[int]:
+        return self.module_goals.get((user_id, module_id))
+
     def get_groups(self, user_id: int, exercise_id: int) -> List[StudentGroup]:
         return self.groups[(user_id, exercise_id)]
 
@@ -947,14 +995,8 @@ class ModulePoints(DifficultyStats, ModuleEntryBase[LearningObjectPoints]):
             elif entry.submission_count > 0:
                 self.confirmable_children = True
 
-        try:
-            user = User.objects.get(id=user_id)
-            student_module_goal = StudentModuleGoal.objects.get(module_id=module_id, student_id=user.userprofile)
-            self.module_goal_points = student_module_goal.goal_points
-        except StudentModuleGoal.DoesNotExist:
-            pass
-        except User.DoesNotExist:
-            pass
+        if user_id is not None:
+            self.module_goal_points = prefetched_data.get_module_goal_points(user_id, module_id)
 
         def add_points(children):
             for entry in children:
@@ -1104,6 +1146,56 @@ class CachedPoints(ContentMixin[ModulePoints, EitherExerciseEntry, CategoryPoint
         self.user = user
         self.data = CachedPointsData.get(course_instance, user, show_unrevealed, prefetch_children=prefetch_children)
 
+    @classmethod
+    def get_many(
+            cls,
+            course_instance: CourseInstance,
+            users: Iterable[User],
+            show_unrevealed: bool = False,
+            ) -> List[CachedPoints]:
+        """
+        Returns a CachedPoints object for each of the users, in the same order.
+
+        All the cache entries are resolved through a single ProxyManager, so
+        the cache is read and written once per level of the hierarchy and the
+        missing data is fetched from the database in bulk for all users at once.
+        """
+        users = list(users)
+        instance_id = CachedPointsData.parameter_ids(course_instance)[0]
+        modifiers = (show_unrevealed,)
+
+        precreated = ProxyManager()
+        content = precreated.get_or_create_proxy(CachedDataBase, instance_id)
+        precreated.resolve([content])
+
+        # Create the proxies of the whole hierarchy beforehand, so that they
+        # are all fetched from the cache and the database in one go
+        proxies: List[CacheBase] = []
+        for user in users:
+            proxies.extend(
+                precreated.get_or_create_proxy(LearningObjectPoints, exercise_id, user.id, modifiers=modifiers)
+                for exercise_id in content.exercise_index
+            )
+            proxies.extend(
+                precreated.get_or_create_proxy(ModulePoints, module._params[0], user.id, modifiers=modifiers)
+                for module in content.modules
+            )
+        data = [
+            precreated.get_or_create_proxy(CachedPointsData, instance_id, user.id, modifiers=modifiers)
+            for user in users
+        ]
+        precreated.resolve(proxies + data)
+        precreated.save()
+
+        points = []
+        for user, user_data in zip(users, data):
+            obj = cls.__new__(cls)
+            obj.instance = course_instance
+            obj.user = user
+            obj.data = user_data
+            points.append(obj)
+        return points
+
     def created(self) -> Tuple[datetime.datetime, datetime.datetime]:
         return self.data.points_created, super().created()
 
@@ -484,9 +484,10 @@ def invalidate_exercise(sender, instance, **kwargs): # pylint: disable=unused-ar
         ExerciseCache.invalidate(instance, modifiers=[language])
 
 
-# Automatically invalidate cached exercise html when edited.
+# Automatically invalidate cached exercise html when edited. The page of a
+# deleted exercise cannot be loaded anymore, and its key, which depends on the
+# possibly deleted course module, is left for the cache to evict.
 post_save.connect(invalidate_exercise, sender=LearningObject)
-post_delete.connect(invalidate_exercise, sender=LearningObject)
 
 
 class LearningObjectDisplay(models.Model):
@@ -1004,7 +1005,8 @@ class BaseExercise(LearningObject):
             access_ok, access_alerts = True, {'error_messages': [], 'warning_messages': [], 'info_messages': []}
         else:
             access_ok, access_alerts = self.one_has_access(students)
-        is_staff = all(self.course_instance.is_course_staff(p.user) for p in students)
+        staff_ids = self.course_instance.get_course_staff_ids(students)
+        is_staff = all(p.id in staff_ids for p in students)
         # pylint: disable-next=consider-using-ternary
         ok = (access_ok and len(alerts['error_messages'] + alerts['warning_messages']) == 0) or is_staff
         # Combine alerts dict with access_alerts dict
@@ -1576,6 +1578,16 @@ class ExerciseTask(models.Model):
         max_length=128,
         blank=False,
     )
+    # A restarted task continues after the submissions that have been regraded
+    regraded_up_to = models.IntegerField(
+        verbose_name=_('LABEL_REGRADED_UP_TO'),
+        null=True,
+        blank=True,
+    )
+    regraded_count = models.PositiveIntegerField(
+        verbose_name=_('LABEL_REGRADED_COUNT'),
+        default=0,
+    )
 
     class Meta:
         verbose_name = _('MODEL_NAME_EXERCISE_TASK')
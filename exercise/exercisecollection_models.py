@@ -1,16 +1,20 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.db import models
+from django.db import connection, models, transaction
 from django.dispatch import receiver
 from django.db.models.signals import post_save
 from django.utils.translation import gettext_lazy as _
 
 from django.core.exceptions import ValidationError
 
+from .cache.collections import CachedCollectionTargets
 from .cache.points import ExercisePoints
 from .exercise_models import BaseExercise
 from .submission_models import Submission
 from course.models import LearningObjectCategory
+from lib.request_globals import RequestGlobal
 
 
 class ExerciseCollection(BaseExercise):
@@ -60,8 +64,15 @@ class ExerciseCollection(BaseExercise):
     #  * Target category doesn't have exercises with points
     #
     def get_points(self, user, no_scaling=False):
-        total_points = 0
-        tc_max_points = self.target_category_maxpoints
+        exercises = self._target_exercises()
+        points = self._best_points(exercises, user)
+        return self._total_points(user, exercises, points, no_scaling)
+
+
+    # Scales the sum of the points in the target category exercises
+    # like get_points
+    def _total_points(self, user, exercises, points, no_scaling=False):
+        tc_max_points = sum(exercise.max_points for exercise in exercises)
         max_points = self.max_points
 
         if tc_max_points == 0:
@@ -78,9 +89,7 @@ class ExerciseCollection(BaseExercise):
         ):
             return None
 
-        for entry in ExercisePoints.get_many(self.exercises, user):
-            if entry.best_submission is not None:
-                total_points += entry.best_submission.points
+        total_points = sum(points.get(str(exercise.id), 0) for exercise in exercises)
 
         if timing == self.TIMING.LATE:
             total_points = round(total_points * (1 - self.course_module.late_submission_penalty))
@@ -93,6 +102,18 @@ class ExerciseCollection(BaseExercise):
         return total_points
 
 
+    # Returns the best points of the user in the exercises by exercise id.
+    # The ids are strings, as the points are stored in JSON.
+    def _best_points(self, exercises, user) -> Dict[str, int]:
+        points = {}
+        for exercise, entry in zip(exercises, ExercisePoints.get_many(exercises, user)):
+            if entry.best_submission is not None:
+                points[str(exercise.id)] = entry.best_submission.points
+            else:
+                points[str(exercise.id)] = 0
+        return points
+
+
     # Used when staff forces regrading
     def grade(self, submission, request=None): # pylint: disable=arguments-differ
         user = list(submission.submitters.all())[0]
@@ -107,11 +128,12 @@ class ExerciseCollection(BaseExercise):
     #
     def check_submission(self, user, no_update=False, forced=False):
 
-        if no_update and self.is_submitted(user) and not forced:
+        current_submission = self.get_submissions_for_student(user.userprofile).first()
+        if no_update and current_submission is not None and not forced:
             return
 
         # Create new submission or use previous
-        if not self.is_submitted(user):
+        if current_submission is None:
             current_submission = Submission.objects.create(
             exercise=self,
             feedback="",
@@ -119,20 +141,19 @@ class ExerciseCollection(BaseExercise):
             )
             current_submission.clean()
             current_submission.save()
-        else:
-            submissions = self.get_submissions_for_student(user.userprofile)
-            current_submission = submissions[0]
-
 
-        new_grade = self.get_points(user)
+        # The points of all the exercises are read from the points cache, as
+        # they may change without a new submission, e.g. with deviations
+        exercises = self._target_exercises()
+        points = self._best_points(exercises, user)
+        new_grade = self._total_points(user, exercises, points)
+        grading_data, feedback = self._generate_grading_data(exercises, points)
 
-        if new_grade == current_submission.grade and not forced:
+        # The feedback lists the points of each exercise
+        if new_grade == current_submission.grade and feedback == current_submission.feedback and not forced:
             return
 
 
-        grading_data, feedback = self._generate_grading_data(user.userprofile)
-
-
         current_submission.grade = new_grade
         current_submission.submission_time = timezone.now()
         current_submission.status = Submission.STATUS.READY
@@ -160,6 +181,11 @@ class ExerciseCollection(BaseExercise):
         return max_points
 
 
+    # The exercises in target category with the models needed for feedback
+    def _target_exercises(self) -> List[BaseExercise]:
+        return list(self.exercises.select_related('category__course_instance__course'))
+
+
     # Property to access exercises in target category
     @property
     def exercises(self):
@@ -173,18 +199,13 @@ class ExerciseCollection(BaseExercise):
 
     # Generates feedback and grading_data
     # Feedback is in HTML format
-    # grading_data is currently blank
-    def _generate_grading_data(self, profile):
+    def _generate_grading_data(self, exercises, points):
         feedback = ""
         grading_data = ""
 
         exercise_counter = 1
-        exercise_entries = ExercisePoints.get_many(self.exercises, profile.user)
-        for exercise, entry in zip(self.exercises, exercise_entries):
-            if entry.best_submission is None:
-                grade = 0
-            else:
-                grade = entry.best_submission.points
+        for exercise in exercises:
+            grade = points.get(str(exercise.id), 0)
 
             feedback += "Exercise {}: {}/{}\n  Course: {} - {}\n  Exercise: {}\n".format(
                 exercise_counter,
@@ -201,11 +222,56 @@ class ExerciseCollection(BaseExercise):
 
 
 
+class PendingCollectionUpdates(RequestGlobal):
+    """The exercise collections to update when the current transaction commits.
+
+    Many submissions of a user in the target category within one transaction
+    update each collection of the user once.
+    """
+    updates: Set[Tuple[int, int]]
+    transaction_block: Optional[object]
+
+    def init(self):
+        self.updates = set()
+        self.transaction_block = None
+
+    def add(self, collection_ids: Iterable[int], user_id: int) -> None:
+        if not connection.in_atomic_block:
+            self.update({(collection_id, user_id) for collection_id in collection_ids})
+            return
+
+        block = connection.atomic_blocks[0]
+        if block is not self.transaction_block:
+            # The updates of a rolled back transaction are dropped
+            self.updates = set()
+            self.transaction_block = block
+        self.updates.update((collection_id, user_id) for collection_id in collection_ids)
+        # Registered every time, because the callbacks of a rolled back
+        # savepoint are dropped. The later calls find nothing to update.
+        transaction.on_commit(self.flush)
+
+    def flush(self) -> None:
+        updates, self.updates = self.updates, set()
+        self.transaction_block = None
+        self.update(updates)
+
+    @staticmethod
+    def update(updates: Set[Tuple[int, int]]) -> None:
+        collections = ExerciseCollection.objects.in_bulk({collection_id for collection_id, _ in updates})
+        users = User.objects.in_bulk({user_id for _, user_id in updates})
+        for collection_id, user_id in updates:
+            collection = collections.get(collection_id)
+            user = users.get(user_id)
+            if collection is not None and user is not None:
+                collection.check_submission(user)
+
+
 # Updates submissions if new submission is in any ExerciseCollection's target category.
-# ! Probably needs Cache-optimization
+# The collections are looked up from the cached index, so submissions outside
+# the target categories do not query the database.
 @receiver(post_save, sender=Submission)
 def update_exercise_collection_submission(sender, instance, **kwargs): # pylint: disable=unused-argument
-    collections = ExerciseCollection.objects.filter(target_category=instance.exercise.category)
+    collections = CachedCollectionTargets().collections(instance.exercise.category_id)
     if not collections:
         return
 
@@ -213,5 +279,4 @@ def update_exercise_collection_submission(sender, instance, **kwargs): # pylint:
     if not profile:
         return
 
-    for collection in collections:
-        collection.check_submission(profile.user)
+    PendingCollectionUpdates().add(collections, profile.user_id)
@@ -0,0 +1,91 @@
+"""
+Grading new submissions in the background.
+
+Grading a submission waits for the response of the exercise service, which
+may take the whole EXERCISE_HTTP_TIMEOUT and EXERCISE_HTTP_RETRIES cycle.
+When SUBMISSION_ASYNC_GRADING is set, the submission is left in the waiting
+state and graded by a celery worker or a thread pool in the web server
+process instead. The feedback then arrives the same way as with
+asynchronous exercise services: the submission page polls the submission
+status until it is ready.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from threading import Lock
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from lib.request_globals import RequestGlobal
+from .exercise_models import BaseExercise, LearningObject
+from .submission_models import Submission
+from .tasks import grade_submission
+
+
+logger = logging.getLogger('aplus.exercise')
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SUBMISSION_ASYNC_GRADING_THREADS,
+                thread_name_prefix="grading",
+            )
+        return _executor
+
+
+def _grade_in_thread(submission_id: int, url_name: str) -> None:
+    try:
+        grade_submission(submission_id, url_name)
+    except Exception: # pylint: disable=broad-except
+        logger.exception("Failed to grade submission %s", submission_id)
+    finally:
+        # The thread is reused for other submissions
+        RequestGlobal.clear_globals()
+        connections.close_all()
+
+
+def can_grade_async(exercise: BaseExercise, submission: Submission) -> bool:
+    """
+    Returns whether the submission can be graded outside of the request.
+    Exercises that need the request for grading (LTI) and enrollment
+    questionnaires, whose result is needed immediately, are always graded
+    in the request.
+    """
+    return (
+        settings.SUBMISSION_ASYNC_GRADING in ('celery', 'thread')
+        and exercise.can_regrade
+        and not submission.lti_launch_id
+        and exercise.status not in (
+            LearningObject.STATUS.ENROLLMENT,
+            LearningObject.STATUS.ENROLLMENT_EXTERNAL,
+        )
+    )
+
+
+def grade_async(exercise: BaseExercise, submission: Submission, url_name: str = "exercise") -> bool:
+    """
+    Sets the submission to the waiting state and queues it for grading once
+    the current transaction is committed. Returns False without doing
+    anything if the submission should be graded in the request.
+    """
+    if not can_grade_async(exercise, submission):
+        return False
+
+    # set_waiting() is not used here because it would count the grading
+    # request as a retry of the submission
+    submission.status = Submission.STATUS.WAITING
+    submission.save(update_fields=['status'])
+
+    submission_id = submission.id
+    if settings.SUBMISSION_ASYNC_GRADING == 'celery':
+        transaction.on_commit(lambda: grade_submission.delay(submission_id, url_name))
+    else:
+        transaction.on_commit(lambda: _get_executor().submit(_grade_in_thread, submission_id, url_name))
+    return True
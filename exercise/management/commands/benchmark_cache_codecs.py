@@ -0,0 +1,89 @@
+from collections import defaultdict
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lib.cache.cached import ProxyManager
+from lib.cache.codecs import CacheCodec, CompactCodec, CompressedCodec, PickleCodec
+from lib.testdata import create_synthetic_course
+from ...cache.points import CachedPoints
+
+
+class Rollback(Exception): ...
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the payload size and encode/decode time of the cache codecs '
+        'per cache entry type on a synthetic course. The course is created in a '
+        'transaction that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modules', type=int, default=15)
+        parser.add_argument('--exercises-per-module', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20, help='Number of encode/decode rounds')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                instance = create_synthetic_course(
+                    modules=options['modules'],
+                    exercises_per_module=options['exercises_per_module'],
+                    students=1,
+                    submissions_per_exercise=3,
+                )
+                student = instance.students.first().user
+                points = CachedPoints(instance, student, True)
+                states = self.collect_states(points.data._manager)
+                raise Rollback()
+        except Rollback:
+            pass
+
+        codecs: Dict[str, CacheCodec] = {
+            'pickle': PickleCodec(),
+            'compact': CompactCodec(),
+            'pickle+compress': CompressedCodec(PickleCodec()),
+            'compact+compress': CompressedCodec(CompactCodec()),
+        }
+        self.stdout.write(
+            f"{'entry type':<24}{'count':>7}{'codec':>18}{'avg bytes':>11}{'encode us':>11}{'decode us':>11}"
+        )
+        for name, entries in sorted(states.items()):
+            for codec_name, codec in codecs.items():
+                size, encode, decode = self.measure(codec, entries, options['repeat'])
+                self.stdout.write(
+                    f"{name:<24}{len(entries):>7}{codec_name:>18}{size:>11.0f}{encode:>11.1f}{decode:>11.1f}"
+                )
+
+    def collect_states(self, manager: ProxyManager) -> Dict[str, List[Tuple]]:
+        """Returns the cached state of every cache entry in manager, grouped by entry type"""
+        states = defaultdict(list)
+        for proxy in list(manager.proxies.values()):
+            if not proxy._resolved:
+                continue
+            ocls = proxy.__class__
+            for base_cls, _ in proxy._keys_with_cls:
+                proxy.__class__ = base_cls
+                states[base_cls.__name__].append(proxy._getstate())
+            proxy.__class__ = ocls
+        return states
+
+    def measure(self, codec: CacheCodec, entries: List[Tuple], repeat: int) -> Tuple[float, float, float]:
+        """Returns the average payload size, encode time and decode time (in microseconds) per entry"""
+        start = perf_counter()
+        for _ in range(repeat):
+            payloads = [codec.dumps(state) for state in entries]
+        encode = perf_counter() - start
+
+        start = perf_counter()
+        for _ in range(repeat):
+            manager = ProxyManager()
+            for payload in payloads:
+                codec.loads(payload, manager)
+        decode = perf_counter() - start
+
+        n = len(entries) * repeat
+        return sum(map(len, payloads)) / len(entries), encode / n * 1e6, decode / n * 1e6
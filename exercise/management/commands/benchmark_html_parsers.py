@@ -0,0 +1,80 @@
+from time import perf_counter
+from typing import Dict, List
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lib.remote_page import RemotePage, parse_html
+from lib.testdata import generate_rst_chapter
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the BeautifulSoup tree builders on chapter or exercise HTML '
+        'files, e.g. pages saved from a built course. Measures the processing '
+        'done to each loaded page: parsing, fixing the relative URLs, extracting '
+        'the content element and parsing it again as in ExercisePage.populate_form. '
+        'With --sections, measures generated chapters of the given sizes instead.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='HTML files to parse')
+        parser.add_argument(
+            '--sections',
+            help='Comma separated section counts of generated RST chapters to measure one by one, e.g. 100,800,3200',
+        )
+        parser.add_argument(
+            '--url',
+            default='http://grader.local/course/module1/chapter.html',
+            help='URL the pages are assumed to be loaded from',
+        )
+        parser.add_argument('--parsers', default='html5lib,lxml,html.parser')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        if not options['files'] and not options['sections']:
+            raise CommandError("Give the HTML files to parse or --sections")
+        if options['files']:
+            pages: List[str] = []
+            for path in options['files']:
+                with open(path, encoding='utf-8') as f:
+                    pages.append(f.read())
+            self.report(f"{len(pages)} pages", pages, options)
+        if options['sections']:
+            for sections in options['sections'].split(','):
+                self.report(f"chapter of {sections} sections", [generate_rst_chapter(int(sections))], options)
+
+    def report(self, name: str, pages: List[str], options: dict) -> None:
+        size = sum(len(page) for page in pages)
+        self.stdout.write(f"{name}, {size / 1024:.0f} KiB in total")
+
+        self.stdout.write(f"{'parser':<14}{'parse ms':>11}{'urls ms':>11}{'extract ms':>12}{'reparse ms':>12}")
+        for parser in options['parsers'].split(','):
+            times = self.measure(parser, pages, options['url'], options['repeat'])
+            self.stdout.write(
+                f"{parser:<14}{times['parse']:>11.1f}{times['urls']:>11.1f}"
+                f"{times['extract']:>12.1f}{times['reparse']:>12.1f}"
+            )
+
+    def measure(self, parser: str, pages: List[str], url: str, repeat: int) -> Dict[str, float]:
+        """Returns the average time in milliseconds per page for each step"""
+        times = dict.fromkeys(('parse', 'urls', 'extract', 'reparse'), 0.0)
+        for _ in range(repeat):
+            for html in pages:
+                start = perf_counter()
+                page = RemotePage.from_text(url, html, parser)
+                times['parse'] += perf_counter() - start
+
+                start = perf_counter()
+                page.fix_relative_urls(True)
+                times['urls'] += perf_counter() - start
+
+                start = perf_counter()
+                content, _ = page.element_or_body([{'id': 'exercise'}, {'id': 'chapter'}])
+                times['extract'] += perf_counter() - start
+
+                start = perf_counter()
+                parse_html(content, parser)
+                times['reparse'] += perf_counter() - start
+
+        n = repeat * len(pages)
+        return {key: value / n * 1000 for key, value in times.items()}
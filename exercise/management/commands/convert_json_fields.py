@@ -0,0 +1,53 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from lib.fields import NativeJSONField, TextJSONField
+
+
+class Command(BaseCommand):
+    help = ("Convert the database columns of the JSON fields (lib.fields.JSONField) "
+            "between text and the native JSON type of the database. Set JSON_FIELDS_NATIVE "
+            "in the settings to match the columns after converting them. "
+            "Supports PostgreSQL and SQLite, which stores native JSON as text.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--to',
+            choices=('native', 'text'),
+            default='native',
+            help="The column type to convert to. By default, native.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError(f"Converting the JSON fields is not supported on {connection.vendor}.")
+        native = options['to'] == 'native'
+        quote = connection.ops.quote_name
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in apps.get_models():
+                if not model._meta.managed or model._meta.proxy:
+                    continue
+                for field in model._meta.local_fields:
+                    if not isinstance(field, (TextJSONField, NativeJSONField)):
+                        continue
+                    table = quote(model._meta.db_table)
+                    column = quote(field.column)
+                    # The text fields store empty values as '' and the native fields as JSON null
+                    if connection.vendor == 'sqlite':
+                        if native:
+                            cursor.execute(f"UPDATE {table} SET {column} = 'null' WHERE {column} = ''")
+                        else:
+                            cursor.execute(f"UPDATE {table} SET {column} = '' WHERE {column} = 'null'")
+                    elif native:
+                        cursor.execute(
+                            f"ALTER TABLE {table} ALTER COLUMN {column} TYPE jsonb "
+                            f"USING (CASE WHEN {column} = '' THEN 'null' ELSE {column} END)::jsonb"
+                        )
+                    else:
+                        cursor.execute(
+                            f"ALTER TABLE {table} ALTER COLUMN {column} TYPE text "
+                            f"USING (CASE WHEN {column} = 'null'::jsonb THEN '' ELSE {column}::text END)"
+                        )
+                    self.stdout.write(f"Converted {model._meta.label}.{field.name} to {options['to']}")
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exercise", "0051_revealrule_show_zero_points_immediately"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exercisetask",
+            name="regraded_up_to",
+            field=models.IntegerField(
+                blank=True, null=True, verbose_name="LABEL_REGRADED_UP_TO"
+            ),
+        ),
+        migrations.AddField(
+            model_name="exercisetask",
+            name="regraded_count",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="LABEL_REGRADED_COUNT"
+            ),
+        ),
+    ]
@@ -3,6 +3,8 @@ from typing import Dict, List, Optional, cast
 from bs4 import BeautifulSoup
 from bs4.element import NavigableString, Tag
 
+from lib.remote_page import parse_html
+
 class ExercisePage:
     """
     Represents the pages that are received from exercise services as objects.
@@ -51,7 +53,7 @@ class ExercisePage:
         If `feedback_revealed` is False, file input fields in the form
         are marked as disabled and the submit button is removed.
         """
-        soup = BeautifulSoup(self.content, 'html5lib')
+        soup = parse_html(self.content)
 
         exercise_element = self._find_exercise_element(soup)
         if exercise_element is None:
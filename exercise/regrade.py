@@ -0,0 +1,191 @@
+"""
+Grading many existing submissions concurrently.
+
+Regrading sends the submissions to the exercise service from a pool of
+threads. The number of concurrent grading requests to each exercise service
+host is adapted to how the grader copes (AIMD): it starts from one, grows by
+one after every window of successful requests, and is halved when a request
+fails, e.g. on a 5xx response or a timeout. Every decrease also pauses the
+requests to the host for a time that doubles on consecutive decreases. The
+limit is never more than REGRADE_MAX_CONCURRENCY.
+
+The limiters are shared by all the regrade runs of the process, so two
+exercises served by the same grader do not both hit it at full concurrency.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from queue import Empty, Queue
+from threading import Condition, Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+
+from lib.request_globals import RequestGlobal
+from .exercise_models import BaseExercise
+
+
+logger = logging.getLogger('aplus.exercise')
+
+T = TypeVar("T")
+
+BACKOFF_INITIAL = 0.5
+BACKOFF_MAX = 30.0
+
+
+class AIMDLimiter:
+    """Limits the number of concurrent requests to a single host"""
+    def __init__(self, maximum: int, initial: int = 1, minimum: int = 1) -> None:
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        # Incremented on every decrease, so that the failures of the requests
+        # started before the decrease do not decrease the limit again
+        self.epoch = 0
+        # The number of decreases since the last success
+        self.failures = 0
+        self.paused_until = 0.0
+        self.condition = Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Waits until a request may be sent and returns the epoch to pass to
+        release(). Returns None if timeout seconds passed first.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.condition:
+            while True:
+                now = monotonic()
+                if self.in_flight < int(self.limit) and now >= self.paused_until:
+                    self.in_flight += 1
+                    return self.epoch
+                wait = self.paused_until - now if now < self.paused_until else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.condition.wait(wait)
+
+    def release(self, epoch: int, success: bool) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            if success:
+                self.failures = 0
+                # Grows by one when a whole window of requests has succeeded
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif epoch == self.epoch:
+                self.epoch += 1
+                self.failures += 1
+                self.limit = max(self.minimum, self.limit / 2)
+                backoff = min(BACKOFF_MAX, BACKOFF_INITIAL * 2 ** (self.failures - 1))
+                self.paused_until = monotonic() + backoff
+            self.condition.notify_all()
+
+
+_limiters: Dict[str, AIMDLimiter] = {}
+_limiters_lock = Lock()
+
+
+def get_limiter(host: str) -> AIMDLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = AIMDLimiter(settings.REGRADE_MAX_CONCURRENCY)
+        return limiter
+
+
+def grader_host(exercise: BaseExercise) -> str:
+    url = exercise.get_service_url(exercise.course_instance.default_language)
+    return urlsplit(url).netloc
+
+
+def grade_concurrently(
+        items: Iterable[T],
+        host: Callable[[T], str],
+        grade: Callable[[T], bool],
+        on_done: Optional[Callable[[T, bool], None]] = None,
+        ) -> None:
+    """
+    Calls grade for each item in a pool of REGRADE_MAX_CONCURRENCY threads.
+    grade should return False if the grader failed to respond, which makes
+    the concurrency towards the host of the item smaller. The items are
+    dispatched in order. on_done is called in the calling thread for each
+    item as it completes.
+    """
+    completed: "Queue[Tuple[T, bool]]" = Queue()
+
+    def work(item: T, limiter: AIMDLimiter, epoch: int) -> None:
+        success = False
+        try:
+            success = grade(item)
+        except Exception: # pylint: disable=broad-except
+            logger.exception("Failed to grade %s", item)
+        finally:
+            limiter.release(epoch, success)
+            # The thread is reused for other items
+            RequestGlobal.clear_globals()
+            connections.close_all()
+            completed.put((item, success))
+
+    def drain(timeout: Optional[float] = None) -> int:
+        done = 0
+        try:
+            while True:
+                item, success = completed.get(block=timeout is not None, timeout=timeout)
+                timeout = None
+                done += 1
+                if on_done is not None:
+                    on_done(item, success)
+        except Empty:
+            pass
+        return done
+
+    in_flight = 0
+    with ThreadPoolExecutor(
+            max_workers=settings.REGRADE_MAX_CONCURRENCY,
+            thread_name_prefix="regrade",
+            ) as executor:
+        for item in items:
+            limiter = get_limiter(host(item))
+            epoch = limiter.acquire(timeout=0.5)
+            while epoch is None:
+                in_flight -= drain()
+                epoch = limiter.acquire(timeout=0.5)
+            executor.submit(work, item, limiter, epoch)
+            in_flight += 1
+            in_flight -= drain()
+        while in_flight:
+            in_flight -= drain(timeout=0.5)
+
+
+class RegradeProgress:
+    """
+    Follows the completion of submissions that are dispatched in the order of
+    their ids but complete in any order. All the submissions up to `up_to`
+    have been completed, so a resumed run can continue after it.
+    """
+    def __init__(self, submission_ids: List[int], done_before: int = 0) -> None:
+        self.submission_ids = submission_ids
+        self.positions = {submission_id: i for i, submission_id in enumerate(submission_ids)}
+        self.completed = [False] * len(submission_ids)
+        self.done_before = done_before
+        self.count = done_before
+        self.next = 0
+
+    def complete(self, submission_id: int) -> None:
+        self.completed[self.positions[submission_id]] = True
+        self.count += 1
+        while self.next < len(self.completed) and self.completed[self.next]:
+            self.next += 1
+
+    @property
+    def up_to(self) -> Optional[int]:
+        return self.submission_ids[self.next - 1] if self.next > 0 else None
+
+    @property
+    def count_up_to(self) -> int:
+        """The number of completed submissions up to and including up_to"""
+        return self.done_before + self.next
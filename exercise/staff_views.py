@@ -378,7 +378,8 @@ class StartRegradeView(ExerciseBaseView, BaseRedirectView):
             if created:
                 result = regrade_exercises.delay(self.exercise.id, regrade_type)
                 task.task_id = result.id
-                task.save()
+                # The task may already have saved its progress
+                task.save(update_fields=['task_id'])
                 messages.info(request, _("NEW_REGRADE_TASK_CREATED"))
             else:
                 messages.warning(request, _("REGRADE_ALREADY_RUNNING"))
@@ -8,7 +8,7 @@ from urllib.parse import urlparse
 
 from binaryornot.check import is_binary
 from django.conf import settings
-from django.db import models, DatabaseError
+from django.db import models, transaction, DatabaseError
 from django.db.models import F
 from django.db.models.signals import post_delete
 from django.http.request import HttpRequest
@@ -656,8 +656,9 @@ class Submission(SubmissionProto, models.Model):
 
         if not PendingSubmission.objects.is_grader_stable():
             # We have a successful grading task in the recovery state. It may be a sign that problems
-            # have been resolved, so immediately retry the next pending submission, to speed up recovery
-            retry_submissions()
+            # have been resolved, so immediately retry the next pending submission, to speed up recovery.
+            # The retry runs in the celery worker, so that it does not hold up the grader's request.
+            transaction.on_commit(retry_submissions.delay)
 
     def set_rejected(self):
         self.status = self.STATUS.REJECTED
@@ -0,0 +1,257 @@
+"""
+ZIP archives of the files submitted to an exercise.
+
+The archive is written entry by entry, reading each submitted file in chunks,
+so that it can be streamed to the response or spooled to a temporary file
+without holding the whole archive in memory. All the database queries are
+made before writing starts: the submissions with their submitters and files
+are prefetched, and the submission number of each submission is computed from
+a single query instead of one query per submission.
+"""
+from bisect import bisect_right
+from datetime import timedelta
+from io import RawIOBase
+from time import localtime, time
+from typing import IO, Dict, Iterator, List, Optional, Sequence, Set
+import zipfile
+
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from course.models import CourseInstance
+from lib.cache.cached import resolve_proxies
+from userprofile.models import UserProfile
+from .cache.points import ExercisePoints
+from .exercise_models import BaseExercise
+from .submission_models import Submission
+
+
+INFO_CSV_HEADER = (
+    "filename,label,created_at,original_name,points,submission_id,"
+    "submitter_name,exercise_form_name,submission_index\n"
+)
+CHUNK_SIZE = 64 * 1024
+# The archives built in the background are stored under this directory of the
+# default storage. The web server only serves MEDIA_ROOT/public, so the
+# archives are downloaded through the API, which checks the permissions.
+ARCHIVE_DIR = "submission_archives"
+
+
+def get_group_id(submission: Submission) -> Optional[str]:
+    group_id = None
+    if 'group' in submission.meta_data:
+        group_id = submission.meta_data['group']
+    if group_id is None:
+        for lst in submission.submission_data:
+            if '_aplus_group' in lst:
+                group_id = lst[1]
+                break
+    return group_id
+
+
+def submission_numbers(exercise: BaseExercise, submissions: Sequence[Submission]) -> Dict[int, int]:
+    """
+    Returns the number of each submission, counting the submissions to the
+    exercise by any of its submitters in the order of submission time.
+    """
+    rows = (
+        Submission.submitters.through.objects
+        .filter(submission__exercise=exercise)
+        .order_by('submission__submission_time', 'submission_id')
+        .values_list('submission_id', 'userprofile_id')
+    )
+    positions: Dict[int, int] = {}
+    submitter_positions: Dict[int, List[int]] = {}
+    for submission_id, profile_id in rows:
+        position = positions.setdefault(submission_id, len(positions))
+        submitter_positions.setdefault(profile_id, []).append(position)
+
+    numbers = {}
+    for submission in submissions:
+        position = positions.get(submission.id)
+        if position is None:
+            continue
+        earlier = [
+            submitter_positions[submitter.id][:bisect_right(submitter_positions[submitter.id], position)]
+            for submitter in submission.submitters.all()
+        ]
+        if len(earlier) == 1:
+            numbers[submission.id] = len(earlier[0])
+        else:
+            # Group members may have submitted different earlier submissions
+            numbers[submission.id] = len(set().union(*earlier))
+    return numbers
+
+
+def exported_submissions(
+        instance: CourseInstance,
+        exercise: BaseExercise,
+        best: bool,
+        ) -> List[Submission]:
+    """
+    Returns the submissions of the students in the order they are exported.
+    If best is True, only the best submission of each student is included.
+    """
+    submissions = list(
+        Submission.objects
+        .filter(exercise=exercise)
+        .defer('feedback', 'assistant_feedback', 'grading_data')
+        .prefetch_related(
+            Prefetch('submitters', queryset=UserProfile.objects.select_related('user')),
+            'files',
+        )
+        .order_by('submission_time')
+    )
+
+    staff = instance.get_course_staff_ids(
+        submitter
+        for submission in submissions
+        for submitter in submission.submitters.all()
+    )
+
+    # Skip staff submissions
+    student_submissions = [
+        submission for submission in submissions
+        if not any(submitter.id in staff for submitter in submission.submitters.all())
+    ]
+    if not best:
+        return student_submissions
+
+    unique_submitters: Dict[int, UserProfile] = {}
+    for submission in student_submissions:
+        for submitter in submission.submitters.all():
+            unique_submitters.setdefault(submitter.id, submitter)
+
+    # Resolve the points of all the students at once
+    points = [
+        ExercisePoints.proxy(exercise.id, submitter.user.id, modifiers=(False,))
+        for submitter in unique_submitters.values()
+    ]
+    resolve_proxies(points)
+
+    by_id = {submission.id: submission for submission in submissions}
+    best_submissions = []
+    added: Set[int] = set()
+    for entry in points:
+        best_submission = entry.best_submission
+        if best_submission is None or best_submission.id not in by_id:
+            continue
+        # Prevent duplicate best submissions due to group submissions
+        if best_submission.id not in added:
+            added.add(best_submission.id)
+            best_submissions.append(by_id[best_submission.id])
+    return best_submissions
+
+
+def write_submissions_zip( # pylint: disable=too-many-locals
+        fileobj: IO[bytes],
+        exercise: BaseExercise,
+        submissions: Sequence[Submission],
+        ) -> Iterator[int]:
+    """
+    Writes the files of the submissions and an info.csv into a ZIP archive
+    in fileobj, which does not need to be seekable. This is a generator that
+    yields the number of submissions handled so far after each chunk written.
+    """
+    numbers = submission_numbers(exercise, submissions)
+    exercise_form_name = None
+    info_csv = [INFO_CSV_HEADER]
+
+    with zipfile.ZipFile(fileobj, 'w') as zip_file:
+        for count, submission in enumerate(submissions, start=1):
+            submitters = submission.submitters.all()
+            group_id = None
+            if len(submitters) > 1:
+                group_id = get_group_id(submission)
+                if group_id is not None:
+                    try:
+                        group_id = int(group_id)
+                    except ValueError:
+                        continue
+            if exercise_form_name is None:
+                exercise_form_name = ";".join(list(exercise.exercise_info["form_i18n"].keys()))
+            submission_time = submission.submission_time.strftime('%Y-%m-%d %H:%M:%S %z')
+            points = submission.service_points
+            submitter_name = ";".join([submitter.user.get_full_name() for submitter in submitters])
+            submitters_string = '+'.join(sorted([str(submitter.student_id) for submitter in submitters]))
+            label = f"group{group_id}" if group_id is not None else submitters_string
+            submission_num = numbers[submission.id]
+
+            for i, submitted_file in enumerate(submission.files.all(), start=1):
+                filename = f"{submitters_string}_file{i}_submission{submission_num}"
+                original_name = submitted_file.filename
+                try:
+                    with submitted_file.file_object.file.open('rb') as file:
+                        info = zipfile.ZipInfo(filename, date_time=localtime(time())[:6])
+                        info.external_attr = 0o600 << 16
+                        info.file_size = submitted_file.file_object.size
+                        with zip_file.open(info, 'w') as entry:
+                            while chunk := file.read(CHUNK_SIZE):
+                                entry.write(chunk)
+                                yield count - 1
+                    info_csv.append(
+                        f"{filename},{label},{submission_time},{original_name},{points},"
+                        f"{submission.id},{submitter_name},{exercise_form_name},{submission_num}\n"
+                    )
+                except OSError:
+                    pass
+            yield count
+        zip_file.writestr('info.csv', "".join(info_csv))
+    yield len(submissions)
+
+
+class StreamBuffer(RawIOBase):
+    """A write-only, unseekable file that keeps what is written until it is taken"""
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int: # type: ignore
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_submissions_zip(exercise: BaseExercise, submissions: Sequence[Submission]) -> Iterator[bytes]:
+    """Yields the ZIP archive of the submissions in chunks for a StreamingHttpResponse"""
+    buffer = StreamBuffer()
+    for _ in write_submissions_zip(buffer, exercise, submissions):
+        data = buffer.take()
+        if data:
+            yield data
+    data = buffer.take()
+    if data:
+        yield data
+
+
+def archive_name(exercise_id: int, task_id: str) -> str:
+    """Returns the storage name of an archive built in the background"""
+    return f"{ARCHIVE_DIR}/{exercise_id}/{task_id}.zip"
+
+
+def delete_expired_archives(max_age: float) -> int:
+    """
+    Deletes the stored archives that are older than max_age seconds. Returns
+    the number of deleted archives.
+    """
+    if not default_storage.exists(ARCHIVE_DIR):
+        return 0
+    expired = timezone.now() - timedelta(seconds=max_age)
+    deleted = 0
+    exercise_dirs, _ = default_storage.listdir(ARCHIVE_DIR)
+    for exercise_dir in exercise_dirs:
+        path = f"{ARCHIVE_DIR}/{exercise_dir}"
+        _, names = default_storage.listdir(path)
+        for name in names:
+            if default_storage.get_modified_time(f"{path}/{name}") < expired:
+                default_storage.delete(f"{path}/{name}")
+                deleted += 1
+    return deleted
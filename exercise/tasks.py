@@ -1,14 +1,28 @@
 import logging
-from time import sleep
+from tempfile import TemporaryFile
+from time import monotonic
+from typing import Any, Dict, Iterator
+
+from django.core.files import File
+from django.core.files.storage import default_storage
 
 from aplus.celery import app
 from .exercise_models import BaseExercise, ExerciseTask
+from .regrade import RegradeProgress, grade_concurrently, grader_host
 from .submission_models import Submission
+from .submission_zip import archive_name, exported_submissions, write_submissions_zip
 
 logger = logging.getLogger('aplus.exercise')
 
-@app.task(bind=True)
-def regrade_exercises(self, exerciseid: int, regrade_type: str) -> None:
+# Submissions are loaded for regrading in chunks of this size
+REGRADE_CHUNK_SIZE = 100
+# Seconds between saving the progress of a regrade in its ExerciseTask
+REGRADE_SAVE_INTERVAL = 5
+
+# A regrade interrupted by a worker restart is redelivered and continues from
+# the progress saved in its ExerciseTask
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def regrade_exercises(self, exerciseid: int, regrade_type: str) -> None: # pylint: disable=too-many-locals
     try:
         exercise = BaseExercise.objects.get(pk=exerciseid)
     except BaseExercise.DoesNotExist:
@@ -26,24 +40,56 @@ def regrade_exercises(self, exerciseid: int, regrade_type: str) -> None:
             Submission.STATUS.ERROR
         ))
 
-    count = 0
-    total = qs.count()
-    for submission in qs:
+    task = ExerciseTask.objects.filter(
+        exercise=exercise,
+        task_type=ExerciseTask.TASK_TYPE.REGRADE,
+    ).first()
+    if task is not None and task.regraded_up_to is not None:
+        qs = qs.filter(id__gt=task.regraded_up_to)
+
+    submission_ids = list(qs.order_by('id').values_list('id', flat=True))
+    progress = RegradeProgress(submission_ids, task.regraded_count if task is not None else 0)
+    total = progress.count + len(submission_ids)
+    host = grader_host(exercise)
+    saved = {'up_to': progress.up_to, 'time': monotonic()}
+
+    def submissions() -> Iterator[Submission]:
+        for i in range(0, len(submission_ids), REGRADE_CHUNK_SIZE):
+            yield from qs.filter(id__in=submission_ids[i:i + REGRADE_CHUNK_SIZE]).order_by('id')
+
+    def grade(submission: Submission) -> bool:
         page = exercise.grade(submission)
         for error in page.errors:
             logger.error( # pylint: disable=logging-fstring-interpolation
                 f"regrade_exercises task error (Exercise: {exercise.id}, Submission: {submission.id}): {error}"
             )
+        return page.is_loaded
+
+    def save_progress() -> None:
+        ExerciseTask.objects.filter(pk=task.pk).update(
+            regraded_up_to=progress.up_to,
+            regraded_count=progress.count_up_to,
+        )
+        saved['up_to'] = progress.up_to
+        saved['time'] = monotonic()
 
-        count += 1
+    def on_done(submission: Submission, _success: bool) -> None:
+        progress.complete(submission.id)
         self.update_state(
             state='PROGRESS',
             meta={
-                'current': count,
+                'current': progress.count,
                 'total': total,
             },
         )
-        sleep(0.5)  # Delay 500 ms to avoid choking grader
+        if (
+            task is not None
+            and progress.up_to != saved['up_to']
+            and monotonic() - saved['time'] >= REGRADE_SAVE_INTERVAL
+        ):
+            save_progress()
+
+    grade_concurrently(submissions(), lambda submission: host, grade, on_done)
 
     # Tell DB that there is no task running anymore
     try:
@@ -54,3 +100,54 @@ def regrade_exercises(self, exerciseid: int, regrade_type: str) -> None:
             exercise.id)
         return
     task.delete()
+
+
+@app.task
+def grade_submission(submission_id: int, url_name: str = "exercise") -> None:
+    """Grades a new submission outside of the request that created it"""
+    try:
+        submission = Submission.objects.select_related('exercise').get(pk=submission_id)
+    except Submission.DoesNotExist:
+        logger.warning("grade_submission task: submission id %s not found", submission_id)
+        return
+
+    exercise = submission.exercise.as_leaf_class()
+    page = exercise.grade(submission, url_name=url_name)
+    for error in page.errors:
+        logger.error(
+            "grade_submission task error (Exercise: %s, Submission: %s): %s",
+            exercise.id,
+            submission.id,
+            error,
+        )
+
+
+@app.task(bind=True)
+def build_submissions_zip(self, exercise_id: int, best: bool) -> Dict[str, Any]:
+    """
+    Writes the ZIP archive of the submitted files of an exercise into a
+    temporary file and saves it in the default storage. Returns the name of
+    the stored archive. The archive is deleted by the periodic
+    delete_submission_archives task after SUBMISSION_ARCHIVE_EXPIRY seconds.
+    """
+    exercise = BaseExercise.objects.get(pk=exercise_id)
+    submissions = exported_submissions(exercise.course_instance, exercise, best)
+    total = len(submissions)
+    reported = None
+    with TemporaryFile() as spool:
+        for count in write_submissions_zip(spool, exercise, submissions):
+            if count != reported:
+                reported = count
+                self.update_state(
+                    state='PROGRESS',
+                    meta={
+                        'current': count,
+                        'total': total,
+                    },
+                )
+        spool.seek(0)
+        name = default_storage.save(archive_name(exercise.id, self.request.id), File(spool))
+    return {
+        'exercise_id': exercise.id,
+        'name': name,
+    }
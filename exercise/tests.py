@@ -2,13 +2,20 @@ import json
 import urllib
 from datetime import datetime, timedelta
 from io import BytesIO, StringIO
+from threading import Condition, Event, Thread
+from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection, models
+from django.db.models import ExpressionWrapper, F, TextField
+from django.db.models.functions import Cast
+from django.test import Client, TestCase, TransactionTestCase, override_settings
 from django.test.client import RequestFactory
+from django.test.utils import isolate_apps
 from django.utils import timezone
 from django.utils.datastructures import MultiValueDict
 
@@ -16,14 +23,20 @@ from course.models import Course, CourseInstance, CourseHook, CourseModule, \
     LearningObjectCategory
 from deviations.models import DeadlineRuleDeviation, \
     MaxSubmissionsRuleDeviation
+from exercise import grading
+from exercise.cache.collections import CachedCollectionTargets
 from exercise.cache.points import ExercisePoints
-from exercise.exercise_models import build_upload_dir
+from exercise.exercise_models import ExerciseTask, build_upload_dir
+from exercise.exercisecollection_models import ExerciseCollection, update_exercise_collection_submission
 from exercise.models import BaseExercise, StaticExercise, \
     ExerciseWithAttachment, Submission, SubmittedFile, LearningObject, \
     RevealRule, CourseChapter
 from exercise.protocol.exercise_page import ExercisePage
+from exercise.regrade import AIMDLimiter, RegradeProgress, get_limiter, grade_concurrently
 from exercise.reveal_states import ExerciseRevealState, ModuleRevealState
 from exercise.submission_models import build_upload_dir as build_upload_dir_for_submission_model
+from exercise.tasks import grade_submission
+from lib.fields import NativeJSONField, RawJSON, TextJSONField
 from lib.helpers import build_aplus_url
 
 class ExerciseTestBase(TestCase):
@@ -856,6 +869,69 @@ class ExerciseTest(ExerciseTestBase):
 
         exercise.delete()
 
+    def test_async_grading(self):
+        """
+        Checks that a synchronous request grades the submission before it
+        responds, and an asynchronous request only queues it for the worker.
+        """
+        def grade(exercise, submission, request=None, no_penalties=False, url_name="exercise"):
+            graded.append(submission.id)
+            submission.set_points(5, 10)
+            submission.set_ready()
+            submission.save()
+            page = ExercisePage(exercise)
+            page.is_loaded = page.is_accepted = page.is_graded = True
+            return page
+
+        exercise = BaseExercise.objects.create(
+            order=4,
+            name="test exercise 4",
+            course_module=self.course_module,
+            category=self.learning_object_category,
+            url="bbb",
+            max_points=10,
+            max_submissions=0,
+            service_url="http://grader.invalid/testServiceURL",
+        )
+        self.course_instance.enroll_student(self.user)
+        self.client.login(username="testUser", password="testPassword")
+
+        def submit():
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(exercise.get_absolute_url(), {"key": "value"})
+            self.assertEqual(response.status_code, 302)
+            return response, exercise.submissions.latest('id')
+
+        graded = []
+        queued = []
+        with patch.object(BaseExercise, 'grade', grade):
+            # The synchronous request has graded the submission when it responds
+            for _ in range(3):
+                _, submission = submit()
+                self.assertEqual(graded[-1], submission.id)
+                self.assertEqual(submission.status, Submission.STATUS.READY)
+
+            graded.clear()
+            with override_settings(SUBMISSION_ASYNC_GRADING='celery'), \
+                    patch('exercise.grading.grade_submission.delay', lambda *args: queued.append(args)):
+                for _ in range(3):
+                    response, submission = submit()
+                    self.assertTrue(response.url.endswith("?wait=1"))
+                    self.assertEqual(submission.status, Submission.STATUS.WAITING)
+            # The asynchronous requests did not grade
+            self.assertEqual(graded, [])
+            submissions = exercise.submissions.order_by('id')
+            self.assertEqual([args[0] for args in queued], [s.id for s in submissions[3:]])
+
+            # The worker grades the queued submissions
+            for args in queued:
+                grade_submission(*args)
+        self.assertEqual(graded, [s.id for s in submissions[3:]])
+        self.assertEqual(
+            [s.status for s in exercise.submissions.all()],
+            [Submission.STATUS.READY] * 6,
+        )
+
     def test_can_show_model_solutions(self):
         course_module_with_late_submissions_open = CourseModule.objects.create(
             name="test module late open",
@@ -1609,3 +1685,452 @@ class ExerciseTest(ExerciseTestBase):
         user2_submission.grader = self.teacher.userprofile
         user2_submission.save()
         self.assertEqual(exercise.get_submission_list_url(), get_url_user_id())
+
+
+class GradingLoadTest(TransactionTestCase):
+    """
+    Sends a submission from each of several students to an exercise whose
+    grader blocks until it is released, and checks which requests wait for it.
+    The requests are started one at a time, each when the previous one has
+    done its database writes, so that SQLite is not written concurrently.
+    """
+    students = 4
+
+    def setUp(self):
+        now = timezone.now()
+        course = Course.objects.create(name="load course", code="LOAD-1", url="load-course")
+        instance = CourseInstance.objects.create(
+            instance_name="Load",
+            starting_time=now - timedelta(days=1),
+            ending_time=now + timedelta(days=1),
+            course=course,
+            url="load",
+        )
+        module = CourseModule.objects.create(
+            name="load module",
+            url="load-module",
+            course_instance=instance,
+            opening_time=now - timedelta(days=1),
+            closing_time=now + timedelta(days=1),
+        )
+        category = LearningObjectCategory.objects.create(name="load category", course_instance=instance)
+        self.exercise = BaseExercise.objects.create(
+            name="load exercise",
+            url="load-exercise",
+            course_module=module,
+            category=category,
+            max_points=10,
+            max_submissions=0,
+            service_url="http://grader.invalid/load",
+        )
+        self.clients = []
+        for i in range(self.students):
+            user = User.objects.create(username=f"loadUser{i}")
+            instance.enroll_student(user)
+            client = Client()
+            client.force_login(user)
+            self.clients.append(client)
+
+        self.condition = Condition()
+        self.released = Event()
+        self.grading = 0
+        self.responses = []
+
+    def blocking_grade(self):
+        def grade(exercise, submission, request=None, no_penalties=False, url_name="exercise"):
+            with self.condition:
+                self.grading += 1
+                self.condition.notify_all()
+            self.released.wait(10)
+            page = ExercisePage(exercise)
+            page.is_loaded = page.is_accepted = True
+            return page
+        return patch.object(BaseExercise, 'grade', grade)
+
+    def submit(self, client):
+        response = client.post(self.exercise.get_absolute_url(), {"key": "value"})
+        with self.condition:
+            self.responses.append(response)
+            self.condition.notify_all()
+
+    def submit_all(self, started):
+        """Starts a request for each student, the next one when started(n) is true for n requests"""
+        threads = []
+        for n, client in enumerate(self.clients, 1):
+            threads.append(Thread(target=self.submit, args=(client,)))
+            threads[-1].start()
+            with self.condition:
+                self.assertTrue(self.condition.wait_for(lambda n=n: started(n), timeout=10))
+        return threads
+
+    def release(self, threads):
+        self.released.set()
+        for thread in threads:
+            thread.join(10)
+
+    def test_sync_grading_holds_requests(self):
+        threads = []
+        with self.blocking_grade():
+            try:
+                threads = self.submit_all(lambda n: self.grading == n)
+                # Every request is tied up until the grader responds
+                self.assertEqual(self.responses, [])
+            finally:
+                self.release(threads)
+        self.assertEqual([response.status_code for response in self.responses], [302] * self.students)
+
+    def test_async_grading_releases_requests(self):
+        threads = []
+        with self.blocking_grade(), \
+                patch.object(grading, '_executor', None), \
+                override_settings(SUBMISSION_ASYNC_GRADING='thread', SUBMISSION_ASYNC_GRADING_THREADS=self.students):
+            try:
+                threads = self.submit_all(lambda n: len(self.responses) == n and self.grading == n)
+                # Every request has responded while the graders are still blocked
+                self.assertEqual(self.grading, self.students)
+                self.assertTrue(all(response.url.endswith("?wait=1") for response in self.responses))
+                self.assertEqual(
+                    self.exercise.submissions.filter(status=Submission.STATUS.WAITING).count(),
+                    self.students,
+                )
+            finally:
+                self.release(threads)
+                if grading._executor is not None: # pylint: disable=protected-access
+                    grading._executor.shutdown() # pylint: disable=protected-access
+
+
+class RegradeTest(ExerciseTestBase):
+
+    def test_aimd_limiter(self):
+        limiter = AIMDLimiter(maximum=4)
+        self.assertEqual(limiter.acquire(timeout=0), 0)
+        self.assertIsNone(limiter.acquire(timeout=0))
+        limiter.release(0, True)
+        # Grows by one after a window of successes, up to the maximum
+        for _ in range(20):
+            limiter.release(limiter.acquire(timeout=0), True)
+        self.assertEqual(limiter.limit, 4)
+
+        epochs = [limiter.acquire(timeout=0) for _ in range(4)]
+        self.assertIsNone(limiter.acquire(timeout=0))
+        # The failures of the requests sent in the same window halve the limit once
+        for epoch in epochs:
+            limiter.release(epoch, False)
+        self.assertEqual(limiter.limit, 2)
+        # and pause the requests for a while
+        self.assertIsNone(limiter.acquire(timeout=0.05))
+        self.assertIsNotNone(limiter.acquire(timeout=5))
+
+    def test_grade_concurrently(self):
+        """
+        A fake grader fails when it gets more than its capacity of concurrent
+        requests. The grader holds the requests until the limiter lets no
+        more through, and then answers them together, so the requests are
+        graded in rounds whose size is the concurrency limit.
+        """
+        capacity = 3
+        host = "test-grade-concurrently"
+        condition = Condition()
+        sent = []
+        waiting = set()
+        failures = []
+
+        def grade(item):
+            with condition:
+                sent.append(item)
+                waiting.add(item)
+                overloaded = len(waiting) > capacity
+                condition.notify_all()
+                condition.wait_for(lambda: item not in waiting, timeout=10)
+            if overloaded:
+                failures.append(item)
+            return not overloaded
+
+        done = []
+        with override_settings(REGRADE_MAX_CONCURRENCY=8), \
+                patch('exercise.regrade.BACKOFF_INITIAL', 0), \
+                patch.dict('exercise.regrade._limiters', clear=True):
+            regrade = Thread(target=grade_concurrently, args=(
+                range(60), lambda item: host, grade, lambda item, success: done.append(item),
+            ))
+            regrade.start()
+            limiter = get_limiter(host)
+
+            def stalled():
+                # Every request the limiter has let through is waiting in the
+                # grader, and either no more are let through or all are sent
+                with limiter.condition:
+                    return len(waiting) == limiter.in_flight and (
+                        limiter.in_flight >= int(limiter.limit) or len(sent) == 60
+                    )
+
+            rounds = []
+            while regrade.is_alive():
+                with condition:
+                    if not condition.wait_for(lambda: waiting and stalled(), timeout=0.1):
+                        continue
+                    rounds.append(len(waiting))
+                    waiting.clear()
+                    condition.notify_all()
+            regrade.join()
+
+        self.assertEqual(sorted(done), list(range(60)))
+        self.assertEqual(sum(rounds), 60)
+        # The concurrency grows by one after every window of successes
+        self.assertEqual(rounds[:5], [1, 2, 2, 3, 4])
+        # and backs off after overloading the grader
+        self.assertIn(failures[0], range(8, 12))
+        self.assertLess(rounds[5], 4)
+        self.assertLessEqual(max(rounds), 8)
+        self.assertLess(len(failures), 15)
+
+    def test_regrade_progress(self):
+        progress = RegradeProgress([3, 5, 8, 9], done_before=2)
+        self.assertIsNone(progress.up_to)
+        progress.complete(5)
+        self.assertIsNone(progress.up_to)
+        self.assertEqual(progress.count, 3)
+        progress.complete(3)
+        self.assertEqual(progress.up_to, 5)
+        progress.complete(9)
+        self.assertEqual(progress.up_to, 5)
+        self.assertEqual(progress.count_up_to, 4)
+        progress.complete(8)
+        self.assertEqual(progress.up_to, 9)
+        self.assertEqual((progress.count, progress.count_up_to), (6, 6))
+
+    def test_regrade_resumes(self):
+        from exercise.tasks import regrade_exercises # pylint: disable=import-outside-toplevel
+        submissions = list(self.base_exercise.submissions.order_by('id'))
+        task = ExerciseTask.objects.create(
+            exercise=self.base_exercise,
+            task_type=ExerciseTask.TASK_TYPE.REGRADE,
+            task_id="test",
+            regraded_up_to=submissions[0].id,
+            regraded_count=1,
+        )
+        graded = []
+        def grade(exercise, submission, request=None, no_penalties=False, url_name="exercise"):
+            graded.append(submission.id)
+            page = ExercisePage(exercise)
+            page.is_loaded = True
+            return page
+
+        states = []
+        with patch.object(BaseExercise, 'grade', grade), \
+                patch.object(regrade_exercises, 'update_state', lambda **kwargs: states.append(kwargs['meta'])):
+            regrade_exercises(self.base_exercise.id, 'all')
+
+        self.assertEqual(sorted(graded), [submission.id for submission in submissions[1:]])
+        self.assertEqual(states[-1], {'current': len(submissions), 'total': len(submissions)})
+        self.assertFalse(ExerciseTask.objects.filter(pk=task.pk).exists())
+
+
+class JSONFieldTest(ExerciseTestBase):
+
+    def test_decoded_on_access(self):
+        self.submission.submission_data = [["key", "value"]]
+        self.submission.meta_data = {"group": 3}
+        self.submission.save()
+
+        with patch('json.loads', wraps=json.loads) as loads:
+            submission = Submission.objects.get(pk=self.submission.pk)
+            self.assertEqual(submission.status, self.submission.status)
+            self.assertEqual(loads.call_count, 0)
+            self.assertEqual(submission.meta_data, {"group": 3})
+            self.assertEqual(submission.meta_data["group"], 3)
+            self.assertEqual(loads.call_count, 1)
+        # The fields that were not accessed are saved as they were
+        submission.save()
+        self.assertIsInstance(submission.__dict__['submission_data'], RawJSON)
+        self.assertEqual(
+            Submission.objects.get(pk=self.submission.pk).submission_data,
+            [["key", "value"]],
+        )
+
+        submission.meta_data = None
+        submission.save()
+        self.assertIsNone(Submission.objects.get(pk=self.submission.pk).meta_data)
+
+    def test_convert_json_fields(self):
+        self.submission.grading_data = None
+        self.submission.meta_data = {"group": 3}
+        self.submission.save()
+
+        def raw(column):
+            return (
+                Submission.objects.filter(pk=self.submission.pk)
+                .annotate(raw=Cast(column, TextField()))
+                .values_list('raw', flat=True)
+                .get()
+            )
+
+        self.assertEqual(raw('grading_data'), '')
+        call_command('convert_json_fields', stdout=StringIO())
+        self.assertEqual(raw('grading_data'), 'null')
+        self.assertEqual(json.loads(raw('meta_data')), {"group": 3})
+        call_command('convert_json_fields', '--to', 'text', stdout=StringIO())
+        self.assertEqual(raw('grading_data'), '')
+        self.assertIsNone(Submission.objects.get(pk=self.submission.pk).grading_data)
+
+
+@isolate_apps('exercise')
+class NativeJSONFieldTest(TransactionTestCase):
+    """Tests NativeJSONField regardless of the JSON_FIELDS_NATIVE setting"""
+
+    def setUp(self):
+        class NativeModel(models.Model):
+            data = NativeJSONField(blank=True)
+
+            class Meta:
+                app_label = 'exercise'
+
+        class TextModel(models.Model):
+            data = TextJSONField(blank=True)
+
+            class Meta:
+                app_label = 'exercise'
+
+        self.models = (NativeModel, TextModel)
+        with connection.schema_editor() as editor:
+            for model in self.models:
+                editor.create_model(model)
+
+    def tearDown(self):
+        with connection.schema_editor() as editor:
+            for model in self.models:
+                editor.delete_model(model)
+
+    def test_decoded_on_access(self):
+        NativeModel = self.models[0]
+        obj = NativeModel.objects.create(data={"group": 3, "members": [1, 2]})
+        with patch('json.loads', wraps=json.loads) as loads:
+            obj = NativeModel.objects.get(pk=obj.pk)
+            self.assertIsInstance(obj.__dict__['data'], RawJSON)
+            self.assertEqual(loads.call_count, 0)
+            self.assertEqual(obj.data, {"group": 3, "members": [1, 2]})
+            self.assertEqual(loads.call_count, 1)
+
+        obj.data = None
+        obj.save()
+        self.assertIsNone(NativeModel.objects.get(pk=obj.pk).data)
+
+    def test_key_lookup(self):
+        NativeModel = self.models[0]
+        obj = NativeModel.objects.create(data={"group": 3})
+        NativeModel.objects.create(data={"group": 4})
+        self.assertEqual(list(NativeModel.objects.filter(data__group=3)), [obj])
+        self.assertEqual(
+            list(NativeModel.objects.filter(pk=obj.pk).values_list('data__group', flat=True)),
+            [3],
+        )
+
+    def test_str_is_json_text(self):
+        for model in self.models:
+            with self.subTest(model=model.__name__):
+                obj = model.objects.create(data='{"group": 3}')
+                self.assertEqual(model.objects.get(pk=obj.pk).data, {"group": 3})
+                obj = model.objects.create(data='"text"')
+                self.assertEqual(model.objects.get(pk=obj.pk).data, "text")
+
+    def test_values(self):
+        for model in self.models:
+            with self.subTest(model=model.__name__):
+                obj = model.objects.create(data={"group": 3})
+                self.assertEqual(model.objects.filter(pk=obj.pk).values_list('data', flat=True).get(), {"group": 3})
+                self.assertEqual(model.objects.filter(pk=obj.pk).values('data').get(), {"data": {"group": 3}})
+                # The values are left undecoded only when loading model instances
+                self.assertIsInstance(model.objects.get(pk=obj.pk).__dict__['data'], RawJSON)
+                self.assertIsInstance(model.objects.only('data').get(pk=obj.pk).__dict__['data'], RawJSON)
+                field = model._meta.get_field('data')
+                value = (
+                    model.objects.filter(pk=obj.pk)
+                    .annotate(copy=ExpressionWrapper(F('data'), output_field=field.clone()))
+                    .values_list('copy', flat=True)
+                    .get()
+                )
+                self.assertEqual(value, {"group": 3})
+
+    def test_invalid_text_values(self):
+        TextModel = self.models[1]
+        obj = TextModel.objects.create(data='{"group": ')
+        self.assertIsNone(TextModel.objects.get(pk=obj.pk).data)
+        self.assertIsNone(TextModel.objects.filter(pk=obj.pk).values_list('data', flat=True).get())
+
+
+class ExerciseCollectionTest(ExerciseTestBase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.target_category = LearningObjectCategory.objects.create(
+            name="target category",
+            course_instance=cls.course_instance,
+        )
+        cls.collection_category = LearningObjectCategory.objects.create(
+            name="collection category",
+            course_instance=cls.course_instance,
+        )
+        cls.target_exercises = [
+            BaseExercise.objects.create(
+                name=f"target exercise {i}",
+                course_module=cls.course_module,
+                category=cls.target_category,
+                url=f"t{i}",
+                max_points=10,
+            )
+            for i in range(2)
+        ]
+        cls.collection = ExerciseCollection.objects.create(
+            name="test collection",
+            course_module=cls.course_module,
+            category=cls.collection_category,
+            target_category=cls.target_category,
+            url="c1",
+            max_points=20,
+            max_submissions=1,
+        )
+
+    def submit(self, exercise, points):
+        submission = Submission.objects.create(exercise=exercise)
+        submission.submitters.add(self.user.userprofile)
+        submission.set_points(points, exercise.max_points)
+        submission.set_ready()
+        submission.save()
+        return submission
+
+    def test_no_collections(self):
+        CachedCollectionTargets()
+        with self.assertNumQueries(0):
+            update_exercise_collection_submission(Submission, self.submission)
+
+    def test_collection_points(self):
+        with patch.object(
+                    ExerciseCollection,
+                    'check_submission',
+                    autospec=True,
+                    side_effect=ExerciseCollection.check_submission,
+                ) as check_submission, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.submit(self.target_exercises[0], 5)
+            best = self.submit(self.target_exercises[0], 7)
+            self.submit(self.target_exercises[1], 3)
+        # The collection is updated once for the transaction
+        self.assertEqual(check_submission.call_count, 1)
+        submission = self.collection.get_submissions_for_student(self.user.userprofile).get()
+        self.assertEqual(submission.grade, 10)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.submit(self.target_exercises[1], 9)
+        submission = self.collection.get_submissions_for_student(self.user.userprofile).get()
+        self.assertEqual(submission.grade, 16)
+        self.assertIn("Exercise 1: 7/10", submission.feedback)
+        self.assertIn("Exercise 2: 9/10", submission.feedback)
+
+        # Points that changed without a submission to the exercise are read again
+        best.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.submit(self.target_exercises[1], 9)
+        submission = self.collection.get_submissions_for_student(self.user.userprofile).get()
+        self.assertEqual(submission.grade, 14)
+        self.assertIn("Exercise 1: 5/10", submission.feedback)
@@ -1,3 +1,7 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 from lib.testdata import CourseTestCase
 from course.models import CourseInstance, CourseModule, LearningObjectCategory
 from deviations.models import MaxSubmissionsRuleDeviation
@@ -10,9 +14,11 @@ from .cache.points import (
     LearningObjectPoints,
     ModulePoints,
     ExercisePoints,
+    PointsDBData,
 )
 from .models import BaseExercise, CourseChapter, LearningObject, RevealRule, StaticExercise, Submission
 from deviations.models import DeadlineRuleDeviation
+from userprofile.models import UserProfile
 
 
 class CachedExerciseContentTest(ExerciseTestBase):
@@ -624,6 +630,28 @@ class CachedPointsTest(CourseTestCase):
         self.assertTrue(entry2.is_revealed)
         self.assertFalse(chapter_entry.is_revealed)
 
+    def test_get_many(self):
+        self.submission2.set_points(2,2)
+        self.submission2.set_ready()
+        self.submission2.save()
+        users = [self.student, self.user, self.teacher]
+        many = CachedPoints.get_many(self.instance, users)
+        self.assertEqual([p.user for p in many], users)
+        for user, points in zip(users, many):
+            single = CachedPoints(self.instance, user)
+            self.assertEqual(points.total().points, single.total().points)
+            self.assertEqual(points.total().submission_count, single.total().submission_count)
+            self.assertEqual(
+                [module.points for module in points.modules()],
+                [module.points for module in single.modules()],
+            )
+        self.assertEqual(many[0].total().points, 100)
+
+        # Everything is in the cache now, so no database queries are needed
+        with self.assertNumQueries(0):
+            CachedPoints.get_many(self.instance, users)
+
+
 class ExercisePointsTest(ExerciseTestBase):
     def test_forced_points(self) -> None:
         self.submission.set_points(5, 10)
@@ -677,3 +705,60 @@ class ExercisePointsTest(ExerciseTestBase):
         entry = ExercisePoints.get(self.base_exercise, self.user)
         self.assertEqual(entry.official_points, 50)
         self.assertEqual(entry.points, 50)
+
+
+class PointsDBDataTest(CourseTestCase):
+    def create_students(self, count):
+        users = User.objects.bulk_create(
+            User(username=f"bulk_{count}_{i}")
+            for i in range(count)
+        )
+        # bulk_create skips the post_save signal that normally creates the profiles
+        UserProfile.objects.bulk_create(UserProfile(user=user) for user in users)
+        profiles = UserProfile.objects.filter(user__in=users)
+        submissions = Submission.objects.bulk_create(
+            Submission(exercise=self.exercise, status=Submission.STATUS.READY, grade=i % 100)
+            for i in range(count)
+        )
+        Submission.submitters.through.objects.bulk_create(
+            Submission.submitters.through(submission_id=submission.id, userprofile_id=profile.id)
+            for submission, profile in zip(submissions, profiles)
+        )
+        return users
+
+    def fetch(self, users):
+        db = PointsDBData()
+        for user in users:
+            for exercise in (self.exercise, self.exercise2):
+                db.add(LearningObjectPoints.proxy(exercise.id, user.id, modifiers=(False,)))
+        with CaptureQueriesContext(connection) as queries:
+            db.fetch()
+        return db, len(queries)
+
+    def test_fetch_query_count(self):
+        query_counts = []
+        for count in (1, 100, 1000):
+            users = self.create_students(count)
+            db, num_queries = self.fetch(users)
+            query_counts.append(num_queries)
+            for user in users:
+                self.assertEqual(len(db.get_submissions(user.id, self.exercise.id)), 1)
+                self.assertEqual(db.get_submissions(user.id, self.exercise2.id), [])
+                self.assertEqual(db.get_groups(user.id, self.exercise.id), [])
+        self.assertEqual(len(set(query_counts)), 1, query_counts)
+
+    def test_fetch_matches_single_user(self):
+        db, _ = self.fetch([self.student, self.user])
+        self.assertEqual(
+            [s.id for s in db.get_submissions(self.student.id, self.exercise.id)],
+            [self.submission2.id, self.submission.id],
+        )
+        self.assertEqual(
+            [s.id for s in db.get_submissions(self.user.id, self.exercise2.id)],
+            [self.submission3.id],
+        )
+        self.assertEqual(
+            [s.id for s in db.get_submissions(self.student.id, self.exercise2.id)],
+            [self.submission3.id],
+        )
+        self.assertEqual(db.get_submissions(self.user.id, self.exercise.id), [])
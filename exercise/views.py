@@ -25,6 +25,7 @@ from lib.remote_page import RemotePageNotFound, request_for_response
 from lib.viewbase import BaseFormView, BaseRedirectMixin, BaseView
 from userprofile.models import UserProfile
 from .cache.points import CachedPoints, ModulePoints, ExercisePoints
+from .grading import grade_async
 from .models import BaseExercise, LearningObject, LearningObjectDisplay
 from .protocol.exercise_page import ExercisePage
 from .submission_models import SubmittedFile, Submission, SubmissionTagging, PendingSubmission
@@ -204,9 +205,14 @@ class ExerciseView(BaseRedirectMixin, ExerciseBaseView, EnrollableViewMixin):
                 # Deactivate the current draft if it exists.
                 self.exercise.unset_submission_draft(self.profile)
 
-                page = self.exercise.grade(new_submission,
-                    request,
-                    url_name=self.post_url_name)
+                if grade_async(self.exercise, new_submission, self.post_url_name):
+                    page = ExercisePage(self.exercise)
+                    page.is_accepted = True
+                    page.is_wait = True
+                else:
+                    page = self.exercise.grade(new_submission,
+                        request,
+                        url_name=self.post_url_name)
                 for error in page.errors:
                     messages.error(request, error)
 
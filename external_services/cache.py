@@ -1,5 +1,6 @@
 from django.db.models.signals import post_save, post_delete
 
+from inheritance.models import as_leaf_classes
 from lib.cache import CachedAbstract
 from .models import MenuItem
 
@@ -26,7 +27,13 @@ class CachedCourseMenu(CachedAbstract):
                 }
             groups[group_label]['items'].append(menu_entry)
 
-        for menu in instance.ext_services.all():
+        menus = list(instance.ext_services.select_related('service'))
+        # Resolve the services of all menu items at once instead of one by one
+        linked = [menu for menu in menus if menu.service is not None]
+        for menu, service in zip(linked, as_leaf_classes(menu.service for menu in linked)):
+            menu.service = service
+
+        for menu in menus:
             url = menu.url
             entry = {
                 'enabled': menu.is_enabled,
@@ -1,9 +1,11 @@
 from datetime import timedelta
 
+from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase
 from django.utils import timezone
 
 from course.models import Course, CourseInstance
+from inheritance.models import as_leaf_classes
 from userprofile.models import User
 from .cache import CachedCourseMenu
 from .models import LinkService, LTIService, MenuItem
@@ -147,3 +149,20 @@ class ExternalServicesTest(TestCase):
         self.assertEqual(len(menu.student_link_groups()[0]['items']), 4)
         self.assertEqual(len(menu.staff_link_groups()), 1)
         self.assertEqual(len(menu.staff_link_groups()[0]['items']), 1)
+
+    def test_as_leaf_classes(self):
+        services = list(LinkService._base_manager.order_by('-id'))
+        ContentType.objects.get_for_models(LinkService, LTIService)
+        # The plain link services are returned as they are
+        with self.assertNumQueries(1):
+            leaves = as_leaf_classes(services)
+        self.assertEqual([s.id for s in leaves], [s.id for s in services])
+        self.assertEqual(
+            [type(s) for s in leaves],
+            [LTIService, LinkService, LinkService],
+        )
+        self.assertEqual(leaves[0].consumer_key, "123456789")
+        self.assertIs(leaves[1], services[1])
+        with self.assertNumQueries(1):
+            leaves = LinkService.objects.order_by('-id').as_leaf_classes()
+        self.assertEqual([type(s) for s in leaves], [LTIService, LinkService, LinkService])
@@ -1,10 +1,43 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple, Type, TypeVar
+
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
 
-from model_utils.managers import InheritanceManager
+from model_utils.managers import InheritanceManager, InheritanceQuerySet
+
+
+T = TypeVar('T', bound='ModelWithInheritance')
+
+
+def as_leaf_classes(objects: Iterable[T]) -> List[T]:
+    """
+    Returns the objects as instances of their leaf classes in the same order.
+    Unlike calling as_leaf_class() for each object, the objects are grouped by
+    their content type and each subclass is fetched in a single query. Objects
+    that already are instances of their leaf class are returned as they are.
+    """
+    objects = list(objects)
+    ids_by_class: Dict[Type[models.Model], Set[int]] = defaultdict(set)
+    for obj in objects:
+        model_class = obj.leaf_model_class()
+        if model_class is not obj.__class__:
+            ids_by_class[model_class].add(obj.pk)
+    leaves: Dict[Tuple[Type[models.Model], int], models.Model] = {}
+    for model_class, ids in ids_by_class.items():
+        for leaf in model_class.objects.filter(pk__in=ids):
+            leaves[(model_class, leaf.pk)] = leaf
+    return [leaves.get((obj.leaf_model_class(), obj.pk), obj) for obj in objects]
+
+
+class ModelWithInheritanceQuerySet(InheritanceQuerySet):
+    def as_leaf_classes(self) -> List['ModelWithInheritance']:
+        return as_leaf_classes(self)
 
 
 class ModelWithInheritanceManager(InheritanceManager):
+    _queryset_class = ModelWithInheritanceQuerySet
+
     def get_queryset(self):
         return super().get_queryset().select_related('content_type').select_subclasses()
 
@@ -41,15 +74,23 @@ class ModelWithInheritance(models.Model):
 
         return super().save(*args, update_fields=update_fields, **kwargs)
 
+    def leaf_model_class(self):
+        """
+        Returns the class the object was saved as. The content types are cached,
+        so this does not query the database.
+        """
+        if self.content_type_id is None:
+            return self.__class__
+        return ContentType.objects.get_for_id(self.content_type_id).model_class()
+
     def as_leaf_class(self):
         """
         Checks if the object is an instance of a certain class or one of its subclasses.
         If the instance belongs to a subclass, it will be returned as an instance of
-        that class.
+        that class. Use as_leaf_classes() for many objects.
         """
 
-        content_type = self.content_type
-        model_class = content_type.model_class()
+        model_class = self.leaf_model_class()
         if (model_class == self.__class__):
             return self
         return model_class.objects.get(id=self.id)
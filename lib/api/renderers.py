@@ -1,5 +1,9 @@
+from typing import Any, Dict, Iterable, Iterator
+
 from django.conf import settings
+from rest_framework_csv.misc import Echo
 from rest_framework_csv.renderers import CSVRenderer
+import unicodecsv as csv
 
 def remove_newlines(x):
     return x.replace('\n', ' ').replace('\r', '') if isinstance(x, str) else x
@@ -7,14 +11,14 @@ def remove_newlines(x):
 class CSVExcelRenderer(CSVRenderer):
     format = 'excel.csv'
     writer_opts = { 'delimiter': settings.EXCEL_CSV_DEFAULT_DELIMITER }
+    bom = '\uFEFF'.encode('UTF-8')
 
     def flatten_item(self, item):
         "Remove newlines from the item in addition to flattening"
         flat_item = super().flatten_item(item)
         return {k: remove_newlines(v) for k, v in flat_item.items()}
 
-    # pylint: disable-next=dangerous-default-value
-    def render(self, data, media_type=None, renderer_context={}, writer_opts=None):
+    def update_writer_opts(self, renderer_context):
         "Extract sep from GET parameters if specified"
         if 'request' in renderer_context and 'writer_opts' not in renderer_context:
             get = renderer_context['request'].GET
@@ -23,5 +27,35 @@ class CSVExcelRenderer(CSVRenderer):
                     'writer_opts': { 'delimiter': get['sep'] }
                 }
                 renderer_context.update(new_writer_opts)
+
+    # pylint: disable-next=dangerous-default-value
+    def render(self, data, media_type=None, renderer_context={}, writer_opts=None):
+        self.update_writer_opts(renderer_context)
         response = super().render(data, media_type, renderer_context, writer_opts)
-        return '\uFEFF'.encode('UTF-8') + response
+        return self.bom + response
+
+
+def render_csv_stream(
+        renderer: CSVRenderer,
+        data: Iterable[Dict[str, Any]],
+        renderer_context: Dict[str, Any],
+        ) -> Iterator[bytes]:
+    """
+    Renders the rows of data one at a time for a StreamingHttpResponse.
+    The output is the same as that of renderer.render(list(data)), but data
+    can be a generator. The header must be given in the renderer context,
+    as it cannot be collected from the rows in advance.
+    """
+    if isinstance(renderer, CSVExcelRenderer):
+        renderer.update_writer_opts(renderer_context)
+        yield renderer.bom
+    writer_opts = renderer_context.get('writer_opts', renderer.writer_opts or {})
+    encoding = renderer_context.get('encoding', settings.DEFAULT_CHARSET)
+    writer = csv.writer(Echo(), encoding=encoding, **writer_opts)
+    table = renderer.tablize(
+        data,
+        header=renderer_context['header'],
+        labels=renderer_context.get('labels', renderer.labels),
+    )
+    for row in table:
+        yield writer.writerow(row)
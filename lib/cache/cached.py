@@ -29,11 +29,15 @@ from typing import (
 import logging
 import sys
 
+from django.db import connections
 from django.db.models import Model
 from django.db.models.signals import ModelSignal
 
-from .transact import CacheTransactionManager
+from . import lease
+from .transact import CacheTransactionManager, InvalidationBatch
 
+if TYPE_CHECKING:
+    from .codecs import CacheCodec
 
 logger = logging.getLogger('aplus.cached2')
 
@@ -60,23 +64,35 @@ class ProxyManager:
     new_keys contains cache keys that were added to the manager since the
     last cache get.
     nstates contains new items to be saved to the cache on .save().
+    codec is used to serialize the newly generated items. Defaults to the
+    CACHE_CODEC setting.
+    leases contains the regeneration leases (see lease.py) held by this
+    manager by the leased key. They are released on .save(), when resolving
+    fails or with .release_leases().
     """
     gen_start: float
+    codec: CacheCodec
     proxies: Dict[ProxyID, CacheBase]
     fetched_data: Dict[str, Optional[CacheData]]
     new_keys: Set[str]
     nstates: Dict[str, CacheData]
     new_proxies: List[CacheBase]
     db_managers: Dict[Type[DBDataManager], DBDataManager]
+    leases: Dict[str, str]
 
-    def __init__(self, proxies: Iterable[CacheBase] = ()):
+    def __init__(self, proxies: Iterable[CacheBase] = (), codec: Optional[CacheCodec] = None):
+        if codec is None:
+            from .codecs import get_default_codec # pylint: disable=import-outside-toplevel
+            codec = get_default_codec()
         self.gen_start = time()
+        self.codec = codec
         self.fetched_data = {}
         self.proxies = {}
         self.nstates = {}
         self.new_keys = set()
         self.new_proxies = []
         self.db_managers = {}
+        self.leases = {}
         self.update(proxies)
 
     def fetch(self) -> None: # noqa: MC0001
@@ -122,6 +138,25 @@ class ProxyManager:
 
             # Get data from cache and check dependencies
             fetch(self.new_keys, set())
+
+            # Make sure only one process regenerates each missing entry. Cache
+            # writes are delayed until the end of the transaction, so waiting
+            # for another process would be pointless inside one.
+            missing = [key for key in self.new_keys if self.fetched_data.get(key) is None]
+            if missing and lease.is_enabled() and not connections["default"].in_atomic_block:
+                def still_missing(keys: List[str]) -> List[str]:
+                    fetch(set(keys), set())
+                    return [key for key in keys if self.fetched_data.get(key) is None]
+
+                # One lease covers the whole batch of missing keys
+                lease_key = lease.batch_key(missing)
+                if lease_key not in self.leases:
+                    token = lease.acquire(lease_key)
+                    if token is None:
+                        lease.wait(missing, still_missing, lease_key)
+                    else:
+                        self.leases[lease_key] = token
+
             self.new_keys.clear()
 
         if self.new_proxies:
@@ -157,21 +192,27 @@ class ProxyManager:
         """Resolve given proxies. Depth is how many layers (child proxies) down should be resolved. Negative depth
         means to resolve the whole proxy tree.
 
-        NOTE: Doesn't resolve the children of already resolved proxies no matter the depth value."""
-        while proxies:
-            self.fetch()
+        NOTE: Doesn't resolve the children of already resolved proxies no matter the depth value.
+        The leases taken are held until .save(), so that the waiting processes find the saved data,
+        unless resolving fails."""
+        try:
+            while proxies:
+                self.fetch()
 
-            fetched = self.fetched_data
-            nstates = self.nstates
-            db_managers = self.db_managers
-            for proxy in filter(lambda x: not x._resolved, proxies):
-                proxy._build(fetched, nstates, self, db_managers)
+                fetched = self.fetched_data
+                nstates = self.nstates
+                db_managers = self.db_managers
+                for proxy in filter(lambda x: not x._resolved, proxies):
+                    proxy._build(fetched, nstates, self, db_managers)
 
-            depth -= 1
-            if depth == 0:
-                break
+                depth -= 1
+                if depth == 0:
+                    break
 
-            proxies = [child for proxy in proxies for child in proxy.get_child_proxies() if not child._resolved]
+                proxies = [child for proxy in proxies for child in proxy.get_child_proxies() if not child._resolved]
+        except BaseException:
+            self.release_leases()
+            raise
 
     def save(self) -> None:
         stored_states = CacheTransactionManager().get_many(self.nstates.keys())
@@ -179,14 +220,28 @@ class ProxyManager:
         for k, nstate in self.nstates.items():
             # stored_state is None or a (float (time), Optional[bytes])-tuple like values in self.nstates
             stored_state = stored_states.get(k)
+            if nstate[3] is None and stored_state is not None and stored_state[2] is not None:
+                # A valid namespace (see CacheNamespace) must not be moved forward:
+                # that would invalidate the entries generated before it
+                continue
             if (
                 stored_state is None
                 or stored_state[0] <= nstate[0]
             ):
                 save_states[k] = nstate
 
-        CacheTransactionManager().set_many(save_states)
-        self.nstates = {}
+        try:
+            CacheTransactionManager().set_many(save_states)
+            self.nstates = {}
+        finally:
+            self.release_leases()
+
+    def release_leases(self, keep: Collection[str] = ()) -> None:
+        """Releases the leases held by this manager, except those of the keys in keep"""
+        for key, token in self.leases.items():
+            if key not in keep:
+                lease.release(key, token)
+        self.leases = {key: token for key, token in self.leases.items() if key in keep}
 
     def get_or_create_proxy(self, cls: Type[CacheBaseT], *params: Any, modifiers: Tuple[Any,...] = ()) -> CacheBaseT:
         """
@@ -211,8 +266,11 @@ def resolve_proxies(proxies: Sequence[CacheBase]) -> None:
             manager = proxies[0]._manager
         except AttributeError:
             manager = ProxyManager(proxies)
-        manager.resolve(proxies)
-        manager.save()
+        try:
+            manager.resolve(proxies)
+            manager.save()
+        finally:
+            manager.release_leases()
 
 
 class Pickler(pickle.Pickler):
@@ -375,6 +433,8 @@ class CacheMeta(type):
     - PROTO_BASES: Base classes that are to be handled as protocols: their fields are not included in the
     cache.
     - DBCLS: DBDataManager subclass to be used for fetching data from the database.
+    - CODEC: CacheCodec instance used to serialize this class' cache entries instead
+    of the codec of the ProxyManager. Inherited by subclasses. See codecs.py.
     """
     # Use PARENTS: Tuple[CacheMeta, ...] to manually determine the parent classes
     KEY_PREFIX: str
@@ -387,6 +447,7 @@ class CacheMeta(type):
         ]
     ]
     DBCLS: Optional[Type[DBDataManager]] = None
+    CODEC: Optional[CacheCodec] = None
     _cached_fields: Tuple[str, ...]
     _varying_fields: Tuple[str, ...]
     _all_cached_fields: Set[str]
@@ -467,7 +528,7 @@ class CacheMeta(type):
         # The time is needed in case the cache is being generated at the same time:
         # otherwise the cache could be generated using old data and then saved, even though
         # that data was invalidated
-        CacheTransactionManager().set(cache_key, (time(), None, None, None))
+        InvalidationBatch().invalidate_many([cache_key])
 
     def invalidate_many(cls, models_iterable: Collection[Tuple[Any,...]]) -> None:
         if len(models_iterable) == 0:
@@ -475,11 +536,43 @@ class CacheMeta(type):
         params_iterable = (cls.parameter_ids(*models) for models in models_iterable)
         cache_keys = [cls._get_keys_with_cls(*params)[-1][1] for params in params_iterable]
         logger.debug("Invalidating cached data for %s%s", cls.__name__, cache_keys)
-        t = (time(), None, None, None)
-        CacheTransactionManager().set_many({ key: t for key in cache_keys })
+        InvalidationBatch().invalidate_many(cache_keys)
+
+
+class CacheNamespace:
+    """
+    A group of cache entries that can be invalidated with one cache write.
 
+    An entry joins the namespace by returning it among the dependencies from
+    _generate_data, e.g. {InstanceNamespace: [(instance_id,)]}. The namespace
+    is stored like the other dependencies, and invalidate() marks it invalid,
+    which makes every entry generated before that invalid when it is fetched.
+    The entries are regenerated lazily and the old ones are left for the cache
+    to evict. A missing namespace is created by the next generated entry, so
+    the entries that were generated before it are not trusted.
 
-Dependencies = Dict[Type["CacheBase"], Iterable[Tuple[Any,...]]]
+    Class variables:
+    - KEY_PREFIX: prefix used for the cache key of the namespace
+    """
+    KEY_PREFIX: ClassVar[str]
+
+    @classmethod
+    def _get_key_postfix(cls, params: Tuple[Any, ...]) -> str:
+        return ','.join(str(p) for p in params)
+
+    @classmethod
+    def key(cls, *models: Any) -> str:
+        params = tuple(getattr(model, "id", model) for model in models)
+        return f"{cls.KEY_PREFIX}:{cls._get_key_postfix(params)}"
+
+    @classmethod
+    def invalidate(cls, *models: Any) -> None:
+        cache_key = cls.key(*models)
+        logger.debug("Invalidating cached data in namespace %s", cache_key)
+        InvalidationBatch().invalidate_many([cache_key])
+
+
+Dependencies = Dict[Union[Type["CacheBase"], Type[CacheNamespace]], Iterable[Tuple[Any,...]]]
 T = TypeVar("T", bound="CacheBase")
 class CacheBase(metaclass=CacheMeta):
     _keys_with_cls: NoCache[List[Tuple[Type[CacheBase], str]]]
@@ -516,7 +609,14 @@ class CacheBase(metaclass=CacheMeta):
 
     def populate_children(self):
         children = self.get_child_proxies()
-        self._manager.resolve(children)
+        # The leases of the entries that are still being built, e.g. this one,
+        # are held until they are saved
+        held = set(self._manager.leases)
+        try:
+            self._manager.resolve(children)
+        finally:
+            # The generated children are not saved, so nobody should wait for them
+            self._manager.release_leases(keep=held)
 
     def get_child_proxies(self) -> Iterable[CacheBase]:
         return []
@@ -607,6 +707,8 @@ class CacheBase(metaclass=CacheMeta):
             precreated: ProxyManager,
             db_managers: Dict[Type[DBDataManager], DBDataManager],
             ):
+        # pylint: disable-next=import-outside-toplevel
+        from .codecs import CodecError, loads as codec_loads
         ocls = self.__class__
         base_cls = None
 
@@ -625,23 +727,30 @@ class CacheBase(metaclass=CacheMeta):
 
             if attrs is not None:
                 try:
-                    unpickler = Unpickler(precreated, attrs[3])
-                    self._setstate(unpickler.load())
-                except TypeError as e:
-                    logger.warning("_setstate TypeError with %s[%s]: %s", base_cls, cache_key, e)
+                    self._setstate(codec_loads(attrs[3], precreated))
+                except (TypeError, CodecError) as e:
+                    logger.warning("_setstate %s with %s[%s]: %s", e.__class__.__name__, base_cls, cache_key, e)
                     attrs = None # Generate new cache data
                 else:
                     self.post_get(precreated)
 
             if attrs is None or not self.is_valid():
                 dependencies = self._get_data(precreated, db_managers.get(base_cls.__dict__.get("DBCLS")))
+                for dcls, paramss in dependencies.items():
+                    if issubclass(dcls, CacheNamespace):
+                        for params in paramss:
+                            namespace_key = f"{dcls.KEY_PREFIX}:{dcls._get_key_postfix(params)}"
+                            if cache_data.get(namespace_key) is None and namespace_key not in new_cache_data:
+                                # Created unless it exists, see ProxyManager.save
+                                new_cache_data[namespace_key] = (precreated.gen_start, None, {}, None)
                 dependencies = {
                     dcls.KEY_PREFIX: [dcls._get_key_postfix(params) for params in paramss]
                     for dcls,paramss in dependencies.items()
                 }
-                pickler = Pickler()
-                pickler.dump(self._getstate())
-                new_cache_data[cache_key] = (self._generated_on, self._expires_on, dependencies, pickler.getvalue())
+                codec = base_cls.CODEC or precreated.codec
+                new_cache_data[cache_key] = (
+                    self._generated_on, self._expires_on, dependencies, codec.dumps(self._getstate())
+                )
 
         # Do not reset the class back if _get_data/unpickler changed the type
         if self.__class__ is base_cls:
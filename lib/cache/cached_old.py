@@ -6,12 +6,19 @@ import logging
 from django.core.cache import cache
 from django.db.models import Model
 
+from . import lease
+from .transact import InvalidationBatch, NamespaceVersions
+
 logger = logging.getLogger('aplus.cached')
 
 
 DataType = TypeVar("DataType")
 class CachedAbstract(Generic[DataType]):
     KEY_PREFIX = 'abstract'
+    # The number of leading models that select the namespace of the cached
+    # data. The version of the namespace is a part of the cache key, so
+    # invalidate_namespace invalidates all the data in it with one cache write.
+    NAMESPACE_PARAMS = 0
     data: DataType
 
     @classmethod
@@ -19,12 +26,60 @@ class CachedAbstract(Generic[DataType]):
         keys = [str(m.id if isinstance(m, Model) else m)
                 for m in models]
         keys.extend(modifiers)
-        return "%s:%s" % (cls.KEY_PREFIX, ','.join(keys))
+        key = "%s:%s" % (cls.KEY_PREFIX, ','.join(keys))
+        namespace_key = cls._namespace_key(*cls._namespace_models(*models))
+        if namespace_key is not None:
+            key = "%s@%s" % (key, cls._namespace_version(namespace_key))
+        return key
+
+    @classmethod
+    def _namespace_models(cls, *models):
+        return models[:cls.NAMESPACE_PARAMS]
+
+    @classmethod
+    def _namespace_key(cls, *namespace_models):
+        if not namespace_models:
+            return None
+        keys = [str(m.id if isinstance(m, Model) else m)
+                for m in namespace_models]
+        return "ns.%s:%s" % (cls.KEY_PREFIX, ','.join(keys))
+
+    @staticmethod
+    def _namespace_version(namespace_key):
+        versions = NamespaceVersions().versions
+        version = versions.get(namespace_key)
+        if version is not None:
+            return version
+        version = cache.get(namespace_key)
+        if version is None:
+            # A new version never matches the keys of an evicted one
+            version = time()
+            if not cache.add(namespace_key, version, None):
+                version = cache.get(namespace_key, version)
+        versions[namespace_key] = version
+        return version
+
+    @classmethod
+    def invalidate_namespace(cls, *namespace_models):
+        """
+        Invalidates the cached data of every key in the namespace by changing
+        its version. The data under the old version is left for the cache to
+        evict.
+        """
+        namespace_key = cls._namespace_key(*namespace_models)
+        logger.debug("Invalidating cached data in namespace %s", namespace_key)
+        if InvalidationBatch().bump_namespaces([namespace_key]):
+            return
+        version = time()
+        cache.set(namespace_key, version, None)
+        NamespaceVersions().versions[namespace_key] = version
 
     @classmethod
     def invalidate(cls, *models, modifiers=[]): # pylint: disable=dangerous-default-value
         cache_key = cls._key(*models, modifiers=modifiers)
         logger.debug("Invalidating cached data for %s", cache_key)
+        if InvalidationBatch().invalidate_old_many([cache_key]):
+            return
         # The cache is invalid, if the time field is None
         # The invalidation time is stored in the data field for debug messages
         # Keep this value in the cache for an hour, so it will be removed from
@@ -32,6 +87,18 @@ class CachedAbstract(Generic[DataType]):
         cache.set(cache_key, (None, time()), 60*60)
         # TODO: flush old version cache automatically
 
+    @classmethod
+    def invalidate_many(cls, models_iterable, modifiers=[]): # pylint: disable=dangerous-default-value
+        """Invalidates the cached data of each tuple of models with one cache call"""
+        cache_keys = [cls._key(*models, modifiers=modifiers) for models in models_iterable]
+        if not cache_keys:
+            return
+        logger.debug("Invalidating cached data for %s", cache_keys)
+        if InvalidationBatch().invalidate_old_many(cache_keys):
+            return
+        now = time()
+        cache.set_many({key: (None, now) for key in cache_keys}, 60*60)
+
     def __init__(self, *models, modifiers=[]): # pylint: disable=dangerous-default-value
         self.__models = models
         self.__cache_key = self.__class__._key(*models, modifiers=modifiers)
@@ -41,6 +108,14 @@ class CachedAbstract(Generic[DataType]):
         cache_key = self.__cache_key
         cache_name = "%s[%s]" % (self.__class__.__name__, cache_key)
 
+        batch = InvalidationBatch()
+        if cache_key in batch.old_keys or (
+            batch.namespaces
+            and self._namespace_key(*self._namespace_models(*self.__models)) in batch.namespaces
+        ):
+            # Invalidated in an unfinished batch, the cache is left alone
+            return self._generate_data(*self.__models)
+
         # Retrieve currently cached data
         raw = cache.get(cache_key)
         updated, data = raw if isinstance(raw, tuple) and len(raw) == 2 else (None, None)
@@ -58,6 +133,31 @@ class CachedAbstract(Generic[DataType]):
         if raw is not None:
             cache.delete(cache_key)
 
+        # If another process is already generating the data, wait for it
+        token = None
+        if lease.is_enabled():
+            token = lease.acquire(cache_key)
+            if token is None:
+                found = []
+                def missing(keys):
+                    raw = cache.get(cache_key)
+                    if isinstance(raw, tuple) and len(raw) == 2 and raw[0] is not None:
+                        if not self._needs_generation(raw[1]):
+                            found.append(raw[1])
+                            return []
+                    return keys
+                lease.wait([cache_key], missing)
+                if found:
+                    logger.debug("Using data generated by another process for %s", cache_name)
+                    return found[0]
+
+        try:
+            return self.__generate(cache_key, cache_name, data)
+        finally:
+            if token is not None:
+                lease.release(cache_key, token)
+
+    def __generate(self, cache_key: str, cache_name: str, data: Optional[DataType]) -> DataType:
         # Generate a new data
         self.dirty = False
         gen_start = time()
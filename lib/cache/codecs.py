@@ -0,0 +1,485 @@
+"""
+Serialization codecs for the cache objects in cached.py.
+
+A codec turns the cached state of a CacheBase object (the tuple returned by
+CacheBase._getstate) into bytes and back. References to other cache objects
+are stored as (class, params, modifiers) and resolved through the
+ProxyManager when loading, the same way the original pickle based format
+does.
+
+Every payload identifies its own format by the first byte, so entries written
+by one codec can be read back even after the configured codec has been
+changed. Pickle payloads start with the pickle PROTO opcode (0x80), which
+keeps the entries written before codecs were introduced readable.
+"""
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+import importlib
+import logging
+import pickle
+import struct
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from django.conf import settings
+
+from .cached import CacheBase, Pickler, Unpickler
+
+if TYPE_CHECKING:
+    from .cached import ProxyManager
+
+
+logger = logging.getLogger('aplus.cached2')
+
+try:
+    from lz4.block import compress as _compress, decompress as _decompress
+    COMPRESSION_MARKER = 0x02
+    def compress(data: bytes) -> bytes:
+        return _compress(data, compression=1)
+    def decompress(data: bytes) -> bytes:
+        return _decompress(data)
+except ImportError:
+    from zlib import compress as _compress, decompress as _decompress
+    COMPRESSION_MARKER = 0x03
+    def compress(data: bytes) -> bytes:
+        return _compress(data, level=1)
+    def decompress(data: bytes) -> bytes:
+        return _decompress(data)
+
+LZ4_MARKER = 0x02
+ZLIB_MARKER = 0x03
+
+
+class CodecError(ValueError):
+    """The payload could not be decoded"""
+
+
+# Raised by unpickling a truncated or otherwise corrupted pickle, or one that
+# refers to a class that no longer exists
+_UNPICKLING_ERRORS = (pickle.UnpicklingError, EOFError, AttributeError, ImportError)
+
+
+class CacheCodec(ABC):
+    """Base class for cache entry codecs.
+
+    MARKER is the first byte of every payload produced by the codec, and it
+    must be unique among the registered codecs.
+    """
+    MARKER: ClassVar[int]
+
+    @abstractmethod
+    def dumps(self, state: Any) -> bytes:
+        """Serialize state. The returned bytes must start with MARKER."""
+
+    @abstractmethod
+    def loads(self, data: bytes, precreated: ProxyManager) -> Any:
+        """Deserialize data produced by dumps. Cache object references are
+        resolved using precreated."""
+
+
+class PickleCodec(CacheCodec):
+    """The original format: a pickle with persistent ids for cache objects"""
+    MARKER = pickle.PROTO[0]
+
+    def dumps(self, state: Any) -> bytes:
+        pickler = Pickler()
+        pickler.dump(state)
+        return pickler.getvalue()
+
+    def loads(self, data: bytes, precreated: ProxyManager) -> Any:
+        try:
+            return Unpickler(precreated, data).load()
+        except _UNPICKLING_ERRORS as e:
+            raise CodecError(f"Corrupted pickled cache payload: {e}") from e
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_AWARE_DT = struct.Struct("<qi")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NAIVE_EPOCH = datetime(1970, 1, 1)
+# Strings longer than this are not added to the string table
+_MAX_INTERNED_LENGTH = 64
+
+# Type tags of the compact format
+_NONE = 0x00
+_TRUE = 0x01
+_FALSE = 0x02
+_INT_TAG = 0x03
+_FLOAT_TAG = 0x05
+_STR = 0x06
+_STR_REF = 0x07
+_BYTES = 0x08
+_LIST = 0x09
+_TUPLE = 0x0A
+_DICT = 0x0B
+_SET = 0x0C
+_AWARE_DATETIME = 0x0D
+_NAIVE_DATETIME = 0x0E
+_PROXY = 0x0F
+_CLASS = 0x10
+_OBJECT = 0x11
+_MEMO_REF = 0x12
+_PICKLED = 0x13
+
+
+_class_cache: Dict[str, type] = {}
+def _resolve_class(path: str) -> type:
+    cls = _class_cache.get(path)
+    if cls is None:
+        module_name, _, qualname = path.partition(":")
+        obj: Any = importlib.import_module(module_name)
+        for name in qualname.split("."):
+            obj = getattr(obj, name)
+        cls = _class_cache[path] = obj
+    return cls
+
+
+def _is_plain_object(obj: Any) -> bool:
+    """Whether obj can be stored as its class and __dict__, i.e. the same way
+    the default pickle protocol would store it."""
+    cls = type(obj)
+    return (
+        hasattr(obj, "__dict__")
+        and "__slots__" not in cls.__dict__
+        and cls.__reduce_ex__ is object.__reduce_ex__
+        and cls.__reduce__ is object.__reduce__
+        and getattr(cls, "__getstate__", object.__getstate__) is object.__getstate__
+        and not hasattr(cls, "__setstate__")
+    )
+
+
+class _Encoder:
+    def __init__(self):
+        self.out = bytearray()
+        self.strings: Dict[str, int] = {}
+        self.memo: Dict[int, int] = {}
+
+    def string(self, value: str) -> None:
+        out = self.out
+        index = self.strings.get(value)
+        if index is not None:
+            out.append(_STR_REF)
+            _write_varint(out, index)
+            return
+        data = value.encode("utf-8")
+        if len(data) <= _MAX_INTERNED_LENGTH:
+            self.strings[value] = len(self.strings)
+        out.append(_STR)
+        _write_varint(out, len(data))
+        out += data
+
+    def class_ref(self, cls: type) -> None:
+        self.out.append(_CLASS)
+        self.string(f"{cls.__module__}:{cls.__qualname__}")
+
+    def memoize(self, obj: Any) -> bool:
+        """Writes a memo reference if obj has already been written. Otherwise,
+        adds obj to the memo."""
+        index = self.memo.get(id(obj))
+        if index is not None:
+            self.out.append(_MEMO_REF)
+            _write_varint(self.out, index)
+            return True
+        self.memo[id(obj)] = len(self.memo)
+        return False
+
+    def value(self, obj: Any) -> None: # noqa: MC0001
+        out = self.out
+        cls = type(obj)
+        if obj is None:
+            out.append(_NONE)
+        elif obj is True:
+            out.append(_TRUE)
+        elif obj is False:
+            out.append(_FALSE)
+        elif cls is int:
+            # zigzag encoding keeps small negative numbers short as well
+            out.append(_INT_TAG)
+            _write_varint(out, obj << 1 if obj >= 0 else ((-obj) << 1) - 1)
+        elif cls is float:
+            out.append(_FLOAT_TAG)
+            out += _FLOAT.pack(obj)
+        elif cls is str:
+            self.string(obj)
+        elif cls is bytes:
+            out.append(_BYTES)
+            _write_varint(out, len(obj))
+            out += obj
+        elif cls is tuple:
+            out.append(_TUPLE)
+            _write_varint(out, len(obj))
+            for item in obj:
+                self.value(item)
+        elif cls is list:
+            if self.memoize(obj):
+                return
+            out.append(_LIST)
+            _write_varint(out, len(obj))
+            for item in obj:
+                self.value(item)
+        elif cls is dict:
+            if self.memoize(obj):
+                return
+            out.append(_DICT)
+            _write_varint(out, len(obj))
+            for k, v in obj.items():
+                self.value(k)
+                self.value(v)
+        elif cls is set:
+            out.append(_SET)
+            _write_varint(out, len(obj))
+            for item in obj:
+                self.value(item)
+        elif cls is datetime and (obj.tzinfo is None or type(obj.tzinfo) is timezone):
+            offset = obj.utcoffset()
+            if offset is None:
+                out.append(_NAIVE_DATETIME)
+                out += _INT.pack((obj - _NAIVE_EPOCH) // timedelta(microseconds=1))
+            else:
+                out.append(_AWARE_DATETIME)
+                out += _AWARE_DT.pack(
+                    (obj - _EPOCH) // timedelta(microseconds=1),
+                    offset // timedelta(seconds=1),
+                )
+        elif isinstance(obj, CacheBase):
+            out.append(_PROXY)
+            self.class_ref(cls)
+            self.value(obj._params)
+            self.value(obj._modifiers)
+        elif isinstance(obj, type):
+            self.class_ref(obj)
+        elif _is_plain_object(obj):
+            if self.memoize(obj):
+                return
+            out.append(_OBJECT)
+            self.class_ref(cls)
+            attrs = obj.__dict__
+            _write_varint(out, len(attrs))
+            for k, v in attrs.items():
+                self.string(k)
+                self.value(v)
+        else:
+            pickler = Pickler()
+            pickler.dump(obj)
+            data = pickler.getvalue()
+            out.append(_PICKLED)
+            _write_varint(out, len(data))
+            out += data
+
+
+class _Decoder:
+    def __init__(self, data: bytes, precreated: ProxyManager):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.strings: List[str] = []
+        self.memo: List[Any] = []
+        self.precreated = precreated
+        self.readers: Dict[int, Callable[[], Any]] = {
+            _NONE: lambda: None,
+            _TRUE: lambda: True,
+            _FALSE: lambda: False,
+            _INT_TAG: self.int,
+            _FLOAT_TAG: lambda: self.unpack(_FLOAT)[0],
+            _STR: self.new_string,
+            _STR_REF: lambda: self.strings[self.varint()],
+            _BYTES: self.raw,
+            _LIST: self.list,
+            _TUPLE: lambda: tuple(self.value() for _ in range(self.varint())),
+            _DICT: self.dict,
+            _SET: lambda: {self.value() for _ in range(self.varint())},
+            _AWARE_DATETIME: self.aware_datetime,
+            _NAIVE_DATETIME: lambda: _NAIVE_EPOCH + timedelta(microseconds=self.unpack(_INT)[0]),
+            _PROXY: self.proxy,
+            _CLASS: lambda: _resolve_class(self.value()),
+            _OBJECT: self.object,
+            _MEMO_REF: lambda: self.memo[self.varint()],
+            _PICKLED: lambda: Unpickler(self.precreated, self.raw()).load(),
+        }
+
+    def varint(self) -> int:
+        data = self.data
+        result = 0
+        shift = 0
+        while True:
+            byte = data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def int(self) -> int:
+        value = self.varint()
+        return -((value + 1) >> 1) if value & 1 else value >> 1
+
+    def unpack(self, fmt: struct.Struct) -> Tuple[Any, ...]:
+        values = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def raw(self) -> bytes:
+        length = self.varint()
+        start = self.pos
+        self.pos += length
+        return bytes(self.data[start:self.pos])
+
+    def new_string(self) -> str:
+        length = self.varint()
+        start = self.pos
+        self.pos += length
+        value = str(self.data[start:self.pos], "utf-8")
+        if length <= _MAX_INTERNED_LENGTH:
+            self.strings.append(value)
+        return value
+
+    def list(self) -> List[Any]:
+        value: List[Any] = []
+        self.memo.append(value)
+        for _ in range(self.varint()):
+            value.append(self.value())
+        return value
+
+    def dict(self) -> Dict[Any, Any]:
+        value: Dict[Any, Any] = {}
+        self.memo.append(value)
+        for _ in range(self.varint()):
+            k = self.value()
+            value[k] = self.value()
+        return value
+
+    def aware_datetime(self) -> datetime:
+        micros, offset = self.unpack(_AWARE_DT)
+        tz = timezone.utc if offset == 0 else timezone(timedelta(seconds=offset))
+        return (_EPOCH + timedelta(microseconds=micros)).astimezone(tz)
+
+    def proxy(self) -> CacheBase:
+        cls = self.value()
+        params = self.value()
+        modifiers = self.value()
+        return self.precreated.get_or_create_proxy(cls, *params, modifiers=modifiers)
+
+    def object(self) -> Any:
+        cls = self.value()
+        obj = cls.__new__(cls)
+        self.memo.append(obj)
+        attrs = obj.__dict__
+        for _ in range(self.varint()):
+            k = self.value()
+            attrs[k] = self.value()
+        return obj
+
+    def value(self) -> Any:
+        tag = self.data[self.pos]
+        self.pos += 1
+        reader = self.readers.get(tag)
+        if reader is None:
+            raise CodecError(f"Unknown type tag {tag:#x} at {self.pos - 1}")
+        return reader()
+
+
+class CompactCodec(CacheCodec):
+    """A compact tagged binary format.
+
+    The state tuple is written positionally in the order of _cached_fields.
+    Integers are written as varints, floats and datetimes are packed with struct, short strings (such as
+    attribute names and class paths) are written once per payload and then
+    referred to by index, and plain objects (e.g. the dataclasses used in
+    the points cache) are written as their class and attributes. Shared
+    objects are written once, like in pickle. Anything else falls back to
+    pickle, including datetimes in a named time zone (e.g. a ZoneInfo), so
+    that they keep their zone instead of becoming a fixed UTC offset.
+    """
+    MARKER = 0x01
+
+    def dumps(self, state: Any) -> bytes:
+        encoder = _Encoder()
+        encoder.out.append(self.MARKER)
+        encoder.value(state)
+        return bytes(encoder.out)
+
+    def loads(self, data: bytes, precreated: ProxyManager) -> Any:
+        decoder = _Decoder(data, precreated)
+        decoder.pos = 1
+        try:
+            return decoder.value()
+        except (IndexError, KeyError, struct.error, UnicodeDecodeError, *_UNPICKLING_ERRORS) as e:
+            raise CodecError(f"Corrupted compact cache payload: {e}") from e
+
+
+class CompressedCodec(CacheCodec):
+    """Wraps another codec and compresses payloads larger than min_size bytes
+    with lz4 (or zlib if lz4 isn't installed)."""
+    MARKER = COMPRESSION_MARKER
+
+    def __init__(self, codec: CacheCodec, min_size: int = 256):
+        self.codec = codec
+        self.min_size = min_size
+
+    def dumps(self, state: Any) -> bytes:
+        data = self.codec.dumps(state)
+        if len(data) < self.min_size:
+            return data
+        return bytes((self.MARKER,)) + compress(data)
+
+    def loads(self, data: bytes, precreated: ProxyManager) -> Any:
+        return loads(data, precreated)
+
+
+_codecs: Dict[int, CacheCodec] = {}
+def register_codec(codec: CacheCodec) -> None:
+    """Makes payloads starting with codec.MARKER decodable by loads()"""
+    _codecs[codec.MARKER] = codec
+
+
+register_codec(PickleCodec())
+register_codec(CompactCodec())
+
+
+def loads(data: bytes, precreated: ProxyManager) -> Any:
+    """Decode a payload produced by any of the registered codecs"""
+    if not data:
+        raise CodecError("Empty cache payload")
+    marker = data[0]
+    if marker in (LZ4_MARKER, ZLIB_MARKER):
+        if marker != COMPRESSION_MARKER:
+            raise CodecError(f"Cache payload compressed with an unavailable algorithm ({marker:#x})")
+        try:
+            return loads(decompress(data[1:]), precreated)
+        except CodecError:
+            raise
+        except Exception as e:
+            raise CodecError(f"Failed to decompress cache payload: {e}") from e
+    codec = _codecs.get(marker)
+    if codec is None:
+        raise CodecError(f"Unknown cache payload format ({marker:#x})")
+    return codec.loads(data, precreated)
+
+
+CODECS: Dict[str, Callable[[], CacheCodec]] = {
+    "pickle": PickleCodec,
+    "compact": CompactCodec,
+}
+
+
+_default_codec: Optional[CacheCodec] = None
+def get_default_codec() -> CacheCodec:
+    """Returns the codec configured with the CACHE_CODEC and CACHE_CODEC_COMPRESS settings"""
+    global _default_codec # pylint: disable=global-statement
+    if _default_codec is None:
+        name = getattr(settings, "CACHE_CODEC", "pickle")
+        if name not in CODECS:
+            logger.error("Unknown CACHE_CODEC %r, using pickle", name)
+            name = "pickle"
+        codec = CODECS[name]()
+        if getattr(settings, "CACHE_CODEC_COMPRESS", False):
+            codec = CompressedCodec(codec)
+        _default_codec = codec
+    return _default_codec
@@ -0,0 +1,89 @@
+"""
+Single-flight regeneration of cache entries.
+
+When a popular cache entry is invalidated, every concurrent request would see
+a miss and regenerate the same data. Instead, the first request to notice the
+miss takes a short-lived lease on the key (an atomic cache.add), and the other
+requests poll the cache for the fresh value while the lease is held. If the
+lease holder does not finish in CACHE_LEASE_WAIT seconds, or drops the lease
+without storing a value, the waiters generate the data themselves.
+
+A request that misses many keys at once takes a single lease on the whole batch
+(see batch_key), so the lease costs one cache.add however large the batch is.
+Requests that miss exactly the same batch wait for each other.
+"""
+from hashlib import sha1
+from time import sleep, time
+from typing import Callable, Iterable, List, Optional
+from uuid import uuid4
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('aplus.cache')
+
+LEASE_KEY_PREFIX = "lease:"
+POLL_INTERVAL = 0.05
+
+
+def lease_key(key: str) -> str:
+    return LEASE_KEY_PREFIX + key
+
+
+def batch_key(keys: Iterable[str]) -> str:
+    """Returns the key to lease for regenerating all of keys"""
+    keys = sorted(set(keys))
+    if len(keys) == 1:
+        return keys[0]
+    return "batch:" + sha1("\n".join(keys).encode()).hexdigest()
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "CACHE_LEASE_WAIT", 0) > 0
+
+
+def acquire(key: str) -> Optional[str]:
+    """Returns a token if the lease for key was acquired, otherwise None"""
+    token = uuid4().hex
+    timeout = getattr(settings, "CACHE_LEASE_TIMEOUT", 10)
+    if cache.add(lease_key(key), token, timeout):
+        return token
+    return None
+
+
+def release(key: str, token: str) -> None:
+    """Release the lease for key, unless it has expired and been taken by someone else"""
+    # NOTE: there is a small window between the get and the delete. The worst
+    # case is that a concurrent lease is dropped early, which only costs an
+    # extra regeneration.
+    if cache.get(lease_key(key)) == token:
+        cache.delete(lease_key(key))
+
+
+def is_held(key: str) -> bool:
+    return cache.get(lease_key(key)) is not None
+
+
+def wait(
+        keys: Iterable[str],
+        missing: Callable[[List[str]], List[str]],
+        key: Optional[str] = None,
+        ) -> None:
+    """Poll until the lease is released, keys are found or CACHE_LEASE_WAIT passes.
+
+    missing is called with the keys still waited for, and it should refresh
+    them from the cache and return the ones that are still missing. key is the
+    leased key, by default the batch_key of keys.
+    """
+    waiting = list(keys)
+    if key is None:
+        key = batch_key(waiting)
+    deadline = time() + getattr(settings, "CACHE_LEASE_WAIT", 0)
+    while waiting and time() < deadline:
+        sleep(POLL_INTERVAL)
+        waiting = missing(waiting)
+        if waiting and not is_held(key):
+            break
+    if waiting:
+        logger.debug("Timed out waiting for the regeneration of %s", waiting)
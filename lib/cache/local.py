@@ -0,0 +1,150 @@
+"""
+A per-process in-memory tier in front of the shared cache for the cache
+entries of cached.py.
+
+Each entry stored in the shared cache gets a small companion version key that
+holds only the generation time of the entry (CacheData[0]). When reading, the
+version keys are fetched from the shared cache, and the entries whose version
+matches the locally stored copy are served from memory. Only the remaining
+entries are fetched from the shared cache.
+
+Invalidations (see CacheMeta.invalidate) are regular writes of a new
+generation time, so they update the version key and make every process drop
+its local copy on the next read.
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+
+
+VERSION_KEY_SUFFIX = "#gen"
+# Rough per entry overhead of the dict, the tuple and the key
+ENTRY_OVERHEAD = 200
+
+
+def version_key(key: str) -> str:
+    return key + VERSION_KEY_SUFFIX
+
+
+def entry_size(key: str, item: Any) -> int:
+    size = ENTRY_OVERHEAD + len(key)
+    payload = item[3] if isinstance(item, tuple) and len(item) == 4 else None
+    if isinstance(payload, (bytes, bytearray)):
+        size += len(payload)
+    return size
+
+
+class LocalCacheTier:
+    """A size bounded LRU of cache entries validated against the version keys
+    in the shared cache.
+
+    Counters:
+    - hits: entries served from memory
+    - misses: entries fetched from the shared cache
+    - bytes_fetched: approximate size of the entries fetched from the shared cache
+    - bytes_saved: approximate size of the entries served from memory
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries: OrderedDict[str, Tuple[int, Any]] = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_fetched = 0
+        self.bytes_saved = 0
+
+    def get_many(self, keys: Iterable[str], backend: Any) -> Dict[str, Any]:
+        keys = list(keys)
+        versions = backend.get_many([version_key(k) for k in keys])
+
+        items = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                version = versions.get(version_key(key))
+                entry = self.entries.get(key)
+                if entry is not None and version is not None and entry[1][0] == version:
+                    self.entries.move_to_end(key)
+                    items[key] = entry[1]
+                    self.hits += 1
+                    self.bytes_saved += entry[0]
+                else:
+                    missing.append(key)
+
+        if not missing:
+            return items
+
+        fetched = backend.get_many(missing)
+        with self.lock:
+            self.misses += len(missing)
+            for key, item in fetched.items():
+                size = entry_size(key, item)
+                self.bytes_fetched += size
+                # Only keep entries that are known to be current. Without the
+                # version key, there would be no way to tell if it changes
+                if versions.get(version_key(key)) == item[0]:
+                    self._store(key, item, size)
+                else:
+                    self._discard(key)
+        items.update(fetched)
+        return items
+
+    def set_many(self, items: Dict[str, Any], backend: Any) -> Any:
+        """Writes the items and their version keys to the shared cache and
+        updates the local copies. Returns what backend.set_many returns."""
+        data = dict(items)
+        data.update((version_key(k), item[0]) for k, item in items.items())
+        failed = backend.set_many(data)
+        failed_keys = set(failed or ())
+        with self.lock:
+            for key, item in items.items():
+                if key in failed_keys or version_key(key) in failed_keys:
+                    self._discard(key)
+                else:
+                    self._store(key, item, entry_size(key, item))
+        return [k for k in failed_keys if not k.endswith(VERSION_KEY_SUFFIX)]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_fetched": self.bytes_fetched,
+            "bytes_saved": self.bytes_saved,
+        }
+
+    def _store(self, key: str, item: Any, size: int) -> None:
+        self._discard(key)
+        if size > self.max_size:
+            return
+        self.entries[key] = (size, item)
+        self.size += size
+        while self.size > self.max_size:
+            _, (old_size, _) = self.entries.popitem(last=False)
+            self.size -= old_size
+
+    def _discard(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[0]
+
+
+_tier: Optional[LocalCacheTier] = None
+_tier_configured = False
+def get_local_tier() -> Optional[LocalCacheTier]:
+    """Returns the tier of this process, or None if CACHE_LOCAL_TIER_MAX_SIZE is not set"""
+    global _tier, _tier_configured # pylint: disable=global-statement
+    if not _tier_configured:
+        max_size = getattr(settings, "CACHE_LOCAL_TIER_MAX_SIZE", 0)
+        _tier = LocalCacheTier(max_size) if max_size else None
+        _tier_configured = True
+    return _tier
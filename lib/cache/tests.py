@@ -1,12 +1,23 @@
-from typing import Optional
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional
+from django.core.cache import cache
 from django.db import transaction
-from django.test import SimpleTestCase, TransactionTestCase
-from threading import Thread, Event, Barrier
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from threading import Thread, Event, Barrier, Lock
+from time import sleep
 from unittest.mock import patch
-from lib.cache.cached import DBDataManager, ProxyManager
+from zoneinfo import ZoneInfo
+from lib.cache.cached import DBDataManager, ProxyManager, resolve_proxies
 
 from lib.cache.cached_old import CachedAbstract
-from .cached import CacheBase
+from lib.request_globals import RequestGlobal
+from .cached import CacheBase, CacheNamespace
+from .codecs import CodecError, CompactCodec, CompressedCodec, PickleCodec, loads
+from .lease import acquire, batch_key, lease_key
+from .local import LocalCacheTier, version_key
+from .transact import _set_many, invalidation_batch
 
 
 mock_cache = {}
@@ -27,7 +38,7 @@ def mock_get_many(keys):
         if k in mock_cache
     }
 
-def mock_set_many(items):
+def mock_set_many(items, timeout=None): # pylint: disable=unused-argument
     mock_cache.update(items)
 
 def mock_add(key, value, timeout=None): # pylint: disable=unused-argument
@@ -56,6 +67,195 @@ class MockCache(CacheBase):
         return
 
 
+class MockNamespace(CacheNamespace):
+    KEY_PREFIX = "ns.cachetest"
+
+
+class NamespacedCache(CacheBase):
+    KEY_PREFIX = "namespacetest"
+    NUM_PARAMS = 1
+    INVALIDATORS = []
+
+    def _generate_data(self, precreated: ProxyManager, prefetched_data: Optional[DBDataManager]):
+        return {MockNamespace: [(0,)]}
+
+
+@dataclass
+class CodecEntry:
+    id: int
+    name: str
+    date: datetime
+    points: Dict[str, int] = field(default_factory=dict)
+
+
+class CodecCache(CacheBase):
+    KEY_PREFIX = "codectest"
+    NUM_PARAMS = 1
+    INVALIDATORS = []
+    entries: List[CodecEntry]
+    best: Optional[CodecEntry]
+    parent: Optional["CodecCache"]
+
+    def _generate_data(self, precreated: ProxyManager, prefetched_data: Optional[DBDataManager]):
+        now = datetime.now(timezone.utc)
+        self.entries = [
+            CodecEntry(id=i, name=f"entry {i}", date=now, points={"A": i, "B": -i})
+            for i in range(5)
+        ]
+        self.best = self.entries[3]
+        if self._params[0] > 0:
+            self.parent = precreated.get_or_create_proxy(CodecCache, self._params[0] - 1)
+        else:
+            self.parent = None
+
+
+class CompactCodecCache(CodecCache):
+    KEY_PREFIX = "compactcodectest"
+    NUM_PARAMS = 1
+    INVALIDATORS = []
+    CODEC = CompactCodec()
+
+
+class InheritedCodecCache(CompactCodecCache):
+    KEY_PREFIX = "inheritedcodectest"
+    NUM_PARAMS = 1
+    INVALIDATORS = []
+
+
+@cache_patcher('transact')
+class CodecTest(SimpleTestCase):
+    def setUp(self):
+        mock_cache.clear()
+
+    def assert_roundtrip(self, codec):
+        manager = ProxyManager(codec=codec)
+        obj = manager.get_or_create_proxy(CodecCache, 1)
+        manager.resolve([obj])
+        manager.save()
+
+        manager2 = ProxyManager()
+        obj2 = manager2.get_or_create_proxy(CodecCache, 1)
+        manager2.resolve([obj2])
+        self.assertEqual(obj._generated_on, obj2._generated_on)
+        self.assertEqual(obj.entries, obj2.entries)
+        self.assertEqual(obj.best, obj2.best)
+        # Shared objects stay shared
+        self.assertIs(obj2.best, obj2.entries[3])
+        # Cache object references are resolved through the manager
+        self.assertIs(obj2.parent, manager2.get_or_create_proxy(CodecCache, 0))
+
+    def test_pickle(self):
+        self.assert_roundtrip(PickleCodec())
+
+    def test_compact(self):
+        self.assert_roundtrip(CompactCodec())
+
+    def test_compressed(self):
+        self.assert_roundtrip(CompressedCodec(CompactCodec(), min_size=0))
+        self.assert_roundtrip(CompressedCodec(PickleCodec(), min_size=0))
+
+    def test_class_codec(self):
+        manager = ProxyManager(codec=PickleCodec())
+        proxies = [manager.get_or_create_proxy(cls, 0) for cls in (CompactCodecCache, InheritedCodecCache)]
+        manager.resolve(proxies)
+        manager.save()
+        for proxy in proxies:
+            self.assertEqual(mock_cache[proxy._keys[-1]][3][0], CompactCodec.MARKER)
+
+    def test_compact_is_smaller(self):
+        state = CodecCache.get(1)._getstate()
+        self.assertLess(len(CompactCodec().dumps(state)), len(PickleCodec().dumps(state)))
+
+    def test_corrupted(self):
+        manager = ProxyManager()
+        with self.assertRaises(CodecError):
+            loads(b"\x7f", manager)
+        with self.assertRaises(CodecError):
+            loads(CompactCodec().dumps((1, "abc", [1, 2]))[:-2], manager)
+        # A truncated pickle, alone and inside a compact payload
+        with self.assertRaises(CodecError):
+            loads(PickleCodec().dumps((1, "abc", [1, 2]))[:-2], manager)
+        with self.assertRaises(CodecError):
+            loads(CompactCodec().dumps((1, Decimal("1.5")))[:-2], manager)
+
+    def test_datetime_zone(self):
+        helsinki = datetime(2024, 6, 1, 12, tzinfo=ZoneInfo("Europe/Helsinki"))
+        utc = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+        value = loads(CompactCodec().dumps((helsinki, utc)), ProxyManager())
+        self.assertEqual(value, (helsinki, utc))
+        self.assertEqual(value[0].tzinfo, ZoneInfo("Europe/Helsinki"))
+        self.assertIs(value[1].tzinfo, timezone.utc)
+
+
+class MockBackend:
+    get_many = staticmethod(mock_get_many)
+
+    @staticmethod
+    def set_many(items):
+        mock_set_many(items)
+        return []
+
+
+@cache_patcher('transact')
+class LocalTierTest(SimpleTestCase):
+    def setUp(self):
+        mock_cache.clear()
+
+    def test_hits_and_misses(self):
+        tier = LocalCacheTier(10000)
+        tier.set_many({"a": (1.0, None, {}, b"x" * 100)}, MockBackend)
+        self.assertEqual(mock_cache[version_key("a")], 1.0)
+
+        self.assertEqual(tier.get_many(["a", "b"], MockBackend), {"a": (1.0, None, {}, b"x" * 100)})
+        self.assertEqual(tier.hits, 1)
+        self.assertEqual(tier.misses, 1)
+
+    def test_other_process_writes(self):
+        tier1 = LocalCacheTier(10000)
+        tier2 = LocalCacheTier(10000)
+        tier1.set_many({"a": (1.0, None, {}, b"old")}, MockBackend)
+        self.assertEqual(tier2.get_many(["a"], MockBackend)["a"][3], b"old")
+        self.assertEqual(tier2.misses, 1)
+
+        # An invalidation from another process makes the local copy stale
+        tier1.set_many({"a": (2.0, None, None, None)}, MockBackend)
+        self.assertEqual(tier2.get_many(["a"], MockBackend)["a"], (2.0, None, None, None))
+        self.assertEqual(tier2.misses, 2)
+        self.assertEqual(tier2.get_many(["a"], MockBackend)["a"], (2.0, None, None, None))
+        self.assertEqual(tier2.hits, 1)
+
+    def test_missing_version(self):
+        tier = LocalCacheTier(10000)
+        tier.set_many({"a": (1.0, None, {}, b"data")}, MockBackend)
+        del mock_cache[version_key("a")]
+        tier.get_many(["a"], MockBackend)
+        tier.get_many(["a"], MockBackend)
+        self.assertEqual(tier.hits, 0)
+        self.assertEqual(tier.misses, 2)
+
+    def test_size_bound(self):
+        tier = LocalCacheTier(2000)
+        for i in range(10):
+            tier.set_many({str(i): (1.0, None, {}, b"x" * 500)}, MockBackend)
+        self.assertLessEqual(tier.size, 2000)
+        self.assertIn("9", tier.entries)
+        self.assertNotIn("0", tier.entries)
+
+    def test_cache_objects(self):
+        tier = LocalCacheTier(100000)
+        with patch('lib.cache.transact.get_local_tier', return_value=tier):
+            obj = CodecCache.get(1)
+            misses = tier.misses
+            obj2 = CodecCache.get(1)
+            self.assertEqual(tier.misses, misses)
+            self.assertGreater(tier.hits, 0)
+            self.assertEqual(obj.entries, obj2.entries)
+
+            CodecCache.invalidate(1)
+            obj3 = CodecCache.get(1)
+            self.assertGreater(obj3._generated_on, obj._generated_on)
+
+
 @cache_patcher('transact')
 class TransactionTest(TransactionTestCase):
     def test_rollback(self):
@@ -259,6 +459,68 @@ class TransactionTest(TransactionTestCase):
         self.assertEqual(len(original), 2)
         self.assertEqual(len(new), 2)
 
+    def test_invalidation_batch(self):
+        original = MockCache.get()
+        with patch('lib.cache.transact._set_many', wraps=_set_many) as set_many:
+            with invalidation_batch():
+                MockCache.invalidate()
+                with invalidation_batch():
+                    MockCache.invalidate()
+                set_many.assert_not_called()
+                # The batch does not use the data it has invalidated
+                new = MockCache.get()
+                self.assertNotEqual(original._generated_on, new._generated_on)
+            invalidations = [
+                key
+                for call in set_many.call_args_list
+                for key, item in call.args[0].items()
+                if item[2] is None
+            ]
+            self.assertEqual(len(invalidations), 1)
+
+        newer = MockCache.get()
+        self.assertNotEqual(new._generated_on, newer._generated_on)
+
+    def test_invalidation_batch_rollback(self):
+        original = MockCache.get()
+        try:
+            with transaction.atomic(), invalidation_batch():
+                MockCache.invalidate()
+                raise Rollback()
+        except Rollback:
+            pass
+
+        original2 = MockCache.get()
+        self.assertEqual(original._generated_on, original2._generated_on)
+
+    def test_namespace(self):
+        first = NamespacedCache.get(1)
+        second = NamespacedCache.get(2)
+        self.assertEqual(first._generated_on, NamespacedCache.get(1)._generated_on)
+        self.assertEqual(second._generated_on, NamespacedCache.get(2)._generated_on)
+
+        MockNamespace.invalidate(0)
+        first2 = NamespacedCache.get(1)
+        second2 = NamespacedCache.get(2)
+        self.assertNotEqual(first._generated_on, first2._generated_on)
+        self.assertNotEqual(second._generated_on, second2._generated_on)
+        self.assertEqual(first2._generated_on, NamespacedCache.get(1)._generated_on)
+        self.assertEqual(second2._generated_on, NamespacedCache.get(2)._generated_on)
+
+    def test_namespace_rollback(self):
+        original = NamespacedCache.get(1)
+        try:
+            with transaction.atomic():
+                MockNamespace.invalidate(0)
+                new = NamespacedCache.get(1)
+                self.assertNotEqual(original._generated_on, new._generated_on)
+                raise Rollback()
+        except Rollback:
+            pass
+
+        original2 = NamespacedCache.get(1)
+        self.assertEqual(original._generated_on, original2._generated_on)
+
 
 class TestCached(CachedAbstract):
 
@@ -272,6 +534,20 @@ class TestCached(CachedAbstract):
         return self._fake_func(data)
 
 
+class NamespacedCached(CachedAbstract):
+
+    __test__ = False
+    KEY_PREFIX = "namespacetest"
+    NAMESPACE_PARAMS = 1
+
+    def __init__(self, namespace, model, func):
+        self._fake_func = func
+        super().__init__(namespace, model)
+
+    def _generate_data(self, *models, data=None):
+        return self._fake_func(data)
+
+
 @cache_patcher('cached_old')
 class CachedTest(SimpleTestCase):
     def setUp(self):
@@ -330,6 +606,50 @@ class CachedTest(SimpleTestCase):
         cached3 = TestCached(lambda x: data3)
         self.assertEqual(cached3.data, data3)
 
+    def test_invalidation_batch(self):
+        """
+        Invalidations inside a batch are written to the cache when the batch ends.
+        """
+        TestCached(lambda x: "Old data")
+        with invalidation_batch():
+            TestCached.invalidate()
+            TestCached.invalidate()
+            self.assertEqual(mock_cache[TestCached._key(modifiers=[])][1], "Old data")
+            cached1 = TestCached(lambda x: "New data")
+            self.assertEqual(cached1.data, "New data")
+        self.assertIsNone(mock_cache[TestCached._key(modifiers=[])][0])
+        cached2 = TestCached(lambda x: "Newer data")
+        self.assertEqual(cached2.data, "Newer data")
+
+    def test_invalidate_namespace(self):
+        """
+        Invalidating a namespace invalidates the data of every key in it, and only those.
+        """
+        NamespacedCached(1, 1, lambda x: "First data")
+        NamespacedCached(1, 2, lambda x: "Second data")
+        NamespacedCached(2, 1, lambda x: "Other data")
+        NamespacedCached.invalidate_namespace(1)
+        self.assertEqual(NamespacedCached(1, 1, lambda x: "New first data").data, "New first data")
+        self.assertEqual(NamespacedCached(1, 2, lambda x: "New second data").data, "New second data")
+        self.assertEqual(NamespacedCached(2, 1, lambda x: "Ignored").data, "Other data")
+        self.assertEqual(NamespacedCached(1, 1, lambda x: "Ignored").data, "New first data")
+
+    def test_namespace_version_per_request(self):
+        """
+        The version of a namespace is read from the cache once per request.
+        """
+        RequestGlobal.clear_globals()
+        namespace_key = NamespacedCached._namespace_key(1)
+        NamespacedCached(1, 1, lambda x: "First data")
+
+        # A bump by another process is seen in the next request
+        mock_set(namespace_key, mock_get(namespace_key) + 1)
+        self.assertEqual(NamespacedCached(1, 1, lambda x: "New data").data, "First data")
+        RequestGlobal.clear_globals()
+        self.assertEqual(NamespacedCached(1, 1, lambda x: "New data").data, "New data")
+
+    # Simulates concurrent generations, which leases would otherwise serialize
+    @override_settings(CACHE_LEASE_WAIT=0)
     def test_out_of_order_update(self):
         """
         Cached should store the data, which generation was started at the latest point in time.
@@ -349,6 +669,8 @@ class CachedTest(SimpleTestCase):
         cached3 = TestCached(lambda x: "Ignored")
         self.assertEqual(cached3.data, data2)
 
+    # Simulates concurrent generations, which leases would otherwise serialize
+    @override_settings(CACHE_LEASE_WAIT=0)
     def test_latest_data(self):
         """
         Cached should store the data, which generation was started at the latest point in time.
@@ -388,3 +710,125 @@ class CachedTest(SimpleTestCase):
         # thread 3 reads data from thread 2
         cached3 = TestCached(lambda x: "Ignored data")
         self.assertEqual(cached3.data, data2)
+
+
+generations = []
+generations_lock = Lock()
+
+
+def count_generation():
+    # Long enough for the other threads to notice the missing data
+    sleep(0.2)
+    with generations_lock:
+        generations.append(1)
+    return len(generations)
+
+
+class SlowCache(CacheBase):
+    KEY_PREFIX = "slowtest"
+    NUM_PARAMS = 0
+    INVALIDATORS = []
+    value: int
+
+    def _generate_data(self, precreated: ProxyManager, prefetched_data: Optional[DBDataManager]):
+        self.value = count_generation()
+
+
+class ParamCache(CacheBase):
+    KEY_PREFIX = "paramtest"
+    NUM_PARAMS = 1
+    INVALIDATORS = []
+    value: int
+
+    def _generate_data(self, precreated: ProxyManager, prefetched_data: Optional[DBDataManager]):
+        if self._params[0] < 0:
+            raise ValueError("Negative parameter")
+        self.value = self._params[0]
+
+
+class ParentCache(CacheBase):
+    KEY_PREFIX = "parenttest"
+    NUM_PARAMS = 1
+    INVALIDATORS = []
+    children: List[ParamCache]
+
+    def _generate_data(self, precreated: ProxyManager, prefetched_data: Optional[DBDataManager]):
+        self.children = [precreated.get_or_create_proxy(ParamCache, i) for i in range(self._params[0])]
+
+    def get_child_proxies(self):
+        return self.children
+
+
+@override_settings(CACHE_LEASE_WAIT=5, CACHE_LEASE_TIMEOUT=10)
+class SingleFlightTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        generations.clear()
+
+    def run_threads(self, func, count=8):
+        barrier = Barrier(count, timeout=5)
+        results = []
+        def run():
+            barrier.wait()
+            results.append(func())
+        threads = [Thread(target=run) for _ in range(count)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        return results
+
+    def test_cache_base(self):
+        results = self.run_threads(lambda: SlowCache.get().value)
+        self.assertEqual(len(generations), 1)
+        self.assertEqual(results, [1] * 8)
+
+        SlowCache.invalidate()
+        results = self.run_threads(lambda: SlowCache.get().value)
+        self.assertEqual(len(generations), 2)
+        self.assertEqual(results, [2] * 8)
+        self.assertIsNone(cache.get(lease_key("slowtest:")))
+
+    def test_cached_abstract(self):
+        results = self.run_threads(lambda: TestCached(lambda _: count_generation()).data)
+        self.assertEqual(len(generations), 1)
+        self.assertEqual(results, [1] * 8)
+        self.assertIsNone(cache.get(lease_key("abstract:")))
+
+    def test_batch_lease(self):
+        proxies = [ParamCache.proxy(i) for i in range(20)]
+        with patch.object(cache, "add", wraps=cache.add) as add:
+            resolve_proxies(proxies)
+        self.assertEqual(add.call_count, 1)
+        self.assertEqual([proxy.value for proxy in proxies], list(range(20)))
+        self.assertIsNone(cache.get(lease_key(batch_key(proxy._keys[0] for proxy in proxies))))
+
+    def test_failed_generation_releases_lease(self):
+        proxies = [ParamCache.proxy(i) for i in (1, -1)]
+        with self.assertRaises(ValueError):
+            resolve_proxies(proxies)
+        self.assertIsNone(cache.get(lease_key(batch_key(proxy._keys[0] for proxy in proxies))))
+
+    def test_populate_children_keeps_parent_lease(self):
+        manager = ProxyManager()
+        parent = manager.get_or_create_proxy(ParentCache, 3)
+        manager.resolve([parent])
+        parent_lease = lease_key(batch_key(parent._keys))
+        self.assertIsNotNone(cache.get(parent_lease))
+
+        parent.populate_children()
+        self.assertEqual([child.value for child in parent.children], [0, 1, 2])
+        # The unsaved parent is still leased, but the children are not
+        self.assertIsNotNone(cache.get(parent_lease))
+        self.assertIsNone(cache.get(lease_key(batch_key(child._keys[0] for child in parent.children))))
+
+        manager.save()
+        self.assertIsNone(cache.get(parent_lease))
+
+    @override_settings(CACHE_LEASE_WAIT=0.2)
+    def test_lease_timeout(self):
+        # A process holding the lease died without storing a value
+        self.assertIsNotNone(acquire("slowtest:"))
+        self.assertEqual(SlowCache.get().value, 1)
+        self.assertIsNotNone(acquire("abstract:"))
+        self.assertEqual(TestCached(lambda _: "data").data, "data")
@@ -1,29 +1,43 @@
 import logging
+from contextlib import contextmanager
 from time import time
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from django.core.cache import cache
 from django.db import connections, transaction
 
 from ..request_globals import RequestGlobal
+from .local import get_local_tier
 
 logger = logging.getLogger('aplus.cache')
 
 
 def _get(key: str) -> Optional[Any]:
+    if get_local_tier() is not None:
+        return _get_many([key]).get(key)
     return cache.get(key)
 
 
 def _get_many(keys: Iterable[str]) -> Dict[str, Any]:
+    tier = get_local_tier()
+    if tier is not None:
+        return tier.get_many(keys, cache)
     return cache.get_many(keys) # type: ignore
 
 
 def _set(key: str, item: Any) -> None:
-    cache.set(key, item)
+    if get_local_tier() is not None:
+        _set_many({key: item})
+    else:
+        cache.set(key, item)
 
 
 def _set_many(items: Dict[str, Any]) -> None:
-    failed = cache.set_many(items)
+    tier = get_local_tier()
+    if tier is not None:
+        failed = tier.set_many(items, cache)
+    else:
+        failed = cache.set_many(items)
     if failed:
         logger.warning("Failed to save the following in the cache: %s", "; ".join(failed))
 
@@ -70,6 +84,7 @@ class CacheTransactionManager(RequestGlobal):
         memo = {}
         for _, m in self.memos:
             memo.update(m)
+        memo.update(InvalidationBatch().pending)
 
         items = _get_many(keys)
         if not memo:
@@ -89,6 +104,9 @@ class CacheTransactionManager(RequestGlobal):
     def get(self, key: str) -> Optional[Any]:
         self._update_memos()
         item = _get(key)
+        pending = InvalidationBatch().pending.get(key)
+        if pending is not None:
+            return pending
         for _, m in reversed(self.memos):
             if key in m:
                 v = m[key]
@@ -192,3 +210,99 @@ class CacheTransactionManager(RequestGlobal):
         _set_many(memo)
 
         self.memos.clear()
+
+
+class NamespaceVersions(RequestGlobal):
+    """The versions of the CachedAbstract namespaces read in this request.
+
+    Every cache key in a namespace includes its version, so the version is
+    read from the cache only once per request. The namespace bumps of this
+    process update the versions.
+    """
+    versions: Dict[str, float]
+
+    def init(self):
+        self.versions = {}
+
+
+class InvalidationBatch(RequestGlobal):
+    """Collects the cache invalidations made inside invalidation_batch().
+
+    pending holds the invalidations of CacheBase keys, old_keys the keys of
+    CachedAbstract and namespaces the CachedAbstract namespaces to bump. All
+    are written to the cache once when the outermost batch exits. Until then,
+    CacheTransactionManager treats the pending keys as invalidated, so the
+    batch itself does not see stale data.
+    """
+    depth: int
+    pending: Dict[str, Any]
+    old_keys: Set[str]
+    namespaces: Set[str]
+
+    def init(self):
+        self.depth = 0
+        self.pending = {}
+        self.old_keys = set()
+        self.namespaces = set()
+
+    def invalidate_many(self, keys: Iterable[str]) -> None:
+        t = (time(), None, None, None)
+        if self.depth:
+            for key in keys:
+                self.pending.setdefault(key, t)
+        else:
+            CacheTransactionManager().set_many(dict.fromkeys(keys, t))
+
+    def invalidate_old_many(self, keys: Iterable[str]) -> bool:
+        """Collects the CachedAbstract keys. Returns False if no batch is active"""
+        if not self.depth:
+            return False
+        self.old_keys.update(keys)
+        return True
+
+    def bump_namespaces(self, keys: Iterable[str]) -> bool:
+        """Collects the CachedAbstract namespace keys. Returns False if no batch is active"""
+        if not self.depth:
+            return False
+        self.namespaces.update(keys)
+        return True
+
+    def flush(self) -> None:
+        pending, self.pending = self.pending, {}
+        old_keys, self.old_keys = self.old_keys, set()
+        namespaces, self.namespaces = self.namespaces, set()
+        if pending:
+            logger.debug("Invalidating %d batched cache keys", len(pending))
+            # The invalidation time must not be earlier than the last change
+            t = (time(), None, None, None)
+            CacheTransactionManager().set_many(dict.fromkeys(pending, t))
+        if old_keys or namespaces:
+            def set_old():
+                now = time()
+                if old_keys:
+                    cache.set_many({key: (None, now) for key in old_keys}, 60*60)
+                if namespaces:
+                    cache.set_many(dict.fromkeys(namespaces, now), None)
+                    NamespaceVersions().versions.update(dict.fromkeys(namespaces, now))
+            # Runs immediately outside transactions
+            transaction.on_commit(set_old)
+
+
+@contextmanager
+def invalidation_batch() -> Iterator[InvalidationBatch]:
+    """Defers the cache invalidations made inside the block to its end.
+
+    Bulk operations save many objects, and the signal handlers invalidate the
+    same cache entries again for each of them. Inside the batch every key is
+    collected once, and at the end of the outermost batch the keys are written
+    with one set_many call. Inside a transaction the write waits for the commit
+    and is dropped on rollback. Can be used as a decorator, too.
+    """
+    batch = InvalidationBatch()
+    batch.depth += 1
+    try:
+        yield batch
+    finally:
+        batch.depth -= 1
+        if batch.depth == 0:
+            batch.flush()
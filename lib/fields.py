@@ -2,9 +2,12 @@ import json
 from typing import Any, List, Optional, Tuple
 
 from django import forms
+from django.conf import settings
 from django.core import exceptions, validators
 from django.db import models
+from django.db.models.expressions import Col
 from django.db.models.fields import related_descriptors
+from django.db.models.query_utils import DeferredAttribute
 from django.utils.translation import gettext_lazy as _
 
 from .widgets import DurationInput, SearchSelect
@@ -201,9 +204,85 @@ class UsersSearchSelectField(SearchSelectField):
         super().__init__(*args, **kwargs)
 
 
-class JSONField(models.TextField):
+class RawJSON(str):
+    """
+    JSON text loaded from the database that has not been decoded yet.
+    """
+
+
+class LazyJSONDescriptor(DeferredAttribute):
+    """
+    Decodes the JSON text of the field when the attribute is first accessed,
+    so that loading a model instance does not decode fields that are not used.
+    """
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, RawJSON):
+            try:
+                value = JSONField.parse_json(str(value))
+            except exceptions.ValidationError:
+                value = None
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class LazyJSONCol(Col):
+    """
+    A column of a JSON field. Django converts the values of a column in the
+    same way whether they are loaded into model instances or returned by
+    values() and values_list(), so the column notes which one its query does
+    when it is compiled.
+    """
+    lazy = False
+
+    def select_format(self, compiler, sql, params):
+        # The default columns of the query are loaded into model instances
+        self.lazy = compiler.query.default_cols
+        return super().select_format(compiler, sql, params)
+
+
+class LazyJSONFieldMixin:
+    """
+    The common parts of the JSON fields. Both are migrated as
+    lib.fields.JSONField, so that JSON_FIELDS_NATIVE does not change the
+    migrations.
+
+    Only the columns loaded into model instances are left for the descriptor
+    to decode. values(), values_list() and other expressions of the JSON type,
+    e.g. annotations, are decoded as usual.
+    """
+    descriptor_class = LazyJSONDescriptor
+
+    def get_col(self, alias, output_field=None):
+        # Not the cached column of the field, as LazyJSONCol.lazy is set per query
+        return LazyJSONCol(alias, self, output_field)
+
+    def is_lazy(self, expression) -> bool:
+        """Whether the values of expression are left for the descriptor to decode"""
+        return isinstance(expression, LazyJSONCol) and expression.lazy and expression.target is self
+
+    def deconstruct(self):
+        name, _path, args, kwargs = super().deconstruct()
+        return name, "lib.fields.JSONField", args, kwargs
+
+    def pre_save(self, model_instance, add):
+        # Read the value without decoding it
+        if self.attname in model_instance.__dict__:
+            return model_instance.__dict__[self.attname]
+        return super().pre_save(model_instance, add)
+
+
+class TextJSONField(LazyJSONFieldMixin, models.TextField):
     """
     Stores JSON object in a text field.
+
+    The value is decoded lazily on the first access of the model attribute.
+    A str value is JSON text, and it is saved as it is.
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -228,12 +307,17 @@ class JSONField(models.TextField):
         return json.dumps(value)
 
     def from_db_value(self, value, expression, connection): # pylint: disable=unused-argument
-        try:
-            return JSONField.parse_json(value)
-        except (exceptions.ValidationError):
+        if not value:
             return None
+        if not self.is_lazy(expression):
+            try:
+                return JSONField.parse_json(value)
+            except exceptions.ValidationError:
+                return None
+        return RawJSON(value)
 
     def get_prep_value(self, value):
+        # Values that have not been accessed are saved as they were loaded
         return JSONField.print_json(value)
 
     def to_python(self, value):
@@ -250,6 +334,59 @@ class JSONField(models.TextField):
         return field
 
 
+class NativeJSONField(LazyJSONFieldMixin, models.JSONField):
+    """
+    Stores JSON object in the native JSON column of the database, so that the
+    keys can be queried in SQL, e.g. filter(meta_data__group=...).
+
+    The value is decoded lazily like in TextJSONField. Empty values are stored as
+    JSON null and read as None, as in the text field. A str value is JSON text
+    like in the text field, not a JSON string, so it must be valid JSON.
+    """
+    parse_json = TextJSONField.parse_json
+    print_json = TextJSONField.print_json
+
+    def from_db_value(self, value, expression, connection):
+        if not self.is_lazy(expression) or not isinstance(value, str):
+            return super().from_db_value(value, expression, connection)
+        if not value or value == "null":
+            return None
+        return RawJSON(value)
+
+    def get_prep_value(self, value):
+        if isinstance(value, RawJSON):
+            return json.loads(value)
+        return super().get_prep_value(value)
+
+    def get_db_prep_save(self, value, connection):
+        if isinstance(value, str):
+            # JSON text, as in TextJSONField. Lookups still compare plain strings.
+            value = JSONField.parse_json(value)
+        # The column is not nullable, so empty values are saved as JSON null
+        return self.get_db_prep_value(value or None, connection)
+
+    def to_python(self, value):
+        return JSONField.parse_json(value)
+
+    def formfield(self, **kwargs):
+        defaults = {
+            'form_class': JSONFormField,
+            'widget': forms.Textarea,
+        }
+        defaults.update(kwargs)
+        # Skip the form field of models.JSONField to edit the JSON as text
+        field = super(models.JSONField, self).formfield(**defaults) # pylint: disable=bad-super-call
+        if not field.help_text:
+            field.help_text = _('ERROR_ENTER_VALID_JSON')
+        return field
+
+
+# The JSON fields are text columns unless JSON_FIELDS_NATIVE is set. Both
+# classes are migrated as lib.fields.JSONField, and the manage.py command
+# convert_json_fields converts the existing columns between them.
+JSONField = NativeJSONField if getattr(settings, 'JSON_FIELDS_NATIVE', False) else TextJSONField
+
+
 class JSONFormField(forms.CharField):
     """
     A JSON text area.
@@ -0,0 +1,174 @@
+"""
+Shared keep-alive HTTP sessions for the requests A+ makes to other services:
+exercise graders, the git manager, LTI platforms and course hooks.
+
+The module level functions of requests and aplus_auth.requests open a new
+connection for every call. The sessions here are kept for the lifetime of the
+process, one per host, and their connections are reused by consecutive
+requests to the same host. The number of connections kept open per host is
+set by HTTP_POOL_MAXSIZE.
+
+Cookies are not stored in the sessions, as they are shared by all users.
+"""
+from http.cookiejar import DefaultCookiePolicy
+import logging
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple, Type, TypeVar
+from urllib.parse import urlsplit
+
+from aplus_auth.payload import Payload
+from aplus_auth.requests import Session as AuthSession
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+from requests.models import Response
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+logger = logging.getLogger('aplus.http_pool')
+
+class PoolStats:
+    """Counts the requests sent and the connections opened through the pooled sessions"""
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def request_sent(self) -> None:
+        with self.lock:
+            self.requests += 1
+
+    def connection_opened(self) -> None:
+        with self.lock:
+            self.connections += 1
+
+    @property
+    def reused(self) -> int:
+        """The number of requests that were sent over an already open connection"""
+        return max(self.requests - self.connections, 0)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "opened": self.connections,
+            "reused": self.reused,
+        }
+
+
+stats = PoolStats()
+
+
+def log_stats() -> None:
+    """Logs the request and connection counts of this process, if it has sent any requests"""
+    if stats.requests:
+        logger.info("HTTP pool: %(requests)d requests, %(opened)d connections opened, %(reused)d reused",
+                    stats.as_dict())
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        stats.connection_opened()
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        stats.connection_opened()
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+    def send(self, *args: Any, **kwargs: Any) -> Response:
+        stats.request_sent()
+        return super().send(*args, **kwargs)
+
+
+class PooledAuthSession(AuthSession):
+    """
+    aplus_auth.requests.Session that can be shared between threads. Without
+    permissions, payload or token arguments, AuthSession.request signs the
+    session's own payload, which get_token modifies (aud, sub, extra["turl"]).
+    Here the default payload is a new Payload for every request instead.
+    """
+    @property # type: ignore
+    def payload(self) -> Payload:
+        return Payload()
+
+    @payload.setter
+    def payload(self, value: Payload) -> None:
+        # Set by AuthSession.__init__, the pooled sessions are created without a payload
+        pass
+
+
+SessionT = TypeVar("SessionT", bound=requests.Session)
+_sessions: Dict[Tuple[Type[requests.Session], str], requests.Session] = {}
+_sessions_lock = Lock()
+
+
+def _create_session(cls: Type[SessionT]) -> SessionT:
+    session = cls()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = PooledAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(url: Optional[str] = None, cls: Type[SessionT] = requests.Session) -> SessionT:
+    """
+    Returns the shared session of class cls for the host of url. Without url,
+    returns a shared session for libraries that send requests to several
+    hosts through a single session (the connections are still pooled per host).
+    """
+    host = ""
+    if url is not None:
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+    key = (cls, host)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = _create_session(cls)
+    return session # type: ignore
+
+
+def close_sessions() -> None:
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def aplus_get(url: str, **kwargs: Any) -> Response:
+    """aplus_auth.requests.get through the shared session of the host"""
+    return get_session(url, PooledAuthSession).get(url, **kwargs)
+
+
+def aplus_post(url: str, **kwargs: Any) -> Response:
+    """aplus_auth.requests.post through the shared session of the host"""
+    return get_session(url, PooledAuthSession).post(url, **kwargs)
+
+
+def aplus_put(url: str, **kwargs: Any) -> Response:
+    """aplus_auth.requests.put through the shared session of the host"""
+    return get_session(url, PooledAuthSession).put(url, **kwargs)
+
+
+def get(url: str, **kwargs: Any) -> Response:
+    return get_session(url).get(url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> Response:
+    return get_session(url).post(url, **kwargs)
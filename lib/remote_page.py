@@ -2,8 +2,8 @@ import logging
 import posixpath
 import re
 import time
-from typing import Mapping, Optional, Sequence, Tuple
-from urllib.parse import urlparse, urljoin
+from typing import Dict, Mapping, Optional, Sequence, Tuple
+from urllib.parse import ParseResult, urlparse, urljoin
 
 from bs4 import BeautifulSoup, Tag
 import requests
@@ -15,7 +15,7 @@ from django.utils.http import parse_http_date_safe
 from django.utils.text import format_lazy
 from django.utils.translation import gettext_lazy as _
 
-from aplus_auth.requests import post as aplus_post, get as aplus_get
+from .http_pool import aplus_get, aplus_post
 
 
 logger = logging.getLogger('aplus.remote_page')
@@ -42,6 +42,14 @@ def parse_expires(response):
     return parse_http_date_safe(response.headers.get("Expires", "")) or 0
 
 
+def parse_html(html: str, parser: Optional[str] = None) -> BeautifulSoup:
+    """
+    Parses html with the given BeautifulSoup tree builder, or the one set in
+    the HTML_PARSER setting by default.
+    """
+    return BeautifulSoup(html, parser or settings.HTML_PARSER)
+
+
 def request_for_response(url, # pylint: disable=too-many-arguments
         post=False,
         data=None,
@@ -110,6 +118,125 @@ def request_for_response(url, # pylint: disable=too-many-arguments
         )) from e
 
 
+# The attribute that holds the URL in each tag that fix_relative_urls rewrites
+URL_ATTRIBUTES = {
+    "img": "src",
+    "script": "src",
+    "iframe": "src",
+    "link": "href",
+    "a": "href",
+    "video": "poster",
+    "source": "src",
+}
+# Starts with "#", "//" or "https:".
+ABSOLUTE_URL_RE = re.compile(r'^(#|//|\w+:)', re.IGNORECASE)
+# Ends with filename extension ".html" and possibly "#anchor".
+CHAPTER_URL_RE = re.compile(r'.*\.html(#.+)?$', re.IGNORECASE)
+# Starts with at least one "../".
+START_DOTDOT_PATH_RE = re.compile(r"^(../)+")
+# May end with the language suffix _en or _en/#anchor or _en#anchor.
+LANG_SUFFIX_RE = re.compile(r'(?P<lang>_[a-z]{2})?(?P<slash>/)?(?P<anchor>#.+)?$')
+# Detect certain A+ exercise info URLs so that they are not broken by
+# the transformations: "../../module1/chapter/module1_chapter_exercise/info/model/".
+# URLs /plain, /info, /info/model, /info/template.
+EXERCISE_INFO_URL_RE = re.compile(r'/((plain)|(info(/model|/template)?))/?(#.+)?$')
+
+
+def _fix_relative_url( # pylint: disable=too-many-arguments
+        value: str,
+        is_chapter_link: bool,
+        aplus_path: Optional[str],
+        url: ParseResult,
+        staticurl: str,
+        is_multilingual_course: bool,
+        ) -> Optional[str]:
+    """Returns the rewritten value of a URL attribute, or None if it is kept as is.
+
+    is_chapter_link and aplus_path tell whether the element has the
+    data-aplus-chapter attribute and the value of its data-aplus-path attribute.
+    """
+    # Custom transform for RST chapter to chapter links.
+    if is_chapter_link:
+        m = CHAPTER_URL_RE.match(value)
+        if m:
+            i = m.start(1)
+            if i > 0:
+                without_html_suffix = value[:i-5] + value[i:] # Keep #anchor in the end.
+            else:
+                without_html_suffix = value[:-5]
+        elif not value.startswith('/'):
+            without_html_suffix = value
+        else:
+            return None
+        # Remove all ../ from the start and prepend exactly "../../".
+        # a-plus-rst-tools modifies chapter links so that the URL path
+        # begins from the html build root directory (_build/html).
+        # The path starts with "../" to match the directory depth and
+        # there are as many "../" as needed to reach the root.
+        # Chapter html files are located under module directories in
+        # the _build/html directory and some courses use subdirectories
+        # under the module directories too.
+        # In A+, the URL path must start with "../../" so that it
+        # removes the current chapter and module from the A+ chapter
+        # page URL: /course/course_instance/module/chapter/
+        # (A+ URLs do not have the same "subdirectories" as
+        # the real subdirectories in the course git repo.)
+        new_val = '../../' + START_DOTDOT_PATH_RE.sub("", without_html_suffix)
+
+        split_path = new_val.split('/')
+        if len(split_path) > 4 and not EXERCISE_INFO_URL_RE.search(new_val):
+            # If the module directory has subdirectories in the course
+            # git repo, the subdirectory must be modified in the A+ URL.
+            # The subdirectory slash / is converted to underscore _.
+            # Convert "../../module1/subdir/chapter2_en" into "../../module1/subdir_chapter2_en".
+            # Do not convert if the URL points to an A+ page such as
+            # "../../module1/chapter2/info/model/".
+            chapter_key = '_'.join(split_path[3:])
+            new_val = '/'.join(split_path[:3]) + '/' + chapter_key
+
+        # Remove lang suffix in chapter2_en#anchor without modifying the #anchor.
+        # Add slash / to the end before the #anchor.
+        m = LANG_SUFFIX_RE.search(new_val)
+        if m and is_multilingual_course:
+            anchor = m.group('anchor')
+            if anchor is None:
+                anchor = ''
+            new_val = new_val[:m.start()] + '/' + anchor
+
+        return new_val
+
+    if not ABSOLUTE_URL_RE.match(value):
+        # Custom transform for RST generated exercises.
+        if aplus_path is not None:
+            # If the exercise description HTML has links to static files such as images,
+            # their links can be fixed with the data-aplus-path="/static/{course}" attribute.
+            # A+ converts "{course}" into the course key used by the backend based on
+            # the exercise service URL. For example, in the MOOC-Grader, exercise service URLs
+            # follow this scheme: "http://grader.local/coursekey/exercisekey".
+            # In the exercise HTML, image <img data-aplus-path="/static/{course}" src="../_images/image.png">
+            # gets the correct URL "http://grader.local/static/coursekey/_images/image.png".
+            fix_path = aplus_path.replace(
+                '{course}',
+                url.path.split('/', 2)[1]
+            )
+            fix_value = START_DOTDOT_PATH_RE.sub("/", value)
+            value = fix_path + fix_value
+
+        # url points to the exercise service, e.g., MOOC-Grader.
+        # This fixes links to static files (such as images) in RST chapters.
+        # The image URL must be absolute and refer to the server with static content
+        # instead of the A+ server. Traditionally this has been the grader server, but
+        # recently gitmanager is used. If GITMANAGER_URL is specified, we assume gitmanager.
+        # A relative URL with only path "/static/course/image.png" would target the A+ server
+        # when it is included in the A+ page. The value should be a relative
+        # path in the course build directory so that it becomes the full
+        # correct URL to the target file.
+        # E.g., urljoin('http://localhost:8080/static/default/module1/chapter.html', "../_images/image.png")
+        # -> 'http://localhost:8080/static/default/_images/image.png'
+        return urljoin(staticurl, value)
+    return None
+
+
 class RemotePage:
     """
     Represents a page that can be loaded over HTTP for further processing.
@@ -125,7 +252,19 @@ class RemotePage:
         self.url = urlparse(url)
         self.response = request_for_response(url, post, data, files, stamp, instance_id)
         self.response.encoding = "utf-8"
-        self.soup = BeautifulSoup(self.response.text, 'html5lib')
+        self.soup = parse_html(self.response.text)
+
+    @classmethod
+    def from_text(cls, url: str, text: str, parser: Optional[str] = None) -> 'RemotePage':
+        """
+        Creates a page from content that has already been loaded from url.
+        """
+        page = cls.__new__(cls)
+        page.url = urlparse(url)
+        page.response = Response()
+        page.response.status_code = 200
+        page.soup = parse_html(text, parser)
+        return page
 
     def base_address(self):
         path = posixpath.dirname(self.url.path).rstrip('/') + '/'
@@ -212,31 +351,6 @@ class RemotePage:
 
     def fix_relative_urls(self, is_multilingual_course):
         url = self.base_address()
-        for tag,attr in [
-            ("img","src"),
-            ("script","src"),
-            ("iframe","src"),
-            ("link","href"),
-            ("a","href"),
-            ("video","poster"),
-            ("source","src"),
-        ]:
-            self._fix_relative_urls(url, tag, attr, is_multilingual_course)
-
-    # pylint: disable-next=too-many-locals too-many-branches
-    def _fix_relative_urls(self, url, tag_name, attr_name, is_multilingual_course):
-        # Starts with "#", "//" or "https:".
-        test = re.compile('^(#|\/\/|\w+:)', re.IGNORECASE) # noqa: W605
-        # Ends with filename extension ".html" and possibly "#anchor".
-        chapter = re.compile('.*\.html(#.+)?$', re.IGNORECASE) # noqa: W605
-        # Starts with at least one "../".
-        start_dotdot_path = re.compile(r"^(../)+")
-        # May end with the language suffix _en or _en/#anchor or _en#anchor.
-        lang_suffix = re.compile(r'(?P<lang>_[a-z]{2})?(?P<slash>/)?(?P<anchor>#.+)?$')
-        # Detect certain A+ exercise info URLs so that they are not broken by
-        # the transformations: "../../module1/chapter/module1_chapter_exercise/info/model/".
-        # URLs /plain, /info, /info/model, /info/template.
-        exercise_info = re.compile(r'/((plain)|(info(/model|/template)?))/?(#.+)?$')
 
         # If Gitmanager is in use, fix relative static URLs to that host
         if settings.GITMANAGER_URL:
@@ -247,93 +361,30 @@ class RemotePage:
             staticurl = url._replace(scheme=gmurl.scheme, netloc=gmurl.netloc)
         else:
             staticurl = url
-
-        for element in self.soup.find_all(tag_name, {attr_name:True}):
-            value = element[attr_name]
+        staticurl = staticurl.geturl()
+
+        # Chapters tend to repeat the same links (images, scripts, the
+        # navigation), so each distinct link is rewritten only once per page.
+        rewritten: Dict[Tuple[str, bool, Optional[str]], Optional[str]] = {}
+        for element in self.soup.find_all(URL_ATTRIBUTES):
+            attr_name = URL_ATTRIBUTES[element.name]
+            value = element.get(attr_name)
             if not value:
                 continue
-
-            # Custom transform for RST chapter to chapter links.
-            if element.has_attr('data-aplus-chapter'):
-                m = chapter.match(value)
-                if m:
-                    i = m.start(1)
-                    if i > 0:
-                        without_html_suffix = value[:i-5] + value[i:] # Keep #anchor in the end.
-                    else:
-                        without_html_suffix = value[:-5]
-                elif not value.startswith('/'):
-                    without_html_suffix = value
-                else:
-                    continue
-                # Remove all ../ from the start and prepend exactly "../../".
-                # a-plus-rst-tools modifies chapter links so that the URL path
-                # begins from the html build root directory (_build/html).
-                # The path starts with "../" to match the directory depth and
-                # there are as many "../" as needed to reach the root.
-                # Chapter html files are located under module directories in
-                # the _build/html directory and some courses use subdirectories
-                # under the module directories too.
-                # In A+, the URL path must start with "../../" so that it
-                # removes the current chapter and module from the A+ chapter
-                # page URL: /course/course_instance/module/chapter/
-                # (A+ URLs do not have the same "subdirectories" as
-                # the real subdirectories in the course git repo.)
-                new_val = '../../' + start_dotdot_path.sub("", without_html_suffix)
-
-                split_path = new_val.split('/')
-                if len(split_path) > 4 and not exercise_info.search(new_val):
-                    # If the module directory has subdirectories in the course
-                    # git repo, the subdirectory must be modified in the A+ URL.
-                    # The subdirectory slash / is converted to underscore _.
-                    # Convert "../../module1/subdir/chapter2_en" into "../../module1/subdir_chapter2_en".
-                    # Do not convert if the URL points to an A+ page such as
-                    # "../../module1/chapter2/info/model/".
-                    chapter_key = '_'.join(split_path[3:])
-                    new_val = '/'.join(split_path[:3]) + '/' + chapter_key
-
-                # Remove lang suffix in chapter2_en#anchor without modifying the #anchor.
-                # Add slash / to the end before the #anchor.
-                m = lang_suffix.search(new_val)
-                if m and is_multilingual_course:
-                    anchor = m.group('anchor')
-                    if anchor is None:
-                        anchor = ''
-                    new_val = new_val[:m.start()] + '/' + anchor
-
+            key = (
+                value,
+                element.has_attr('data-aplus-chapter'),
+                element.get('data-aplus-path'),
+            )
+            if key in rewritten:
+                new_val = rewritten[key]
+            else:
+                new_val = rewritten[key] = _fix_relative_url(
+                    value, *key[1:], url, staticurl, is_multilingual_course,
+                )
+            if new_val is not None:
                 element[attr_name] = new_val
 
-            elif value and not test.match(value):
-
-                # Custom transform for RST generated exercises.
-                if element.has_attr('data-aplus-path'):
-                    # If the exercise description HTML has links to static files such as images,
-                    # their links can be fixed with the data-aplus-path="/static/{course}" attribute.
-                    # A+ converts "{course}" into the course key used by the backend based on
-                    # the exercise service URL. For example, in the MOOC-Grader, exercise service URLs
-                    # follow this scheme: "http://grader.local/coursekey/exercisekey".
-                    # In the exercise HTML, image <img data-aplus-path="/static/{course}" src="../_images/image.png">
-                    # gets the correct URL "http://grader.local/static/coursekey/_images/image.png".
-                    fix_path = element['data-aplus-path'].replace(
-                        '{course}',
-                        url.path.split('/', 2)[1]
-                    )
-                    fix_value = start_dotdot_path.sub("/", value)
-                    value = fix_path + fix_value
-
-                # url points to the exercise service, e.g., MOOC-Grader.
-                # This fixes links to static files (such as images) in RST chapters.
-                # The image URL must be absolute and refer to the server with static content
-                # instead of the A+ server. Traditionally this has been the grader server, but
-                # recently gitmanager is used. If GITMANAGER_URL is specified, we assume gitmanager.
-                # A relative URL with only path "/static/course/image.png" would target the A+ server
-                # when it is included in the A+ page. The value should be a relative
-                # path in the course build directory so that it becomes the full
-                # correct URL to the target file.
-                # E.g., urljoin('http://localhost:8080/static/default/module1/chapter.html', "../_images/image.png")
-                # -> 'http://localhost:8080/static/default/_images/image.png'
-                element[attr_name] = urljoin(staticurl.geturl(), value)
-
     def find_and_replace(self, attr_name, list_of_attributes):
         l = len(list_of_attributes) # noqa: E741
         if l == 0: # noqa: E741
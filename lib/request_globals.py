@@ -1,34 +1,36 @@
 from __future__ import annotations
-import threading
-from typing import Callable, Optional, Set, Type, TypeVar
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional, Set, Type, TypeVar, Union
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import HttpRequest, HttpResponse
 
 
 _global_types: Set[Type[ThreadGlobal]] = set()
-# Each thread has their own object, so there is no possibility of two requests
-# trying to access it at the same time
-_global_store = threading.local()
+# The objects are stored in context variables. Each thread has its own context,
+# and so does each asyncio task, so the requests that an ASGI server handles
+# concurrently in one thread do not see each other's objects either. Django
+# runs sync code of an async request with the context of the request.
 
 
 T = TypeVar("T", bound="ThreadGlobal")
 def set_global(cls: Type[T], obj: Optional[T]):
-    setattr(_global_store, cls._unique_key, obj)
+    cls._context_var.set(obj)
 
 
 def get_global(cls: Type[ThreadGlobal]):
-    return getattr(_global_store, cls._unique_key, None)
+    return cls._context_var.get()
 
 
 class ThreadGlobalMeta(type):
-    _unique_key: str
+    _context_var: ContextVar
     ABSTRACT: bool
 
     def __new__(cls, name, bases, namespace, **kwargs):
         ncls = super().__new__(cls, name, bases, namespace, **kwargs)
         if not ncls.__dict__.get("ABSTRACT", False):
             _global_types.add(ncls) # type: ignore
-            ncls._unique_key = str(hash(ncls))
+            ncls._context_var = ContextVar(f"{ncls.__module__}.{ncls.__qualname__}", default=None)
         return ncls
 
 
@@ -86,15 +88,32 @@ class RequestGlobal(ThreadGlobal):
 
 
 class ClearRequestGlobals:
-    """Middleware that clears RequestGlobal variables from thread local storage."""
-    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+    """Middleware that clears RequestGlobal variables at the start and the end of
+    a request. Works both in sync and async middleware chains."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(
+            self,
+            get_response: Callable[[HttpRequest], Union[HttpResponse, Awaitable[HttpResponse]]],
+            ):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
-    def __call__(self, request: HttpRequest) -> HttpResponse:
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         RequestGlobal.clear_globals() # Just in case
         response = self.get_response(request)
         RequestGlobal.clear_globals()
         return response
 
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        RequestGlobal.clear_globals() # Just in case
+        response = await self.get_response(request)
+        RequestGlobal.clear_globals()
+        return response
+
     def process_exception(self, _request: HttpRequest, _exception: Exception) -> None:
         RequestGlobal.clear_globals()
@@ -1,4 +1,7 @@
+from contextlib import contextmanager
 from datetime import timedelta
+from typing import Any, Dict, Iterator
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.test import TestCase
@@ -8,6 +11,7 @@ from course.models import (
     Course,
     CourseInstance,
     CourseModule,
+    Enrollment,
     LearningObjectCategory,
 )
 from exercise.models import (
@@ -15,6 +19,174 @@ from exercise.models import (
     StaticExercise,
     Submission,
 )
+from userprofile.models import UserProfile
+
+
+def create_empty_course_instance(url: str) -> CourseInstance:
+    """Creates a course with the given url and an open course instance without any content"""
+    now = timezone.now()
+    course = Course.objects.create(url=url, name="Synthetic Course", code="SYN-1")
+    return CourseInstance.objects.create(
+        course=course,
+        url="synthetic",
+        instance_name="Synthetic",
+        starting_time=now - timedelta(days=30),
+        ending_time=now + timedelta(days=30),
+    )
+
+
+@contextmanager
+def throwaway_course_instance(url: str) -> Iterator[CourseInstance]:
+    """Creates an empty course instance for the block and deletes the course afterwards"""
+    instance = create_empty_course_instance(url)
+    try:
+        yield instance
+    finally:
+        for course_instance in instance.course.instances.all():
+            course_instance.course_modules.all().delete()
+        instance.course.delete()
+
+
+def synthetic_course_config(modules: int, exercises_per_module: int, revision: int) -> Dict[str, Any]:
+    """Returns a course configuration for edit_course.operations.configure where
+    every module, chapter and exercise changes between revisions. Used by the
+    configuration benchmarks."""
+    return {
+        "categories": {
+            "exercises": {"name": "Exercises"},
+            "chapters": {"name": "Chapters"},
+        },
+        "modules": [
+            {
+                "key": f"module{m}",
+                "title": f"Module {m} r{revision}",
+                "points_to_pass": revision,
+                "children": [
+                    {
+                        "key": f"chapter{m}",
+                        "category": "chapters",
+                        "title": f"Chapter {m} r{revision}",
+                        "children": [
+                            {
+                                "key": f"exercise{m}_{e}",
+                                "category": "exercises",
+                                "title": f"Exercise {m}.{e} r{revision}",
+                                "max_submissions": 10 + revision,
+                                "max_points": 10,
+                                "reveal_submission_feedback": {
+                                    "trigger": "deadline" if revision else "immediate",
+                                },
+                                "reveal_model_solutions": {
+                                    "trigger": "time",
+                                    "time": "2030-01-01",
+                                },
+                            }
+                            for e in range(exercises_per_module)
+                        ],
+                    },
+                ],
+            }
+            for m in range(modules)
+        ],
+    }
+
+
+def generate_rst_chapter(sections: int) -> str:
+    """A chapter page like the ones a-plus-rst-tools builds for large courses:
+    every section repeats the same figures, scripts and navigation links"""
+    section = """
+    <div class="section" id="section-{i}">
+      <h2>Section {i}<a class="headerlink" href="#section-{i}">¶</a></h2>
+      <p>See <a href="chapter{j}.html#section-{i}" data-aplus-chapter>chapter {j}</a>
+         and <a href="../module2/subdir/chapter{j}_en.html" data-aplus-chapter>the next module</a>.</p>
+      <img src="../_images/figure{j}.png" alt="Figure">
+      <img src="../_images/icon.png" data-aplus-path="/static/{{course}}">
+      <script src="../_static/highlight.js"></script>
+      <iframe src="../_static/embedded.html"></iframe>
+      <p><a href="https://docs.python.org/3/">Python</a> <a href="#top">top</a></p>
+      <pre class="literal-block">for x in range({i}):\n    print(x)</pre>
+    </div>"""
+    sections = "".join(section.format(i=i, j=i % 10) for i in range(sections))
+    return (
+        '<!DOCTYPE html><html><head>'
+        '<link rel="stylesheet" href="../_static/course.css">'
+        '<script src="../_static/course.js"></script>'
+        '</head><body><div id="chapter">'
+        f'{sections}'
+        '</div></body></html>'
+    )
+
+
+def create_synthetic_course(
+        modules: int = 15,
+        exercises_per_module: int = 20,
+        students: int = 10,
+        submissions_per_exercise: int = 1,
+        ) -> CourseInstance:
+    """Creates a course instance with the given number of modules, exercises,
+    enrolled students and submissions per student per exercise. Used by the
+    benchmarks. Uses bulk creation, so model save signals are not sent."""
+    now = timezone.now()
+    instance = create_empty_course_instance("synthetic")
+    category = LearningObjectCategory.objects.create(course_instance=instance, name="Exercises")
+    course_modules = CourseModule.objects.bulk_create(
+        CourseModule(
+            course_instance=instance,
+            url=f"module{m}",
+            name=f"Module {m}",
+            order=m,
+            points_to_pass=10,
+            opening_time=now - timedelta(days=10),
+            closing_time=now + timedelta(days=10),
+        )
+        for m in range(modules)
+    )
+    exercises = []
+    for module in course_modules:
+        for e in range(exercises_per_module):
+            exercises.append(BaseExercise.objects.create(
+                course_module=module,
+                category=category,
+                url=f"{module.url}-e{e}",
+                name=f"Exercise {module.order}.{e}",
+                service_url="http://localhost/",
+                max_points=10,
+                points_to_pass=5,
+                order=e,
+            ))
+
+    users = User.objects.bulk_create(
+        User(username=f"synthetic_student_{i}", first_name="Synthetic", last_name=str(i))
+        for i in range(students)
+    )
+    UserProfile.objects.bulk_create(UserProfile(user=user, student_id=f"S{i}") for i, user in enumerate(users))
+    profiles = list(UserProfile.objects.filter(user__in=users))
+    Enrollment.objects.bulk_create(
+        Enrollment(
+            course_instance=instance,
+            user_profile=profile,
+            role=Enrollment.ENROLLMENT_ROLE.STUDENT,
+            status=Enrollment.ENROLLMENT_STATUS.ACTIVE,
+        )
+        for profile in profiles
+    )
+
+    submissions = Submission.objects.bulk_create(
+        Submission(
+            exercise=exercise,
+            status=Submission.STATUS.READY,
+            grade=(i + j) % 11,
+        )
+        for exercise in exercises
+        for i, _ in enumerate(profiles)
+        for j in range(submissions_per_exercise)
+    )
+    submitters = (profile for _ in exercises for profile in profiles for _ in range(submissions_per_exercise))
+    Submission.submitters.through.objects.bulk_create(
+        Submission.submitters.through(submission_id=submission.id, userprofile_id=profile.id)
+        for submission, profile in zip(submissions, submitters)
+    )
+    return instance
 
 
 class CourseTestCase(TestCase):
@@ -1,9 +1,18 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import re
+from threading import Thread
 from typing import Optional
+from unittest.mock import patch
 
-from django.test import SimpleTestCase
+from asgiref.sync import iscoroutinefunction
+from django.test import SimpleTestCase, override_settings
 from django.http import HttpResponse
 
-from .request_globals import RequestGlobal
+from . import http_pool, remote_page
+from .remote_page import RemotePage, parse_html
+from .request_globals import ClearRequestGlobals, RequestGlobal
+from .testdata import generate_rst_chapter
 
 
 class TestGlobal(RequestGlobal):
@@ -69,3 +78,273 @@ class RequestGlobalTest(SimpleTestCase):
     def test_init_called(self):
         obj = TestGlobal()
         self.assertEqual(obj.test, "test")
+
+    def test_is_task_specific(self):
+        async def request():
+            RequestGlobal.clear_globals()
+            obj = TestGlobal()
+            # Let the other request run in between
+            await asyncio.sleep(0.01)
+            self.assertIs(TestGlobal(), obj)
+            return obj
+
+        async def requests():
+            return await asyncio.gather(request(), request())
+
+        obj = TestGlobal()
+        obj1, obj2 = asyncio.run(requests())
+        self.assertIsNot(obj1, obj2)
+        self.assertIs(TestGlobal(), obj)
+
+    def test_async_middleware(self):
+        async def get_response(_request):
+            self.obj = TestGlobal()
+            return HttpResponse()
+
+        middleware = ClearRequestGlobals(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        async def request():
+            obj = TestGlobal()
+            await middleware(None)
+            self.assertIsNot(self.obj, obj)
+            self.assertIsNot(TestGlobal(), self.obj)
+
+        asyncio.run(request())
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self): # pylint: disable=invalid-name
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+@override_settings(HTTP_POOL_MAXSIZE=2)
+class HttpPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        http_pool.close_sessions()
+
+    def tearDown(self):
+        http_pool.close_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        before = http_pool.stats.as_dict()
+        for _ in range(5):
+            response = http_pool.get(self.url, timeout=5)
+            self.assertEqual(response.content, b"ok")
+        after = http_pool.stats.as_dict()
+        self.assertEqual(after["requests"] - before["requests"], 5)
+        self.assertEqual(after["opened"] - before["opened"], 1)
+        self.assertEqual(after["reused"] - before["reused"], 4)
+
+    def test_sessions_per_host(self):
+        self.assertIs(http_pool.get_session(self.url), http_pool.get_session(self.url + "other"))
+        self.assertIsNot(http_pool.get_session(self.url), http_pool.get_session("http://example.invalid/"))
+        self.assertIsNot(
+            http_pool.get_session(self.url),
+            http_pool.get_session(self.url, http_pool.PooledAuthSession),
+        )
+
+    def test_auth_session_payload_per_request(self):
+        audiences = []
+        def prepare_token(url, payload, token):
+            # get_token fills in the audience of the payload it signs
+            audiences.append(payload.aud)
+            payload.aud = url
+            return "token"
+        session = http_pool.get_session(self.url, http_pool.PooledAuthSession)
+        with patch.object(session, "prepare_token", prepare_token):
+            http_pool.aplus_get(self.url, timeout=5)
+            http_pool.aplus_get(self.url + "other", timeout=5)
+        self.assertEqual(audiences, [None, None])
+        self.assertIsNone(session.payload.aud)
+
+    def test_log_stats(self):
+        http_pool.get(self.url, timeout=5)
+        with self.assertLogs("aplus.http_pool", "INFO") as logs:
+            http_pool.log_stats()
+        self.assertIn("requests", logs.output[0])
+
+
+CHAPTER_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <meta name="status" content="accepted">
+  <meta name="points" value="3">
+  <meta name="max-points" value="5">
+  <meta name="DC.Description" content="A chapter &amp; its exercises">
+  <title>Module 1: Chapter &lt;2&gt;</title>
+  <link rel="stylesheet" href="../_static/course.css" data-aplus>
+  <script src="../_static/course.js" data-aplus></script>
+  <script>var x = 1 < 2 && "</div>";</script>
+  <style data-aplus>p > a { color: red; }</style>
+</head>
+<body>
+  <nav><a href="../index.html">Index</a></nav>
+  <div id="chapter" class="section">
+    <h1>Chapter&nbsp;2 &mdash; Lists</h1>
+    <p>Text with <a href="chapter3.html#lists" data-aplus-chapter>a link</a>,
+       <a href="../module2/subdir/chapter4_en.html" data-aplus-chapter>another</a>,
+       <a href="https://example.com/">external</a> and <a href="#anchor">an anchor</a>.</p>
+    <img src="../_images/figure.png" alt="Figure">
+    <img src="../_images/other.png" data-aplus-path="/static/{course}">
+    <video poster="../_images/poster.jpg"><source src="../_static/video.mp4"></video>
+    <table class="table">
+      <thead><tr><th>A</th><th>B</th></tr></thead>
+      <tbody><tr><td>1</td><td>2</td></tr></tbody>
+    </table>
+    <ul><li>one</li><li>two <code>x &lt; y</code></li></ul>
+    <pre class="literal-block">
+def f(x):
+    return x &lt; 2  # indented
+</pre>
+    <div data-aplus-once><p>Shown only once</p></div>
+    <div data-aplus-exercise="1" data-aplus-quiz></div>
+    <div data-aplus-exercise="2"></div>
+    <form method="post" action="">
+      <input type="text" name="key" value="">
+      <input type="radio" name="choice" value="a" checked>
+      <select name="sel"><option value="1">1</option><option value="2" selected>2</option></select>
+      <textarea name="code">print("&lt;hello&gt;")</textarea>
+      <input type="submit" value="Submit">
+    </form>
+    <iframe src="embedded.html"></iframe>
+  </div>
+</body>
+</html>
+"""
+
+
+FEEDBACK_HTML = """<html><head>
+<meta name="status" content="graded" />
+<meta name="points" value="7" />
+<meta name="max-points" value="10" />
+<title>Feedback</title>
+</head><body>
+<div id="exercise">
+<div class="alert alert-success">Passed 7 of 10 tests</div>
+<pre>Test 1 ... ok
+Test 2 ... FAIL: expected &lt;3&gt; but got &lt;4&gt;
+</pre>
+<p>See <a href="../static/help.html">the help page</a>.</p>
+<img src="data:image/png;base64,iVBORw0KGgo=">
+</div>
+</body></html>
+"""
+
+
+@override_settings(GITMANAGER_URL=None, REMOTE_PAGE_HOSTS_MAP=None)
+class HtmlParserConformanceTest(SimpleTestCase):
+    """The fast parsers must produce the same results as html5lib for well-formed pages"""
+    url = "http://grader.local/course/module1/chapter2.html"
+    parsers = ["lxml", "html.parser"]
+
+    def normalize(self, html):
+        # The other tree builders of BeautifulSoup collapse whitespace-only
+        # strings, which does not change how the page is rendered
+        soup = parse_html(html, "html5lib")
+        for text in soup.find_all(string=re.compile(r"^\s+$")):
+            if not text.find_parent(["pre", "textarea", "script", "style"]):
+                text.replace_with(" ")
+        return str(soup)
+
+    def process(self, parser, html=CHAPTER_HTML):
+        page = RemotePage.from_text(self.url, html, parser)
+        page.fix_relative_urls(True)
+        page.find_and_replace('data-aplus-exercise', [
+            {'id': 'chapter-exercise-1', 'data-aplus-exercise': 'a'},
+            {'id': 'chapter-exercise-2', '?data-aplus-quiz': 'b'},
+        ])
+        result, clean_result = page.element_or_body([{'id': 'exercise'}, {'id': 'chapter'}], ['chapter'])
+        return {
+            "status": page.meta("status"),
+            "points": page.meta("points"),
+            "description": page.meta("DC.Description"),
+            "missing": page.meta("missing"),
+            "title": [str(c) for c in page.title()],
+            "head": self.normalize(page.head({'data-aplus': True})),
+            "result": self.normalize(result),
+            "clean_result": self.normalize(clean_result),
+        }
+
+    def test_conformance(self):
+        expected = self.process("html5lib")
+        self.assertEqual(expected["status"], "accepted")
+        self.assertEqual(expected["points"], "3")
+        self.assertIn("http://grader.local/course/_images/figure.png", expected["result"])
+        self.assertIn("../../chapter3/#lists", expected["result"])
+        self.assertNotIn("Shown only once", expected["clean_result"])
+        for parser in self.parsers:
+            with self.subTest(parser=parser):
+                self.assertEqual(self.process(parser), expected)
+
+    def test_feedback_conformance(self):
+        expected = self.process("html5lib", FEEDBACK_HTML)
+        self.assertEqual(expected["points"], "7")
+        self.assertIn("http://grader.local/course/static/help.html", expected["result"])
+        for parser in self.parsers:
+            with self.subTest(parser=parser):
+                self.assertEqual(self.process(parser, FEEDBACK_HTML), expected)
+
+
+@override_settings(GITMANAGER_URL=None, REMOTE_PAGE_HOSTS_MAP=None)
+class FixRelativeUrlsTest(SimpleTestCase):
+    url = "http://grader.local/course/module1/chapter.html"
+
+    def fix(self, html):
+        page = RemotePage.from_text(self.url, html)
+        page.fix_relative_urls(True)
+        return page
+
+    def test_repeated_links_are_rewritten_once(self):
+        with patch.object(remote_page, "_fix_relative_url", wraps=remote_page._fix_relative_url) as fix_url:
+            page = self.fix(generate_rst_chapter(100))
+        # The page assets, a header link and a chapter link per section,
+        # 10 module links and figures, and the links repeated in every section
+        self.assertEqual(fix_url.call_count, 2 + 2 * 100 + 2 * 10 + 5)
+
+        chapter = page.soup.find(id="chapter")
+        self.assertEqual(
+            [a["href"] for a in chapter.find(id="section-12").find_all("a")],
+            [
+                "#section-12",
+                "../../chapter2/#section-12",
+                "../../module2/subdir_chapter2/",
+                "https://docs.python.org/3/",
+                "#top",
+            ],
+        )
+        self.assertEqual(
+            {img["src"] for img in chapter.find_all("img")},
+            {f"http://grader.local/course/_images/figure{j}.png" for j in range(10)}
+            | {"http://grader.local/static/course/_images/icon.png"},
+        )
+        self.assertEqual(
+            {e["src"] for e in chapter.find_all(["script", "iframe"])},
+            {"http://grader.local/course/_static/highlight.js", "http://grader.local/course/_static/embedded.html"},
+        )
+
+    def test_single_pass(self):
+        # Rewriting searches the page once and rewrites each distinct link
+        # once, so the work grows linearly with the size of the chapter
+        for sections in (100, 800):
+            page = RemotePage.from_text(self.url, generate_rst_chapter(sections))
+            with patch.object(page.soup, "find_all", wraps=page.soup.find_all) as find_all, \
+                    patch.object(remote_page, "_fix_relative_url", wraps=remote_page._fix_relative_url) as fix_url:
+                page.fix_relative_urls(True)
+            self.assertEqual(find_all.call_count, 1)
+            self.assertEqual(fix_url.call_count, 2 + 2 * sections + 2 * 10 + 5)
@@ -0,0 +1,190 @@
+"""
+Sending points to LTI 1.3 platforms with the Assignment and Grade Services.
+
+The points are not sent in the request that graded the submission.
+queue_score stores the platform and the user of the launch in the cache under
+a key of the user and the exercise, and the publish_lti_points celery task
+sends the best points LTI_AGS_PUBLISH_DELAY seconds later. The grading that
+adds the task marker of the key (an atomic cache.add) schedules the task, and
+the task removes the marker before it reads the points. Other gradings of the
+same exercise by the same user only refresh the stored launch, so the points
+are sent once. The service connector of each platform, and with it
+the access token, is reused between scores, and the line item of each exercise
+is looked up from the platform only once.
+"""
+import logging
+from time import monotonic
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from pylti1p3.assignments_grades import AssignmentsGradesService
+from pylti1p3.exception import LtiServiceException
+from pylti1p3.grade import Grade
+from pylti1p3.lineitem import LineItem
+from pylti1p3.message_launch import TLaunchData
+from pylti1p3.service_connector import ServiceConnector
+
+from exercise.cache.points import ExercisePoints
+from exercise.models import BaseExercise
+from lib.http_pool import get_session
+from .utils import get_tool_conf
+
+
+logger = logging.getLogger('aplus.lti_tool')
+
+AGS_ENDPOINT_CLAIM = "https://purl.imsglobal.org/spec/lti-ags/claim/endpoint"
+# A task marker older than this is assumed to belong to a lost task
+QUEUED_SCORE_TIMEOUT = 3600
+LINEITEM_CACHE_TIMEOUT = 24 * 3600
+
+_connectors: Dict[Tuple[str, str], Tuple[ServiceConnector, float]] = {}
+
+
+def get_client_id(launch_data: TLaunchData) -> str:
+    aud = launch_data['aud']
+    if isinstance(aud, list):
+        return launch_data.get('azp') or aud[0]
+    return aud
+
+
+def score_key(score: Dict[str, Any]) -> str:
+    return "lti_ags_score:{}:{}:{}:{}".format(
+        score['iss'], score['client_id'], score['sub'], score['exercise_id'],
+    )
+
+
+def task_key(key: str) -> str:
+    return key + ":task"
+
+
+def queue_score(score: Dict[str, Any]) -> None:
+    """
+    Queues the best points of the user in the exercise to be sent to the
+    platform after the current transaction commits. score describes the launch
+    the grading came from, see send_lti_points.
+    """
+    from .tasks import publish_lti_points # pylint: disable=import-outside-toplevel
+    key = score_key(score)
+
+    def queue():
+        cache.set(key, score, QUEUED_SCORE_TIMEOUT)
+        # Only one grading gets to add the marker. Until the task removes it,
+        # the queued task sends the points of the other gradings too.
+        if cache.add(task_key(key), True, QUEUED_SCORE_TIMEOUT):
+            publish_lti_points.apply_async((key,), countdown=settings.LTI_AGS_PUBLISH_DELAY)
+
+    transaction.on_commit(queue)
+
+
+def take_queued_score(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the queued score and removes the task marker, so that later
+    gradings queue a new task. The points are read from the database after
+    this, so they include every grading that did not queue a new task.
+    """
+    score = cache.get(key)
+    cache.delete(task_key(key))
+    return score
+
+
+def get_connector(iss: str, client_id: str) -> ServiceConnector:
+    """Returns the service connector of the platform, which keeps its access tokens"""
+    connector, created = _connectors.get((iss, client_id), (None, 0.0))
+    if connector is None or monotonic() - created > settings.LTI_AGS_TOKEN_LIFETIME:
+        registration = get_tool_conf().find_registration_by_params(iss, client_id)
+        connector = ServiceConnector(registration, requests_session=get_session())
+        _connectors[(iss, client_id)] = (connector, monotonic())
+    return connector
+
+
+def drop_connector(iss: str, client_id: str) -> None:
+    _connectors.pop((iss, client_id), None)
+
+
+def lineitem_key(endpoint: Dict[str, Any], exercise: BaseExercise) -> str:
+    return "lti_ags_lineitem:{}:{}".format(endpoint.get('lineitems'), exercise.id)
+
+
+def get_lineitem(ags: AssignmentsGradesService, endpoint: Dict[str, Any], exercise: BaseExercise) -> LineItem:
+    """Returns the line item of the exercise, which is found or created in the platform once"""
+    line_item = LineItem()
+    line_item.set_tag(str(exercise.id))
+    key = lineitem_key(endpoint, exercise)
+    lineitem_id = cache.get(key)
+    if lineitem_id is None:
+        line_item = ags.find_or_create_lineitem(line_item)
+        cache.set(key, line_item.get_id(), LINEITEM_CACHE_TIMEOUT)
+    else:
+        line_item.set_id(lineitem_id)
+    return line_item
+
+
+def publish_score(score: Dict[str, Any]) -> None:
+    """
+    Sends the best points of the user in the exercise to the platform.
+    Raises LtiServiceException or a requests exception if the platform fails,
+    except that a 409 response is taken as the grade being already saved.
+    """
+    try:
+        exercise = BaseExercise.objects.get(pk=score['exercise_id'])
+    except BaseExercise.DoesNotExist:
+        return
+    try:
+        user = User.objects.get(username=score['username'])
+    except User.DoesNotExist:
+        logger.warning("Tried to send LTI points for a non-existing user '%s'.", score['username'])
+        return
+
+    # Moodle does not have gradebook entries for teachers - don't send result if submitter is a teacher
+    if exercise.course_instance.is_teacher(user):
+        return
+    entry = ExercisePoints.get(exercise, user)
+    best_submission = entry.best_submission
+    if best_submission is None:
+        return
+
+    grade = Grade()
+    (grade.set_score_given(best_submission.points)
+        .set_timestamp(best_submission.date.strftime('%Y-%m-%dT%H:%M:%S+0000'))
+        .set_score_maximum(exercise.max_points)
+        .set_activity_progress('Completed')
+        .set_grading_progress('FullyGraded')
+        .set_user_id(score['sub']))
+
+    for attempt in range(2):
+        ags = AssignmentsGradesService(get_connector(score['iss'], score['client_id']), score['endpoint'])
+        line_item = get_lineitem(ags, score['endpoint'], exercise)
+        try:
+            ags.put_grade(grade, line_item)
+            return
+        except LtiServiceException as exc:
+            status = exc.response.status_code
+            # At least Moodle sends a 409 when trying to save
+            # a grade with same timestamp as an existing grade
+            if status == 409:
+                logger.info("Grade for submission has already been saved through LTI; continuing")
+                return
+            if attempt == 0 and status == 401:
+                # The access token has expired
+                drop_connector(score['iss'], score['client_id'])
+            elif attempt == 0 and status == 404:
+                # The line item has been removed from the platform
+                cache.delete(lineitem_key(score['endpoint'], exercise))
+            else:
+                if status < 500:
+                    logger.exception(
+                        "LTI Tool could not send grade to the Platform. "
+                        "Tool user id: %s. Tool exercise id: %s. "
+                        "Grade userId: %s. Grade timestamp: %s. "
+                        "Line item id: %s. Line item tag: %s. ",
+                        str(user.pk),
+                        str(exercise.pk),
+                        str(grade.get_user_id()),
+                        str(grade.get_timestamp()),
+                        str(line_item.get_id()),
+                        str(line_item.get_tag()),
+                    )
+                raise
@@ -0,0 +1,35 @@
+import logging
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from pylti1p3.exception import LtiServiceException
+from requests.exceptions import RequestException
+
+from aplus.celery import app
+from .ags import publish_score, take_queued_score
+
+logger = logging.getLogger('aplus.lti_tool')
+
+@app.task(bind=True, max_retries=settings.LTI_AGS_RETRY_LIMIT)
+def publish_lti_points(self, key: str, score: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Sends the points queued under key to the LTI platform. Requests that fail
+    because of the platform or the network are retried with a backoff.
+    """
+    if score is None:
+        score = take_queued_score(key)
+        if score is None:
+            return
+    try:
+        publish_score(score)
+    except (LtiServiceException, RequestException) as exc:
+        status = getattr(exc.response, 'status_code', None)
+        if status is not None and status < 500 and status != 429:
+            return
+        logger.warning("Sending LTI points failed (%s), retrying: %s", key, exc)
+        raise self.retry(
+            args=(key,),
+            kwargs={'score': score},
+            countdown=settings.LTI_AGS_RETRY_DELAY * 2 ** self.request.retries,
+            exc=exc,
+        )
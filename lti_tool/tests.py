@@ -0,0 +1,246 @@
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Thread
+from unittest.mock import Mock, patch
+from urllib.parse import parse_qs
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from pylti1p3.exception import LtiServiceException
+from pylti1p3.tool_config import ToolConfDict
+
+from course.models import Course, CourseInstance, CourseModule, LearningObjectCategory
+from exercise.models import BaseExercise, Submission
+from lti_tool import ags
+from lti_tool.tasks import publish_lti_points
+from lti_tool.utils import send_lti_points
+
+
+class StubPlatform:
+    """
+    A local LMS that implements the token endpoint and the line item and
+    score endpoints of the Assignment and Grade Services.
+    """
+    def __init__(self):
+        self.requests = []
+        self.lineitems = []
+        self.scores = []
+        self.score_status = 200
+        platform = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                pass
+
+            def respond(self, status, body=None):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self): # pylint: disable=invalid-name
+                platform.requests.append(("GET", self.path))
+                self.respond(200, platform.lineitems)
+
+            def do_POST(self): # pylint: disable=invalid-name
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+                platform.requests.append(("POST", self.path))
+                if self.path == "/token":
+                    if "client_assertion" in parse_qs(body):
+                        self.respond(200, {"access_token": f"token{len(platform.requests)}"})
+                    else:
+                        self.respond(400, {"error": "invalid_request"})
+                elif self.path == "/lineitems":
+                    lineitem = json.loads(body)
+                    lineitem["id"] = f"{platform.url}/lineitems/{len(platform.lineitems) + 1}"
+                    platform.lineitems.append(lineitem)
+                    self.respond(200, lineitem)
+                elif self.path.endswith("/scores"):
+                    if platform.score_status == 200:
+                        platform.scores.append((self.path, json.loads(body)))
+                    self.respond(platform.score_status, {})
+                else:
+                    self.respond(404)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, method, path):
+        return sum(1 for request in self.requests if request == (method, path))
+
+
+class AGSPublishTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.platform = StubPlatform()
+        cls.tool_conf = ToolConfDict({
+            "https://lms.invalid": {
+                "client_id": "aplus",
+                "auth_login_url": f"{cls.platform.url}/login",
+                "auth_token_url": f"{cls.platform.url}/token",
+                "key_set_url": f"{cls.platform.url}/keys",
+                "deployment_ids": ["1"],
+            },
+        })
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.tool_conf.set_private_key("https://lms.invalid", private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.platform.close()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now()
+        cls.user = User.objects.create(username="student", email="student@example.com")
+        cls.course = Course.objects.create(name="test course", code="123456", url="Course-Url")
+        cls.course_instance = CourseInstance.objects.create(
+            instance_name="Fall 2011",
+            starting_time=today - timedelta(days=1),
+            ending_time=today + timedelta(days=1),
+            course=cls.course,
+            url="T-00.1000",
+        )
+        cls.course_module = CourseModule.objects.create(
+            name="test module",
+            url="test-module",
+            points_to_pass=10,
+            course_instance=cls.course_instance,
+            opening_time=today - timedelta(days=1),
+            closing_time=today + timedelta(days=1),
+        )
+        cls.category = LearningObjectCategory.objects.create(
+            name="test category",
+            course_instance=cls.course_instance,
+        )
+        cls.exercise = BaseExercise.objects.create(
+            name="test exercise",
+            course_module=cls.course_module,
+            category=cls.category,
+            url="b1",
+            max_points=10,
+        )
+        cls.submission = Submission.objects.create(
+            exercise=cls.exercise,
+            meta_data={"lti-launch-id": "launch1", "lti-session-id": "session1"},
+        )
+        cls.submission.submitters.add(cls.user.userprofile)
+        cls.submission.set_points(7, 10)
+        cls.submission.set_ready()
+        cls.submission.save()
+
+    def setUp(self):
+        self.platform.requests.clear()
+        self.platform.lineitems.clear()
+        self.platform.scores.clear()
+        self.platform.score_status = 200
+        ags._connectors.clear() # pylint: disable=protected-access
+        cache.clear()
+
+    def launch(self):
+        launch = Mock()
+        launch.get_launch_data.return_value = {
+            "iss": "https://lms.invalid",
+            "aud": "aplus",
+            "sub": "lms-user-1",
+            "email": self.user.email,
+            "https://purl.imsglobal.org/spec/lti/claim/ext": {"user_username": self.user.username},
+            ags.AGS_ENDPOINT_CLAIM: {
+                "scope": [
+                    "https://purl.imsglobal.org/spec/lti-ags/scope/lineitem",
+                    "https://purl.imsglobal.org/spec/lti-ags/scope/score",
+                ],
+                "lineitems": f"{self.platform.url}/lineitems",
+            },
+        }
+        return launch
+
+    def grade(self, count):
+        queued = []
+        request = RequestFactory().post("/")
+        with override_settings(LTI_TOOL_CONF=self.tool_conf), \
+                patch('lti_tool.utils.DjangoMessageLaunch.from_cache', return_value=self.launch()), \
+                patch.object(publish_lti_points, 'apply_async', lambda args, **kwargs: queued.append(args)):
+            for _ in range(count):
+                with self.captureOnCommitCallbacks(execute=True):
+                    send_lti_points(request, self.submission)
+        return queued
+
+    def publish(self, key, **kwargs):
+        with override_settings(LTI_TOOL_CONF=self.tool_conf):
+            return publish_lti_points(key, **kwargs)
+
+    def test_gradings_are_sent_once(self):
+        queued = self.grade(3)
+        self.assertEqual(len(queued), 1)
+        self.assertEqual(self.platform.requests, [])
+
+        self.publish(*queued[0])
+        self.assertEqual(len(self.platform.scores), 1)
+        path, score = self.platform.scores[0]
+        self.assertEqual(path, "/lineitems/1/scores")
+        self.assertEqual((score["scoreGiven"], score["scoreMaximum"]), (7, 10))
+        self.assertEqual(score["userId"], "lms-user-1")
+        self.assertEqual(self.platform.lineitems[0]["tag"], str(self.exercise.id))
+
+        # Later gradings are queued again
+        self.assertEqual(len(self.grade(1)), 1)
+
+    def test_grading_after_task_start_is_queued(self):
+        key, = self.grade(1)[0]
+        # The task has read the queued score, but not the points yet
+        self.assertIsNotNone(ags.take_queued_score(key))
+        self.assertEqual(self.grade(1), [(key,)])
+        self.assertEqual(self.grade(1), [])
+
+    def test_token_and_lineitem_are_reused(self):
+        for _ in range(3):
+            key, = self.grade(1)[0]
+            self.publish(key)
+        self.assertEqual(len(self.platform.scores), 3)
+        self.assertEqual(self.platform.count("POST", "/token"), 1)
+        self.assertEqual(self.platform.count("GET", "/lineitems"), 1)
+        self.assertEqual(self.platform.count("POST", "/lineitems"), 1)
+
+    def test_failures_are_retried(self):
+        key, = self.grade(1)[0]
+        self.platform.score_status = 503
+        # Called directly, the task raises the error instead of retrying later
+        retry_error = LtiServiceException(Mock(status_code=503))
+        with self.assertRaises(LtiServiceException), \
+                patch.object(publish_lti_points, 'retry', side_effect=retry_error) as retry:
+            self.publish(key)
+        self.assertEqual(retry.call_args.kwargs["kwargs"]["score"]["sub"], "lms-user-1")
+
+        self.platform.score_status = 200
+        self.publish(key, score=retry.call_args.kwargs["kwargs"]["score"])
+        self.assertEqual(len(self.platform.scores), 1)
+
+    def test_client_errors_are_not_retried(self):
+        key, = self.grade(1)[0]
+        self.platform.score_status = 400
+        with patch.object(publish_lti_points, 'retry') as retry, \
+                self.assertLogs('aplus.lti_tool', 'ERROR'):
+            self.publish(key)
+        retry.assert_not_called()
+        self.assertEqual(self.platform.scores, [])
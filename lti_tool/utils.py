@@ -2,15 +2,13 @@ import logging
 from typing import Any, Optional, Tuple
 
 from django.conf import settings
-from django.contrib.auth.models import User
 from django.http.request import HttpRequest
-from pylti1p3.grade import Grade
 from pylti1p3.contrib.django import DjangoMessageLaunch, DjangoCacheDataStorage, DjangoDbToolConf
-from pylti1p3.lineitem import LineItem
 from pylti1p3.message_launch import TLaunchData
-from pylti1p3.exception import LtiException, LtiServiceException
+from pylti1p3.exception import LtiException
 
 from course.models import CourseInstance
+from lib.http_pool import get_session
 
 
 logger = logging.getLogger('aplus.lti_tool')
@@ -31,6 +29,10 @@ def get_tool_conf():
 def get_launch_data_storage():
     return DjangoCacheDataStorage()
 
+def get_requests_session():
+    # Keep the connections to the platforms open between launches
+    return get_session()
+
 def parse_lti_session_params(
         request: HttpRequest,
         ) -> Tuple[Optional[DjangoMessageLaunch], Optional[TLaunchData]]:
@@ -44,6 +46,7 @@ def parse_lti_session_params(
             request,
             tool_conf,
             launch_data_storage=get_launch_data_storage(),
+            requests_session=get_requests_session(),
         )
     except LtiException:
         return None, None
@@ -70,8 +73,11 @@ def has_lti_access_to_course(
     )
 
 def send_lti_points(request, submission):
-    from exercise.cache.points import ExercisePoints # pylint: disable=import-outside-toplevel
-    exercise = submission.exercise
+    """
+    Queues the best points of the submitter in the exercise to be sent to the
+    LTI platform the submission was launched from. See lti_tool/ags.py.
+    """
+    from .ags import AGS_ENDPOINT_CLAIM, get_client_id, queue_score # pylint: disable=import-outside-toplevel
     request.COOKIES['lti1p3-session-id'] = submission.meta_data.get('lti-session-id')
     try:
         launch = DjangoMessageLaunch.from_cache(
@@ -79,6 +85,7 @@ def send_lti_points(request, submission):
             request,
             get_tool_conf(),
             launch_data_storage=get_launch_data_storage(),
+            requests_session=get_requests_session(),
         )
     except LtiException:
         logger.warning(
@@ -90,51 +97,26 @@ def send_lti_points(request, submission):
         )
         return
 
+    launch_data = launch.get_launch_data()
     try:
-        username = launch.get_launch_data()['https://purl.imsglobal.org/spec/lti/claim/ext']['user_username']
+        username = launch_data['https://purl.imsglobal.org/spec/lti/claim/ext']['user_username']
     except (KeyError, TypeError):
-        username = launch.get_launch_data()['email']
+        username = launch_data['email']
 
-    try:
-        user = User.objects.get(username=username)
-    except User.DoesNotExist:
-        logger.warning("Tried to send LTI points for a non-existing user '%s'.", username)
+    endpoint = launch_data.get(AGS_ENDPOINT_CLAIM)
+    if not endpoint:
+        logger.warning(
+            "Failed to send LTI points for submission id '%s' "
+            "because the platform did not grant access to the grade service.",
+            submission.pk,
+        )
         return
 
-    # Moodle does not have gradebook entries for teachers - don't send result if submitter is a teacher
-    is_course_teacher = exercise.course_instance.is_teacher(user)
-    if not is_course_teacher:
-        entry = ExercisePoints.get(exercise, user)
-        best_submission = entry.best_submission
-        if best_submission is None:
-            return
-        ags = launch.get_ags()
-        grade = Grade()
-        (grade.set_score_given(best_submission.points)
-            .set_timestamp(best_submission.date.strftime('%Y-%m-%dT%H:%M:%S+0000'))
-            .set_score_maximum(exercise.max_points)
-            .set_activity_progress('Completed')
-            .set_grading_progress('FullyGraded')
-            .set_user_id(launch.get_launch_data().get('sub')))
-        line_item = LineItem()
-        line_item.set_tag(str(submission.exercise.id))
-        try:
-            ags.put_grade(grade, line_item)
-        except LtiServiceException as exc:
-            # At least Moodle sends a 409 when trying to save
-            # a grade with same timestamp as an existing grade
-            if exc.response.status_code == 409:
-                logger.info("Grade for submission has already been saved through LTI; continuing")
-            else:
-                logger.exception(
-                    "LTI Tool could not send grade to the Platform. "
-                    "Tool user id: %s. Tool exercise id: %s. "
-                    "Grade userId: %s. Grade timestamp: %s. "
-                    "Line item id: %s. Line item tag: %s. ",
-                    str(user.pk),
-                    str(exercise.pk),
-                    str(grade.get_user_id()),
-                    str(grade.get_timestamp()),
-                    str(line_item.get_id()),
-                    str(line_item.get_tag()),
-                )
+    queue_score({
+        'iss': launch_data['iss'],
+        'client_id': get_client_id(launch_data),
+        'sub': launch_data.get('sub'),
+        'username': username,
+        'endpoint': endpoint,
+        'exercise_id': submission.exercise.id,
+    })
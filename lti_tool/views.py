@@ -30,6 +30,7 @@ from .utils import (
     get_tool_conf,
     get_launch_data_storage,
     get_launch_url,
+    get_requests_session,
     parse_lti_session_params,
 )
 
@@ -57,7 +58,12 @@ class LtiLaunchView(BaseRedirectView):
     def post(self, request, *args, **kwargs):
         tool_conf = get_tool_conf()
         launch_data_storage = get_launch_data_storage()
-        message_launch = DjangoMessageLaunch(self.request, tool_conf, launch_data_storage=launch_data_storage)
+        message_launch = DjangoMessageLaunch(
+            self.request,
+            tool_conf,
+            launch_data_storage=launch_data_storage,
+            requests_session=get_requests_session(),
+        )
         self.message_launch_data = message_launch.get_launch_data()
 
         # Get or create user